@@ -0,0 +1,880 @@
+import itertools
+import json
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from idempotencia import TAMANHO_MAXIMO_CHAVE, ChaveReutilizada, IdempotencyCache
+from journal import OrderJournal
+from load_shedding import AdaptiveConcurrencyLimiter, Sobrecarga, TrafficClass
+from metrics import CONTENT_TYPE, REGISTRO, MetricsRegistry, exportar
+from models import StatusPedido, TransicaoInvalida
+from repository import PedidoRepository, ProdutoRepository
+from service import PedidoService, PedidoServiceAsync, ProdutoService, ProdutoServiceAsync
+from shared_catalog import SharedMemoryCatalog
+from storage import InMemoryStorage, LockProfiler, SQLiteStorage
+
+# Rotas e regras da API independentes do framework HTTP. O app Flask (app.py) e
+# o app assíncrono (app_asgi.py) só traduzem requisição e resposta e despacham
+# para a mesma tabela de rotas (ROTAS), então as duas variantes aceitam os
+# mesmos parâmetros e respondem com os mesmos corpos.
+
+# Campos de produto expostos pela API, na ordem usada quando fields= é omitido.
+CAMPOS_PRODUTO = ("id", "nome", "preco", "estoque")
+
+# Máximo de ids aceitos em GET /produtos?ids=..., para limitar o custo de uma
+# única requisição.
+MAXIMO_IDS_POR_BUSCA = 100
+TAMANHO_PADRAO_PAGINA = 100
+TAMANHO_MAXIMO_PAGINA = 1000
+
+# Limite de pedidos por lote: mantém o tempo de uma única requisição (e a
+# resposta) limitado, já que o lote inteiro conta como uma chamada no limiter.
+TAMANHO_MAXIMO_LOTE = 500
+
+
+# Acima deste tamanho de catálogo a listagem completa não é guardada em cache
+# (o corpo inteiro em memória cresceria com o catálogo): a resposta é transmitida
+# em partes de TAMANHO_PARTE_JSON produtos.
+MAXIMO_PRODUTOS_EM_CACHE = 10_000
+TAMANHO_PARTE_JSON = 500
+
+# Mesmas opções do jsonify do Flask fora do modo debug, para que as respostas
+# das duas variantes (e as transmitidas em partes) tenham bytes idênticos.
+_codificar = json.JSONEncoder(separators=(",", ":"), sort_keys=True).encode
+
+
+def json_compacto(obj) -> bytes:
+    return (_codificar(obj) + "\n").encode()
+
+
+def json_em_partes(itens: Iterable, para_dict: Callable, tamanho_parte: int = TAMANHO_PARTE_JSON) -> Iterator[bytes]:
+    """Lista JSON de para_dict(item), codificada e entregue a cada tamanho_parte itens.
+
+    Concatenadas, as partes são iguais a json_compacto da lista inteira; nem a
+    lista de dicts nem o corpo completo chegam a existir em memória.
+    """
+    abertura = "["
+    parte = []
+    for item in itens:
+        parte.append(_codificar(para_dict(item)))
+        if len(parte) == tamanho_parte:
+            yield (abertura + ",".join(parte)).encode()
+            abertura = ","
+            parte.clear()
+    if parte:
+        yield (abertura + ",".join(parte)).encode()
+        abertura = ","
+    yield b"[]\n" if abertura == "[" else b"]\n"
+
+
+def _storage_em_memoria() -> InMemoryStorage:
+    # BF_PERFIL_DE_LOCKS=1 liga o profiler de contenção do lock de cada storage
+    # em memória (relatório em GET /admin/locks). Desligado, o lock não mede nada
+    # além da espera exposta em /metrics.
+    if os.environ.get("BF_PERFIL_DE_LOCKS") == "1":
+        return InMemoryStorage(lock_profiler=LockProfiler())
+    return InMemoryStorage()
+
+
+def criar_storages():
+    """Storages de produtos e pedidos conforme BF_STORAGE (memoria, sqlite ou shm)."""
+    backend = os.environ.get("BF_STORAGE", "memoria")
+    if backend == "memoria":
+        return _storage_em_memoria(), _storage_em_memoria()
+    if backend == "sqlite":
+        # Um único arquivo com uma tabela por entidade. Todos os workers que
+        # apontam para o mesmo arquivo compartilham catálogo, estoque e pedidos.
+        caminho = os.environ.get("BF_SQLITE_PATH", "bfshop.db")
+        return SQLiteStorage(caminho, "produtos"), SQLiteStorage(caminho, "pedidos")
+    if backend == "shm":
+        # Catálogo e estoque num bloco de memória compartilhada entre os workers
+        # da mesma máquina; pedidos continuam em memória, por worker.
+        nome = os.environ.get("BF_SHM_NAME", "bfshop_catalogo")
+        return SharedMemoryCatalog(nome), _storage_em_memoria()
+    raise ValueError(f"BF_STORAGE desconhecido: {backend}")
+
+
+# Rotas da classe de tráfego "checkout" (receita); todas as demais são "catalogo".
+# Os nomes são os das funções de rota (Rota.nome, ver ROTAS).
+ROTAS_DE_CHECKOUT = frozenset({
+    "adicionar_carrinho",
+    "criar_pedido",
+    "criar_pedidos_em_lote",
+    "confirmar_pedido",
+    "cancelar_pedido",
+})
+
+
+def classe_de_trafego(rota: str) -> str:
+    return "checkout" if rota in ROTAS_DE_CHECKOUT else "catalogo"
+
+
+def criar_limitador_de_concorrencia() -> AdaptiveConcurrencyLimiter:
+    # Por processo, como a capacidade que ele mede: cada worker descobre o
+    # próprio limite pela latência das próprias requisições.
+    espera_maxima = float(os.environ.get("BF_ESPERA_MAXIMA_MS", "50")) / 1000
+    return AdaptiveConcurrencyLimiter(
+        initial_limit=int(os.environ.get("BF_CONCORRENCIA_INICIAL", "32")),
+        max_limit=int(os.environ.get("BF_CONCORRENCIA_MAXIMA", "1024")),
+        latency_target=float(os.environ.get("BF_LATENCIA_ALVO_MS", "100")) / 1000,
+        max_queue_delay=espera_maxima,
+        # Checkout é atendido antes e pode ocupar todas as vagas. Catálogo fica
+        # com até 70% delas (os outros 30% estão sempre livres para pedidos),
+        # fila menor e metade da espera: sob saturação, é ele que recebe os 503.
+        classes=(
+            TrafficClass("checkout", priority=1, share=1.0, max_queue=256),
+            TrafficClass("catalogo", priority=0, share=0.7, max_queue=128, max_queue_delay=espera_maxima / 2),
+        ),
+    )
+
+
+def uri_do_limiter() -> str:
+    """Storage do rate limiting: BF_LIMITER_URI, padrão memory:// (contadores por processo).
+
+    Com vários workers, bfmmap:///caminho/arquivo compartilha os contadores entre
+    eles num arquivo mapeado em memória (ver limiter_storage.py).
+    """
+    return os.environ.get("BF_LIMITER_URI", "memory://")
+
+
+def criar_journal() -> Optional[OrderJournal]:
+    """Journal de pedidos em BF_PEDIDOS_JOURNAL, se definido; cada processo precisa do seu arquivo."""
+    caminho = os.environ.get("BF_PEDIDOS_JOURNAL")
+    if not caminho:
+        return None
+    janela_ms = float(os.environ.get("BF_JOURNAL_JANELA_MS", "2"))
+    return OrderJournal(caminho, batch_window=janela_ms / 1000)
+
+
+def criar_cache_de_idempotencia() -> IdempotencyCache:
+    # Por processo: com vários workers, uma repetição que cai em outro worker
+    # não é reconhecida. Os clientes repetem em milissegundos, normalmente na
+    # mesma conexão keep-alive, então o caso comum fica coberto.
+    return IdempotencyCache(
+        max_entries=int(os.environ.get("BF_IDEMPOTENCIA_MAX", "10000")),
+        ttl=float(os.environ.get("BF_IDEMPOTENCIA_TTL_S", "3600")),
+    )
+
+
+def ler_chave_de_idempotencia(valor: Optional[str]) -> Optional[str]:
+    """Valor do header Idempotency-Key, ou None se ausente."""
+    if valor is None:
+        return None
+    if not valor or len(valor) > TAMANHO_MAXIMO_CHAVE:
+        raise ValueError(f"Idempotency-Key deve ter de 1 a {TAMANHO_MAXIMO_CHAVE} caracteres")
+    return valor
+
+
+LATENCIA_DE_ROTA = "bfshop_requisicao_latencia_segundos"
+REQUISICOES = "bfshop_requisicoes_total"
+
+
+def criar_metricas(storages: Mapping[str, object]) -> MetricsRegistry:
+    """Métricas do app: requisições por rota e espera nos locks dos storages.
+
+    As latências da camada de serviço ficam em metrics.REGISTRO, do processo.
+    """
+    metricas = MetricsRegistry()
+
+    def locks():
+        for nome, storage in storages.items():
+            # Só o InMemoryStorage tem um lock do processo inteiro; sqlite e shm
+            # sincronizam por item ou fora do processo.
+            if not hasattr(storage, "estatisticas_de_lock"):
+                continue
+            lock = storage.estatisticas_de_lock()
+            rotulos = {"storage": nome}
+            yield ("bfshop_storage_lock_aquisicoes_total", "counter",
+                   "Aquisições do lock do storage em memória.", rotulos, lock["aquisicoes"])
+            yield ("bfshop_storage_lock_esperas_total", "counter",
+                   "Aquisições que encontraram o lock do storage ocupado.", rotulos, lock["esperas"])
+            yield ("bfshop_storage_lock_espera_segundos_total", "counter",
+                   "Tempo total de espera pelo lock do storage.", rotulos, lock["tempo_de_espera_s"])
+
+    metricas.registrar_coletor(locks)
+    return metricas
+
+
+def relatorio_de_locks(storages: Mapping[str, object]) -> Optional[dict]:
+    """Relatório de contenção de cada storage com profiler de locks; None se nenhum tem."""
+    relatorios = {
+        nome: storage.lock_profiler.relatorio()
+        for nome, storage in storages.items()
+        if getattr(storage, "lock_profiler", None) is not None
+    }
+    return relatorios or None
+
+
+def registrar_requisicao(metricas: MetricsRegistry, rota: str, status: int, duracao: Optional[float]) -> None:
+    """Conta a resposta e, se a requisição chegou à rota, registra a duração dela."""
+    metricas.contador(REQUISICOES, "Respostas por rota e status.", rota=rota, status=str(status)).incrementar()
+    # Recusas do rate limit e do load shedding (duracao None) saem em
+    # microssegundos: entrariam nos quantis justamente no pico e os puxariam
+    # para baixo. Ficam só no contador, com o status 429/503.
+    if duracao is not None:
+        metricas.histograma(
+            LATENCIA_DE_ROTA,
+            "Latência das requisições admitidas, incluindo a espera na fila do load shedding.",
+            rota=rota,
+        ).registrar(duracao)
+
+
+def vendas_parciais_por_worker(produto_storage, pedido_storage) -> bool:
+    """Catálogo compartilhado entre workers, mas pedidos guardados em cada um.
+
+    É o caso de BF_STORAGE=shm: o relatório de vendas de um worker mostraria só
+    parte das vendas de um estoque que é de todos, e um total diferente a cada
+    worker que respondesse. GET /relatorios/vendas responde 501 nessa combinação.
+    """
+    return isinstance(produto_storage, SharedMemoryCatalog) and not hasattr(pedido_storage, "insert_many")
+
+
+ERRO_VENDAS_PARCIAIS = "relatório de vendas indisponível com BF_STORAGE=shm: cada worker só vê os próprios pedidos"
+
+
+def semear_catalogo(produto_service) -> None:
+    # Um storage durável ou compartilhado pode já ter o catálogo (restart, ou
+    # outro worker que subiu antes): semear de novo sobrescreveria o estoque.
+    # Verificação e carga sob o lock entre processos do storage, senão dois
+    # workers subindo juntos veriam o catálogo vazio e semeariam os dois.
+    storage = produto_service.repository.storage
+    lock = storage.bootstrap_lock() if hasattr(storage, "bootstrap_lock") else nullcontext()
+    with lock:
+        if produto_service.repository.find_page(None, 1):
+            return
+        for i in range(1, 51):
+            produto_service.cadastrar_produto(
+                nome=f"Produto Black Friday {i:02d}",
+                preco=round(10.0 + i * 2.5, 2),
+                estoque=1000,
+            )
+
+
+def produto_para_dict(produto, campos=CAMPOS_PRODUTO) -> dict:
+    return {campo: getattr(produto, campo) for campo in campos}
+
+
+def pedido_para_dict(pedido) -> dict:
+    return {
+        "id": pedido.id,
+        "total": pedido.total,
+        "status": pedido.status.value,
+        "itens": [
+            {"produto_id": i.produto_id, "quantidade": i.quantidade, "preco_unitario": i.preco_unitario}
+            for i in pedido.itens
+        ],
+    }
+
+
+def ler_campos(parametro: Optional[str]) -> Tuple[str, ...]:
+    if parametro is None:
+        return CAMPOS_PRODUTO
+    campos = tuple(dict.fromkeys(c.strip() for c in parametro.split(",")))
+    desconhecidos = [c for c in campos if c not in CAMPOS_PRODUTO]
+    if desconhecidos:
+        raise ValueError(f"fields inválido: {', '.join(desconhecidos)}")
+    return campos
+
+
+def ler_ids(parametro: str) -> List[int]:
+    try:
+        # dict.fromkeys remove ids repetidos preservando a ordem pedida.
+        ids = list(dict.fromkeys(int(id) for id in parametro.split(",")))
+    except ValueError:
+        raise ValueError("ids deve ser uma lista de inteiros separados por vírgula")
+    if len(ids) > MAXIMO_IDS_POR_BUSCA:
+        raise ValueError(f"máximo de {MAXIMO_IDS_POR_BUSCA} ids por busca")
+    return ids
+
+
+def ler_inteiro(parametro, nome: str, minimo: int, maximo: int) -> int:
+    try:
+        valor = int(parametro)
+    except ValueError:
+        raise ValueError(f"{nome} deve ser um inteiro")
+    if not minimo <= valor <= maximo:
+        raise ValueError(f"{nome} deve estar entre {minimo} e {maximo}")
+    return valor
+
+
+@dataclass
+class ConsultaProdutos:
+    campos: Tuple[str, ...] = CAMPOS_PRODUTO
+    ids: Optional[List[int]] = None
+    # limite None indica listagem sem paginação.
+    limite: Optional[int] = None
+    cursor: Optional[int] = None
+
+
+def ler_consulta_produtos(args: Mapping[str, str]) -> ConsultaProdutos:
+    """Interpreta a query string de GET /produtos; parâmetros inválidos geram ValueError."""
+    consulta = ConsultaProdutos(campos=ler_campos(args.get("fields")))
+    if "ids" in args:
+        consulta.ids = ler_ids(args["ids"])
+    if "limit" in args or "cursor" in args:
+        consulta.limite = ler_inteiro(
+            args.get("limit", TAMANHO_PADRAO_PAGINA), "limit", 1, TAMANHO_MAXIMO_PAGINA
+        )
+        if "cursor" in args:
+            consulta.cursor = ler_inteiro(args["cursor"], "cursor", 0, 2**63 - 1)
+    return consulta
+
+
+def ler_preco(parametro, nome: str) -> float:
+    try:
+        valor = float(parametro)
+    except ValueError:
+        raise ValueError(f"{nome} deve ser um número")
+    if not 0 <= valor < float("inf"):
+        raise ValueError(f"{nome} deve ser um número não negativo")
+    return valor
+
+
+@dataclass
+class ConsultaBusca:
+    termo: Optional[str] = None
+    preco_min: Optional[float] = None
+    preco_max: Optional[float] = None
+    limite: int = TAMANHO_PADRAO_PAGINA
+    campos: Tuple[str, ...] = CAMPOS_PRODUTO
+
+
+def ler_consulta_busca(args: Mapping[str, str]) -> ConsultaBusca:
+    """Interpreta a query string de GET /produtos/busca; parâmetros inválidos geram ValueError."""
+    consulta = ConsultaBusca(campos=ler_campos(args.get("fields")))
+    consulta.termo = args.get("q", "").strip() or None
+    if "preco_min" in args:
+        consulta.preco_min = ler_preco(args["preco_min"], "preco_min")
+    if "preco_max" in args:
+        consulta.preco_max = ler_preco(args["preco_max"], "preco_max")
+    # Sem nenhum filtro a busca seria a listagem inteira, que já tem rota própria.
+    if consulta.termo is None and consulta.preco_min is None and consulta.preco_max is None:
+        raise ValueError("informe q, preco_min ou preco_max")
+    if None not in (consulta.preco_min, consulta.preco_max) and consulta.preco_min > consulta.preco_max:
+        raise ValueError("preco_min não pode ser maior que preco_max")
+    if "limit" in args:
+        consulta.limite = ler_inteiro(args["limit"], "limit", 1, TAMANHO_MAXIMO_PAGINA)
+    return consulta
+
+
+def ler_consulta_pedidos(args: Mapping[str, str]) -> Tuple[StatusPedido, int]:
+    """Status e limite de GET /pedidos; parâmetros inválidos geram ValueError."""
+    if "status" not in args:
+        raise ValueError("status é obrigatório")
+    try:
+        status = StatusPedido(args["status"].upper())
+    except ValueError:
+        validos = ", ".join(s.value for s in StatusPedido)
+        raise ValueError(f"status inválido; use um de: {validos}")
+    limite = ler_inteiro(args.get("limit", TAMANHO_PADRAO_PAGINA), "limit", 1, TAMANHO_MAXIMO_PAGINA)
+    return status, limite
+
+
+def _inteiro(valor) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def _item_valido(item) -> bool:
+    return isinstance(item, dict) and _inteiro(item.get("produto_id")) and _inteiro(item.get("quantidade"))
+
+
+def pedido_do_lote_valido(pedido) -> bool:
+    # A mesma forma que PedidoService._montar_pedido lê: itens é uma lista de
+    # objetos com produto_id e quantidade inteiros. Quantidade <= 0 é regra de
+    # negócio e continua sendo recusada pelo serviço, com 422.
+    if not isinstance(pedido, dict) or not isinstance(pedido.get("itens"), list):
+        return False
+    return all(_item_valido(item) for item in pedido["itens"])
+
+
+def resultados_do_lote(pedidos: list, criados: list) -> List[dict]:
+    # Remonta a resposta na ordem do lote: entradas malformadas recebem 400 na
+    # própria posição; as válidas (na mesma ordem em que foram enviadas ao
+    # serviço) recebem 201 com o pedido ou 422 com o motivo da recusa.
+    criados = iter(criados)
+    resultados = []
+    for pedido in pedidos:
+        if not pedido_do_lote_valido(pedido):
+            resultados.append({
+                "status": 400,
+                "erro": "itens é obrigatório e cada item deve ter produto_id e quantidade inteiros",
+            })
+            continue
+        resultado = next(criados)
+        if isinstance(resultado, ValueError):
+            resultados.append({"status": 422, "erro": str(resultado)})
+        else:
+            resultados.append({"status": 201, "pedido": pedido_para_dict(resultado)})
+    return resultados
+
+
+class Requisicao:
+    """O que as rotas leem da requisição, extraído pelo front end (Flask ou ASGI).
+
+    headers é consultado com nomes em minúsculas; json() devolve o corpo
+    decodificado, ou None se ausente ou inválido.
+    """
+
+    def __init__(self, args: Mapping[str, str], headers: Mapping[str, str], json: Callable[[], object]):
+        self.args = args
+        self.headers = headers
+        self.json = json
+
+
+class Resposta:
+    """Resposta de uma rota, convertida pelo front end para o seu formato.
+
+    corpo é serializado como JSON e bruto vai como está; partes é um iterável de
+    bytes transmitido em várias mensagens, sem content-length (transfer-encoding
+    chunked). Com partes, o front end chama ao_terminar depois da última parte
+    enviada (ou do envio interrompido).
+    """
+
+    def __init__(
+        self,
+        status: int = 200,
+        corpo=None,
+        headers: Optional[dict] = None,
+        bruto: Optional[bytes] = None,
+        partes: Optional[Iterable[bytes]] = None,
+        content_type: str = "application/json",
+    ):
+        self.status = status
+        self.corpo = corpo
+        self.headers = dict(headers or {})
+        self.bruto = bruto
+        self.partes = partes
+        self.content_type = content_type
+        self.ao_terminar: Optional[Callable[[], None]] = None
+
+
+def concluir(corrotina: Awaitable):
+    """Resultado de uma corrotina que termina sem suspender (as rotas, no app Flask)."""
+    try:
+        corrotina.send(None)
+    except StopIteration as fim:
+        return fim.value
+    corrotina.close()
+    raise RuntimeError("rota suspensa fora de um event loop")
+
+
+class _ChamadasSincronas:
+    # Os métodos síncronos de um serviço, como corrotinas que terminam sem
+    # suspender: as rotas fazem await em ambos os apps e o Flask as roda com
+    # concluir(), na thread da requisição.
+    def __init__(self, servico):
+        self._servico = servico
+
+    def __getattr__(self, nome: str):
+        metodo = getattr(self._servico, nome)
+
+        async def chamar(*args):
+            return metodo(*args)
+        return chamar
+
+
+class _ChamadasAssincronas:
+    # As variantes _async de ProdutoServiceAsync e PedidoServiceAsync.
+    def __init__(self, servico):
+        self._servico = servico
+
+    def __getattr__(self, nome: str):
+        return getattr(self._servico, f"{nome}_async")
+
+
+class Api:
+    """Estado de uma instância da API: serviços, caches e controles de carga.
+
+    As rotas chamam as operações com latência de banco por self.produtos e
+    self.pedidos (await api.produtos.buscar_produto(id)); aqui elas são os
+    métodos síncronos dos serviços, e ApiAssincrona troca pelos _async.
+    """
+
+    _chamadas = _ChamadasSincronas
+
+    def __init__(self, produto_service: ProdutoService, pedido_service: PedidoService):
+        self.produto_service = produto_service
+        self.pedido_service = pedido_service
+        self.produto_repo = produto_service.repository
+        self.pedido_repo = pedido_service.pedido_repo
+        self.produtos = self._chamadas(produto_service)
+        self.pedidos = self._chamadas(pedido_service)
+        # Latência e contagem por rota e espera nos locks dos storages (GET /metrics).
+        self.storages = {"produtos": self.produto_repo.storage, "pedidos": self.pedido_repo.storage}
+        self.metricas = criar_metricas(self.storages)
+        # Respostas de POST /pedidos por Idempotency-Key (BF_IDEMPOTENCIA_MAX
+        # entradas, BF_IDEMPOTENCIA_TTL_S segundos).
+        self.idempotencia = criar_cache_de_idempotencia()
+        # Limite de concorrência adaptativo na frente dos serviços (load_shedding.py).
+        self.limitador = criar_limitador_de_concorrencia()
+        # Resposta de GET /produtos já serializada: (versão do catálogo, corpo
+        # JSON, etag). É substituída por inteiro numa única atribuição, então
+        # leitores concorrentes sempre enxergam uma tupla consistente sem lock.
+        self._cache_listagem = None
+
+    async def admitir(self, classe: str) -> float:
+        return self.limitador.acquire(classe)
+
+    async def executar_uma_vez(self, chave: str, corpo, operacao: Callable[[], Awaitable]):
+        # A operação roda inteira dentro de executar, sob o Event da chave.
+        return self.idempotencia.executar(chave, corpo, lambda: concluir(operacao()))
+
+    def listagem_em_cache(self, versao: int):
+        cache = self._cache_listagem
+        if cache is not None and cache[0] == versao:
+            return cache
+        return None
+
+    def guardar_listagem(self, versao: int, produtos):
+        # O custo da serialização é pago uma vez por versão do catálogo.
+        cache = (versao, json_compacto([produto_para_dict(p) for p in produtos]), f"produtos-v{versao}")
+        self._cache_listagem = cache
+        return cache
+
+
+class ApiAssincrona(Api):
+    """Api do app ASGI: as esperas (fila do load shedding, latência simulada,
+    repetições com Idempotency-Key) suspendem só a corrotina, sem ocupar o
+    event loop."""
+
+    _chamadas = _ChamadasAssincronas
+
+    async def admitir(self, classe: str) -> float:
+        return await self.limitador.acquire_async(classe)
+
+    async def executar_uma_vez(self, chave: str, corpo, operacao: Callable[[], Awaitable]):
+        return await self.idempotencia.executar_async(chave, corpo, operacao)
+
+
+def criar_api(assincrona: bool = False) -> Api:
+    """Api sobre os storages escolhidos na inicialização, com o catálogo semeado.
+
+    BF_STORAGE seleciona o backend:
+      memoria (padrão) — dicts em memória, estado próprio de cada processo;
+      sqlite — arquivo BF_SQLITE_PATH, durável e compartilhado entre workers;
+      shm — catálogo em memória compartilhada (BF_SHM_NAME), lido sem IPC por
+            todos os workers da máquina; pedidos ficam em memória por worker
+            (por isso GET /relatorios/vendas responde 501 nesse modo).
+    """
+    produto_storage, pedido_storage = criar_storages()
+    produto_repo = ProdutoRepository(produto_storage)
+    # Com BF_PEDIDOS_JOURNAL, cada pedido aceito é gravado num log com group
+    # commit antes de a resposta sair, e o log é relido no próximo start.
+    pedido_repo = PedidoRepository(pedido_storage, journal=criar_journal())
+    if assincrona:
+        api = ApiAssincrona(ProdutoServiceAsync(produto_repo), PedidoServiceAsync(produto_repo, pedido_repo))
+    else:
+        api = Api(ProdutoService(produto_repo), PedidoService(produto_repo, pedido_repo))
+    semear_catalogo(api.produto_service)
+    return api
+
+
+# Limite de rate limiting por IP e por rota, nas rotas com limitada=True.
+LIMITE_POR_ROTA = "100 per minute"
+
+
+@dataclass(frozen=True)
+class Rota:
+    metodo: str
+    # No formato do Flask, com conversor: /pedidos/<int:id>/confirmar.
+    caminho: str
+    handler: Callable[..., Awaitable[Resposta]]
+    # Sujeita ao rate limit (LIMITE_POR_ROTA), aplicado pelo front end.
+    limitada: bool = True
+    # Passa pelo limite de concorrência adaptativo. Health check e rotas de
+    # diagnóstico ficam de fora: precisam responder justamente quando o
+    # servidor está saturado.
+    load_shedding: bool = True
+
+    @property
+    def nome(self) -> str:
+        return self.handler.__name__
+
+
+# Tabela de rotas dos dois apps, preenchida pelo decorator @rota abaixo.
+ROTAS: List[Rota] = []
+
+
+def rota(metodo: str, caminho: str, limitada: bool = True, load_shedding: bool = True):
+    def registrar(handler):
+        ROTAS.append(Rota(metodo, caminho, handler, limitada, load_shedding))
+        return handler
+    return registrar
+
+
+async def atender(api: Api, rota: Rota, req: Requisicao, parametros: Mapping[str, object]) -> Resposta:
+    """Executa a rota sob o load shedding e registra a resposta nas métricas.
+
+    O rate limit é aplicado antes, pelo front end: requisições já recusadas com
+    429 não ocupam vaga.
+    """
+    # A duração medida inclui a espera na fila do load shedding: é o que o
+    # cliente sente.
+    inicio = time.perf_counter()
+    admitida_em = classe = None
+    if rota.load_shedding:
+        classe = classe_de_trafego(rota.nome)
+        try:
+            admitida_em = await api.admitir(classe)
+        except Sobrecarga as e:
+            registrar_requisicao(api.metricas, rota.nome, 503, None)
+            return Resposta(503, {"erro": "servidor sobrecarregado, tente novamente"},
+                            headers={"Retry-After": str(e.retry_after)})
+
+    def terminar(status: int) -> None:
+        if admitida_em is not None:
+            api.limitador.release(admitida_em, classe)
+        registrar_requisicao(api.metricas, rota.nome, status, time.perf_counter() - inicio)
+
+    try:
+        resposta = await rota.handler(api, req, **parametros)
+    except BaseException:
+        terminar(500)
+        raise
+    if resposta.partes is None:
+        terminar(resposta.status)
+    else:
+        # O corpo em partes só é produzido depois que a rota retorna, enquanto o
+        # front end envia: vaga e latência valem até a última parte, senão a
+        # parte lenta da requisição ficaria fora do load shedding e das métricas.
+        resposta.ao_terminar = lambda: terminar(resposta.status)
+    return resposta
+
+
+def _erro(status: int, mensagem: str) -> Resposta:
+    return Resposta(status, {"erro": mensagem})
+
+
+def _etag(valor: str) -> dict:
+    return {"ETag": f'"{valor}"'}
+
+
+def _nao_modificado(req: Requisicao, etag: str) -> Optional[Resposta]:
+    # If-None-Match é resolvido só com a versão do catálogo, antes de qualquer
+    # chamada ao serviço (e à sua latência simulada de banco). Comparação forte:
+    # só etags exatamente iguais (ou "*") valem.
+    cabecalho = req.headers.get("if-none-match")
+    if cabecalho is None:
+        return None
+    candidatas = {c.strip() for c in cabecalho.split(",")}
+    if f'"{etag}"' in candidatas or "*" in candidatas:
+        return Resposta(304, headers=_etag(etag))
+    return None
+
+
+@rota("GET", "/saude", limitada=False, load_shedding=False)
+async def saude(api: Api, req: Requisicao) -> Resposta:
+    # Health checks de balanceadores de carga precisam sempre responder, mesmo
+    # quando o servidor está sob carga máxima.
+    return Resposta(corpo={"status": "ok"})
+
+
+@rota("GET", "/produtos")
+async def listar_produtos(api: Api, req: Requisicao) -> Resposta:
+    etag = f"produtos-v{api.produto_repo.version}"
+    nao_modificado = _nao_modificado(req, etag)
+    if nao_modificado is not None:
+        return nao_modificado
+
+    try:
+        consulta = ler_consulta_produtos(req.args)
+    except ValueError as e:
+        return _erro(400, str(e))
+
+    headers = _etag(etag)
+    if consulta.ids is not None:
+        produtos = await api.produtos.buscar_produtos(consulta.ids)
+    elif consulta.limite is not None:
+        produtos, proximo_cursor = await api.produtos.listar_produtos_paginado(consulta.limite, consulta.cursor)
+        if proximo_cursor is not None:
+            # O cursor vai em header para que todas as variantes de /produtos
+            # mantenham o mesmo formato de corpo (uma lista de produtos).
+            headers["X-Next-Cursor"] = str(proximo_cursor)
+    else:
+        # Listagem completa. A versão é lida ANTES dos dados: se uma escrita
+        # ocorrer no meio da leitura, o corpo fica mais novo que a versão
+        # registrada e a próxima requisição apenas reconstrói o cache — nunca
+        # serve dado velho como atual.
+        versao = api.produto_repo.version
+        completa = consulta.campos == CAMPOS_PRODUTO
+        cache = api.listagem_em_cache(versao) if completa else None
+        if cache is None:
+            # Uma página do tamanho máximo do cache: se ela cobre o catálogo, é
+            # a listagem inteira; senão o catálogo é grande demais para o cache.
+            produtos, cursor = await api.produtos.listar_produtos_paginado(MAXIMO_PRODUTOS_EM_CACHE)
+            if not completa or cursor is not None:
+                # O corpo é gerado enquanto é enviado, o resto do catálogo lido
+                # de TAMANHO_PARTE_JSON em TAMANHO_PARTE_JSON produtos: storages
+                # que desserializam a cada leitura (SQLite) nunca têm o catálogo
+                # inteiro em memória, e o primeiro byte sai depois da primeira parte.
+                restantes = () if cursor is None else api.produto_repo.iter_after(cursor, TAMANHO_PARTE_JSON)
+                campos = consulta.campos
+                partes = json_em_partes(itertools.chain(produtos, restantes), lambda p: produto_para_dict(p, campos))
+                return Resposta(headers=headers, partes=partes)
+            cache = api.guardar_listagem(versao, produtos)
+        # Caminho quente (listagem completa, sem parâmetros): corpo pré-serializado.
+        _, corpo, etag = cache
+        return Resposta(bruto=corpo, headers=_etag(etag))
+    return Resposta(corpo=[produto_para_dict(p, consulta.campos) for p in produtos], headers=headers)
+
+
+@rota("GET", "/produtos/busca")
+async def pesquisar_produtos(api: Api, req: Requisicao) -> Resposta:
+    # Busca por prefixo de palavra do nome (q) e/ou faixa de preço, respondida
+    # pelos índices secundários do storage em vez de varrer o catálogo.
+    try:
+        consulta = ler_consulta_busca(req.args)
+    except ValueError as e:
+        return _erro(400, str(e))
+    produtos = await api.produtos.pesquisar_produtos(
+        consulta.termo, consulta.preco_min, consulta.preco_max, consulta.limite
+    )
+    return Resposta(corpo=[produto_para_dict(p, consulta.campos) for p in produtos])
+
+
+@rota("GET", "/produtos/<int:id>")
+async def buscar_produto(api: Api, req: Requisicao, id: int) -> Resposta:
+    # A versão é global ao catálogo: mais grosseira que uma por produto (uma
+    # escrita em outro item também troca a etag), mas nunca responde 304 para
+    # um produto que mudou, e não exige ler o produto para validar.
+    etag = f"produto-{id}-v{api.produto_repo.version}"
+    nao_modificado = _nao_modificado(req, etag)
+    if nao_modificado is not None:
+        return nao_modificado
+    try:
+        produto = await api.produtos.buscar_produto(id)
+    except ValueError as e:
+        return _erro(404, str(e))
+    return Resposta(corpo=produto_para_dict(produto), headers=_etag(etag))
+
+
+@rota("POST", "/carrinho")
+async def adicionar_carrinho(api: Api, req: Requisicao) -> Resposta:
+    data = req.json()
+    if not data or "produto_id" not in data or "quantidade" not in data:
+        return _erro(400, "produto_id e quantidade são obrigatórios")
+    try:
+        produto = await api.produtos.buscar_produto(data["produto_id"])
+    except ValueError as e:
+        return _erro(404, str(e))
+    return Resposta(corpo={
+        "mensagem": "Item adicionado ao carrinho",
+        "produto_id": produto.id,
+        "quantidade": data["quantidade"],
+        "subtotal": round(produto.preco * data["quantidade"], 2),
+    })
+
+
+@rota("GET", "/pedidos")
+async def listar_pedidos(api: Api, req: Requisicao) -> Resposta:
+    try:
+        status, limite = ler_consulta_pedidos(req.args)
+    except ValueError as e:
+        return _erro(400, str(e))
+    pedidos = await api.pedidos.listar_pedidos_por_status(status, limite)
+    return Resposta(corpo=[pedido_para_dict(p) for p in pedidos])
+
+
+@rota("GET", "/relatorios/vendas")
+async def relatorio_de_vendas(api: Api, req: Requisicao) -> Resposta:
+    if vendas_parciais_por_worker(api.produto_repo.storage, api.pedido_repo.storage):
+        return _erro(501, ERRO_VENDAS_PARCIAIS)
+    # Agregados em memória, sem latência de banco: chamada síncrona nos dois apps.
+    return Resposta(corpo=api.pedido_service.relatorio_de_vendas())
+
+
+@rota("POST", "/pedidos")
+async def criar_pedido(api: Api, req: Requisicao) -> Resposta:
+    data = req.json()
+    if not data or "itens" not in data:
+        return _erro(400, "itens é obrigatório")
+    try:
+        chave = ler_chave_de_idempotencia(req.headers.get("idempotency-key"))
+    except ValueError as e:
+        return _erro(400, str(e))
+    if chave is None:
+        status, corpo = await _executar_pedido(api, data["itens"])
+        return Resposta(status, corpo)
+
+    # Com a chave, a resposta inteira (inclusive um 422 de estoque insuficiente)
+    # é guardada: a repetição recebe exatamente o que a original recebeu.
+    try:
+        (status, corpo), repetida = await api.executar_uma_vez(
+            chave, data, lambda: _executar_pedido(api, data["itens"])
+        )
+    except ChaveReutilizada as e:
+        return _erro(422, str(e))
+    return Resposta(status, corpo, headers={"Idempotent-Replayed": "true"} if repetida else None)
+
+
+async def _executar_pedido(api: Api, itens) -> Tuple[int, dict]:
+    try:
+        return 201, pedido_para_dict(await api.pedidos.criar_pedido(itens))
+    except ValueError as e:
+        return 422, {"erro": str(e)}
+
+
+@rota("GET", "/metrics", limitada=False, load_shedding=False)
+async def metricas(api: Api, req: Requisicao) -> Resposta:
+    # Fora do rate limit e do load shedding: o scraper do Prometheus consulta a
+    # cada poucos segundos, do mesmo IP, e é no pico que as métricas mais importam.
+    return Resposta(bruto=exportar(api.metricas, REGISTRO).encode(), content_type=CONTENT_TYPE)
+
+
+@rota("GET", "/admin/carga", load_shedding=False)
+async def estatisticas_de_carga(api: Api, req: Requisicao) -> Resposta:
+    return Resposta(corpo=api.limitador.estatisticas())
+
+
+@rota("GET", "/admin/idempotencia", load_shedding=False)
+async def estatisticas_de_idempotencia(api: Api, req: Requisicao) -> Resposta:
+    return Resposta(corpo=api.idempotencia.estatisticas())
+
+
+@rota("GET", "/admin/locks", load_shedding=False)
+async def contencao_de_locks(api: Api, req: Requisicao) -> Resposta:
+    relatorio = relatorio_de_locks(api.storages)
+    if relatorio is None:
+        return _erro(404, "profiler de locks desligado; inicie com BF_PERFIL_DE_LOCKS=1")
+    return Resposta(corpo=relatorio)
+
+
+@rota("POST", "/pedidos/lote")
+async def criar_pedidos_em_lote(api: Api, req: Requisicao) -> Resposta:
+    data = req.json()
+    # Um corpo JSON que não é objeto (lista, string, número) não tem "pedidos".
+    if not isinstance(data, dict) or not isinstance(data.get("pedidos"), list):
+        return _erro(400, "pedidos é obrigatório e deve ser uma lista")
+    if len(data["pedidos"]) > TAMANHO_MAXIMO_LOTE:
+        return _erro(400, f"lote excede o máximo de {TAMANHO_MAXIMO_LOTE} pedidos")
+
+    # Entradas malformadas recebem 400 na própria posição, sem derrubar o lote;
+    # só as válidas seguem para o serviço.
+    validos = [p["itens"] for p in data["pedidos"] if pedido_do_lote_valido(p)]
+    criados = await api.pedidos.criar_pedidos_em_lote(validos)
+    return Resposta(corpo={"resultados": resultados_do_lote(data["pedidos"], criados)})
+
+
+@rota("POST", "/pedidos/<int:id>/confirmar")
+async def confirmar_pedido(api: Api, req: Requisicao, id: int) -> Resposta:
+    return await _mudar_status(api.pedidos.confirmar_pedido, id)
+
+
+@rota("POST", "/pedidos/<int:id>/cancelar")
+async def cancelar_pedido(api: Api, req: Requisicao, id: int) -> Resposta:
+    # Devolve ao estoque as unidades do pedido.
+    return await _mudar_status(api.pedidos.cancelar_pedido, id)
+
+
+async def _mudar_status(transicao: Callable[[int], Awaitable], id: int) -> Resposta:
+    try:
+        return Resposta(corpo=pedido_para_dict(await transicao(id)))
+    except TransicaoInvalida as e:
+        # O pedido existe, mas o status atual não permite a transição
+        # (ex.: confirmar um pedido cancelado).
+        return _erro(409, str(e))
+    except ValueError as e:
+        return _erro(404, str(e))
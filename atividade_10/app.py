@@ -2,113 +2,91 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from storage import InMemoryStorage
-from repository import ProdutoRepository, PedidoRepository
-from service import ProdutoService, PedidoService
+import limiter_storage  # noqa: F401 — registra o esquema bfmmap:// no limits
+from api_comum import (
+    LIMITE_POR_ROTA,
+    ROTAS,
+    Requisicao,
+    Resposta,
+    Rota,
+    atender,
+    concluir,
+    criar_api,
+    registrar_requisicao,
+    uri_do_limiter,
+)
 
 app = Flask(__name__)
 
 limiter = Limiter(
     get_remote_address,
     app=app,
-    default_limits=["100 per minute"],
-    # memory:// mantém o estado de rate limiting no processo, sem depender de Redis.
-    # Funciona corretamente no test client do Flask, onde todas as chamadas
-    # compartilham o mesmo processo e são vistas como o mesmo IP.
-    storage_uri="memory://",
+    default_limits=[LIMITE_POR_ROTA],
+    # memory:// (padrão) mantém o estado de rate limiting no processo, sem depender
+    # de Redis, e funciona no test client do Flask, onde todas as chamadas
+    # compartilham o mesmo processo e são vistas como o mesmo IP. Com vários
+    # workers, BF_LIMITER_URI=bfmmap:///tmp/bfshop_limites.bin faz todos
+    # contarem na mesma tabela (limiter_storage.py).
+    storage_uri=uri_do_limiter(),
+    # Janela deslizante aproximada por dois contadores: sem a rajada de 2x o
+    # limite que a janela fixa permite na virada do minuto, e com o mesmo custo.
+    strategy="sliding-window-counter",
     # headers_enabled expõe Retry-After e X-RateLimit-* nas respostas 429,
     # exigido pelos testes de segurança para validar o comportamento do cliente.
     headers_enabled=True,
 )
 
-_produto_storage = InMemoryStorage()
-_pedido_storage = InMemoryStorage()
-_produto_repo = ProdutoRepository(_produto_storage)
-_pedido_repo = PedidoRepository(_pedido_storage)
-_produto_service = ProdutoService(_produto_repo)
-_pedido_service = PedidoService(_produto_repo, _pedido_repo)
-
-
-def _seed_produtos():
-    for i in range(1, 51):
-        _produto_service.cadastrar_produto(
-            nome=f"Produto Black Friday {i:02d}",
-            preco=round(10.0 + i * 2.5, 2),
-            estoque=1000,
-        )
-
-
-_seed_produtos()
-
-
-@app.route("/saude")
-# Sem @limiter.limit: health checks de balanceadores de carga precisam
-# sempre responder, mesmo quando o servidor está sob carga máxima.
-def saude():
-    return jsonify({"status": "ok"})
-
-
-@app.route("/produtos")
-@limiter.limit("100 per minute")
-def listar_produtos():
-    produtos = _produto_service.listar_produtos()
-    return jsonify([
-        {"id": p.id, "nome": p.nome, "preco": p.preco, "estoque": p.estoque}
-        for p in produtos
-    ])
-
-
-@app.route("/produtos/<int:id>")
-@limiter.limit("100 per minute")
-def buscar_produto(id):
-    try:
-        produto = _produto_service.buscar_produto(id)
-        return jsonify({"id": produto.id, "nome": produto.nome, "preco": produto.preco, "estoque": produto.estoque})
-    except ValueError as e:
-        return jsonify({"erro": str(e)}), 404
-
-
-@app.route("/carrinho", methods=["POST"])
-@limiter.limit("100 per minute")
-def adicionar_carrinho():
-    data = request.get_json()
-    if not data or "produto_id" not in data or "quantidade" not in data:
-        return jsonify({"erro": "produto_id e quantidade são obrigatórios"}), 400
-    try:
-        produto = _produto_service.buscar_produto(data["produto_id"])
-        return jsonify({
-            "mensagem": "Item adicionado ao carrinho",
-            "produto_id": produto.id,
-            "quantidade": data["quantidade"],
-            "subtotal": round(produto.preco * data["quantidade"], 2),
-        })
-    except ValueError as e:
-        return jsonify({"erro": str(e)}), 404
-
-
-@app.route("/pedidos", methods=["POST"])
-@limiter.limit("100 per minute")
-def criar_pedido():
-    data = request.get_json()
-    if not data or "itens" not in data:
-        return jsonify({"erro": "itens é obrigatório"}), 400
-    try:
-        pedido = _pedido_service.criar_pedido(data["itens"])
-        return jsonify({
-            "id": pedido.id,
-            "total": pedido.total,
-            "status": pedido.status.value,
-            "itens": [
-                {"produto_id": i.produto_id, "quantidade": i.quantidade, "preco_unitario": i.preco_unitario}
-                for i in pedido.itens
-            ],
-        }), 201
-    except ValueError as e:
-        return jsonify({"erro": str(e)}), 422
+# Serviços, caches e controles de carga; backend escolhido por BF_STORAGE (ver
+# api_comum.criar_api). As rotas estão em api_comum.ROTAS, as mesmas do app ASGI.
+_api = criar_api()
+
+
+def _resposta_flask(resposta: Resposta):
+    if resposta.partes is not None:
+        resp = app.response_class(resposta.partes, mimetype=resposta.content_type)
+        # O servidor WSGI fecha a resposta depois de enviar a última parte (ou
+        # quando o cliente desiste): só então a requisição terminou.
+        resp.call_on_close(resposta.ao_terminar)
+    elif resposta.bruto is not None:
+        resp = app.response_class(resposta.bruto, content_type=resposta.content_type)
+    elif resposta.corpo is not None:
+        # jsonify usa as mesmas opções de api_comum.json_compacto: bytes
+        # idênticos aos do app ASGI e aos do corpo em cache.
+        resp = jsonify(resposta.corpo)
+    else:
+        resp = app.response_class()
+    resp.status_code = resposta.status
+    resp.headers.update(resposta.headers)
+    return resp
+
+
+def _view(rota: Rota):
+    def view(**parametros):
+        # Respostas produzidas aqui já entram nas métricas por atender().
+        g.registrada = True
+        req = Requisicao(request.args, request.headers, request.get_json)
+        return _resposta_flask(concluir(atender(_api, rota, req, parametros)))
+    # O Flask-Limiter identifica a rota pelo nome da view.
+    view.__name__ = view.__qualname__ = rota.nome
+    return view
+
+
+for _rota in ROTAS:
+    _limitada = limiter.limit(LIMITE_POR_ROTA) if _rota.limitada else limiter.exempt
+    app.add_url_rule(_rota.caminho, endpoint=_rota.nome, view_func=_limitada(_view(_rota)), methods=[_rota.metodo])
+
+
+@app.after_request
+def _contar_recusa(resp):
+    # Respostas que não chegaram a uma rota (429 do Flask-Limiter, 404/405 do
+    # roteamento) entram só na contagem por status.
+    if not g.pop("registrada", False):
+        registrar_requisicao(_api.metricas, request.endpoint or "desconhecida", resp.status_code, None)
+    return resp
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+"""
+Variante assíncrona (ASGI) da API do BF Shop.
+
+Mesmas rotas de app.py (api_comum.ROTAS), mas servidas por um único event loop:
+a latência simulada de banco usa asyncio.sleep, então milhares de requisições
+em espera ocupam apenas corrotinas, não uma thread cada.
+
+Comando para executar:
+  uvicorn app_asgi:app --host 0.0.0.0 --port 8000
+"""
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl
+sys.path.insert(0, str(Path(__file__).parent))
+
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+
+from api_comum import (
+    LIMITE_POR_ROTA,
+    ROTAS,
+    Requisicao,
+    Resposta,
+    Rota,
+    atender,
+    criar_api,
+    json_compacto,
+    registrar_requisicao,
+)
+
+# Mesmo backend (BF_STORAGE) e mesmas rotas de app.py; aqui os serviços são os
+# assíncronos e as esperas na fila do load shedding e nas repetições com
+# Idempotency-Key usam asyncio.Event, sem ocupar o event loop.
+_api = criar_api(assincrona=True)
+
+# Mesmo limite de app.py (por IP e por rota), com a API assíncrona da biblioteca
+# limits — a mesma que o Flask-Limiter usa por baixo.
+_limite_por_rota = parse(LIMITE_POR_ROTA)
+_limiter_storage = MemoryStorage()
+_limiter = FixedWindowRateLimiter(_limiter_storage)
+
+
+def _padrao(caminho: str):
+    # /pedidos/<int:id>/confirmar -> ^/pedidos/(?P<id>\d+)/confirmar$
+    return re.compile("^" + re.sub(r"<int:(\w+)>", r"(?P<\1>\\d+)", caminho) + "$")
+
+
+_rotas = [(_padrao(r.caminho), r) for r in ROTAS]
+
+
+def _requisicao(scope: dict, corpo: bytes) -> Requisicao:
+    def ler_json():
+        # Corpo ausente ou inválido vira None, como request.get_json() faria
+        # antes de a rota validar os campos obrigatórios.
+        try:
+            return json.loads(corpo) if corpo else None
+        except ValueError:
+            return None
+
+    return Requisicao(
+        dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))),
+        {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])},
+        ler_json,
+    )
+
+
+async def _limite_excedido(ip: str, rota: Rota):
+    if await _limiter.hit(_limite_por_rota, ip, rota.nome):
+        return None
+    janela = await _limiter.get_window_stats(_limite_por_rota, ip, rota.nome)
+    retry_after = max(1, int(janela.reset_time - time.time()) + 1)
+    return Resposta(429, {"erro": "limite de requisições excedido"}, headers={
+        "Retry-After": str(retry_after),
+        "X-RateLimit-Limit": str(_limite_por_rota.amount),
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": str(int(janela.reset_time)),
+    })
+
+
+async def _despachar(scope: dict, corpo: bytes) -> Resposta:
+    metodo_errado = False
+    for padrao, rota in _rotas:
+        encontrada = padrao.match(scope["path"])
+        if encontrada is None:
+            continue
+        if rota.metodo != scope["method"]:
+            metodo_errado = True
+            continue
+        if rota.limitada:
+            ip = (scope.get("client") or ("desconhecido", 0))[0]
+            excedido = await _limite_excedido(ip, rota)
+            if excedido is not None:
+                registrar_requisicao(_api.metricas, rota.nome, 429, None)
+                return excedido
+        parametros = {nome: int(valor) for nome, valor in encontrada.groupdict().items()}
+        return await atender(_api, rota, _requisicao(scope, corpo), parametros)
+    resposta = Resposta(405, {"erro": "método não permitido"}) if metodo_errado else \
+        Resposta(404, {"erro": "rota não encontrada"})
+    registrar_requisicao(_api.metricas, "desconhecida", resposta.status, None)
+    return resposta
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            mensagem = await receive()
+            if mensagem["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif mensagem["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    corpo = b""
+    while True:
+        mensagem = await receive()
+        corpo += mensagem.get("body", b"")
+        if not mensagem.get("more_body"):
+            break
+
+    resposta = await _despachar(scope, corpo)
+    if resposta.bruto is not None:
+        dados = resposta.bruto
+    elif resposta.corpo is not None:
+        dados = json_compacto(resposta.corpo)
+    else:
+        dados = b""
+    headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in resposta.headers.items()]
+    if dados or resposta.partes is not None:
+        headers.append((b"content-type", resposta.content_type.encode("latin-1")))
+    if resposta.partes is None:
+        headers.append((b"content-length", str(len(dados)).encode()))
+    await send({"type": "http.response.start", "status": resposta.status, "headers": headers})
+    if resposta.partes is None:
+        await send({"type": "http.response.body", "body": dados})
+        return
+    # Cada parte é codificada só quando vai ser enviada; entre uma e outra o
+    # event loop atende as demais requisições.
+    try:
+        for parte in resposta.partes:
+            await send({"type": "http.response.body", "body": parte, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        resposta.ao_terminar()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Um único processo e um único event loop: a concorrência vem das corrotinas
+    # suspensas em asyncio.sleep, não de threads.
+    uvicorn.run(app, host="0.0.0.0", port=8000)
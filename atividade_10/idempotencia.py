@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+# Respostas de POST /pedidos guardadas por Idempotency-Key. Um cliente que
+# repete a requisição (timeout no Locust, rede móvel instável) recebe a mesma
+# resposta da primeira vez em vez de criar um segundo pedido.
+#
+# LRU com TTL e número máximo de entradas: a memória usada não depende de
+# quantas chaves distintas chegam. O TTL conta da criação da entrada — um
+# cliente que fica repetindo a mesma chave não a mantém viva para sempre.
+#
+# Uma repetição que chega enquanto a original ainda está executando espera pelo
+# resultado dela; só quem criou a entrada executa a operação.
+
+TAMANHO_MAXIMO_CHAVE = 255
+
+
+class ChaveReutilizada(ValueError):
+    # Mesma chave com outro corpo: provavelmente um bug do cliente, e devolver
+    # a resposta do pedido anterior esconderia isso.
+    pass
+
+
+def impressao_do_corpo(corpo: Any) -> bytes:
+    return hashlib.sha256(json.dumps(corpo, sort_keys=True, separators=(",", ":")).encode()).digest()
+
+
+class _Entrada:
+    __slots__ = ("impressao", "resultado", "expira_em", "pronta")
+
+    def __init__(self, impressao: bytes, pronta):
+        self.impressao = impressao
+        self.resultado = None
+        self.expira_em = None
+        # threading.Event no app Flask, asyncio.Event no ASGI.
+        self.pronta = pronta
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries: int = 10_000, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic):
+        if max_entries < 1:
+            raise ValueError("max_entries deve ser maior que zero")
+        if ttl <= 0:
+            raise ValueError("ttl deve ser maior que zero")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self.acertos = 0
+        self.faltas = 0
+        # Repetições que chegaram com a original ainda em andamento (também
+        # contadas em acertos).
+        self.esperas = 0
+        self.expiradas = 0
+        self.despejadas = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def _reservar(self, chave: str, impressao: bytes, nova_espera) -> Tuple[_Entrada, bool]:
+        """(entrada, True) se esta chamada deve executar a operação."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada.expira_em is not None and entrada.expira_em <= self._clock():
+                del self._entradas[chave]
+                self.expiradas += 1
+                entrada = None
+            if entrada is not None:
+                if entrada.impressao != impressao:
+                    raise ChaveReutilizada("Idempotency-Key já usada com outro corpo de requisição")
+                self._entradas.move_to_end(chave)
+                self.acertos += 1
+                if entrada.expira_em is None:
+                    self.esperas += 1
+                return entrada, False
+
+            self.faltas += 1
+            entrada = self._entradas[chave] = _Entrada(impressao, nova_espera())
+            while len(self._entradas) > self.max_entries:
+                self._entradas.popitem(last=False)
+                self.despejadas += 1
+            return entrada, True
+
+    def _concluir(self, entrada: _Entrada, resultado) -> None:
+        with self._lock:
+            entrada.resultado = resultado
+            entrada.expira_em = self._clock() + self.ttl
+        entrada.pronta.set()
+
+    def _abandonar(self, chave: str, entrada: _Entrada) -> None:
+        # A operação levantou uma exceção inesperada: nada foi registrado, então
+        # a chave é liberada e quem estava esperando tenta de novo.
+        with self._lock:
+            if self._entradas.get(chave) is entrada:
+                del self._entradas[chave]
+        entrada.pronta.set()
+
+    def executar(self, chave: str, corpo: Any, operacao: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(resultado, repetido): executa operacao só na primeira vez que a chave aparece."""
+        impressao = impressao_do_corpo(corpo)
+        while True:
+            entrada, dono = self._reservar(chave, impressao, threading.Event)
+            if not dono:
+                entrada.pronta.wait()
+                if entrada.expira_em is not None:
+                    return entrada.resultado, True
+                continue
+            try:
+                resultado = operacao()
+            except BaseException:
+                self._abandonar(chave, entrada)
+                raise
+            self._concluir(entrada, resultado)
+            return resultado, False
+
+    async def executar_async(
+        self, chave: str, corpo: Any, operacao: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        impressao = impressao_do_corpo(corpo)
+        while True:
+            entrada, dono = self._reservar(chave, impressao, asyncio.Event)
+            if not dono:
+                await entrada.pronta.wait()
+                if entrada.expira_em is not None:
+                    return entrada.resultado, True
+                continue
+            try:
+                resultado = await operacao()
+            except BaseException:
+                self._abandonar(chave, entrada)
+                raise
+            self._concluir(entrada, resultado)
+            return resultado, False
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "capacidade": self.max_entries,
+                "ttl_segundos": self.ttl,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "esperas": self.esperas,
+                "expiradas": self.expiradas,
+                "despejadas": self.despejadas,
+            }
@@ -0,0 +1,179 @@
+import bisect
+import itertools
+import re
+import unicodedata
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# Índices secundários declarados sobre um InMemoryStorage (ver add_index). O
+# storage chama update/remove/clear sob o seu próprio lock a cada escrita, então
+# os índices nunca divergem dos dados, e lookup também roda sob esse lock.
+#
+# Cada índice lembra as chaves com que indexou cada id. Os serviços alteram os
+# objetos no lugar e depois regravam (ex.: status de um pedido): sem essas
+# chaves, não daria para saber de onde remover o id quando o valor mudou.
+
+
+class HashIndex:
+    # Igualdade exata: chave -> ids. Ex.: pedidos por StatusPedido.
+    #
+    # Os ids de cada chave ficam numa lista ordenada, para que uma consulta
+    # paginada (after_id, limit) custe O(log n + limit) em vez de ordenar todos
+    # os ids da chave: ids novos são sempre maiores que os existentes, então o
+    # caso comum é um append. Tirar um id do meio de uma lista de milhões a cada
+    # mudança de status também custaria O(n); a remoção é preguiçosa: o id fica
+    # na lista, as consultas o descartam porque a sua chave atual (em
+    # _chaves_por_id) já é outra, e a lista é compactada quando metade dela
+    # estiver nessa situação.
+    def __init__(self, key: Callable[[Any], Hashable]):
+        self._key = key
+        self._ids_por_chave: Dict[Hashable, List[int]] = {}
+        self._removidos_por_chave: Dict[Hashable, int] = {}
+        self._chaves_por_id: Dict[int, Tuple[Hashable, ...]] = {}
+
+    def _chaves(self, item) -> Tuple[Hashable, ...]:
+        return (self._key(item),)
+
+    def update(self, id: int, item) -> None:
+        chaves = self._chaves(item)
+        anteriores = self._chaves_por_id.get(id)
+        # Regravação sem mudança no campo indexado (o caso comum: baixa de
+        # estoque) não mexe no índice.
+        if anteriores == chaves:
+            return
+        if anteriores is not None:
+            self._desindexar(id, anteriores)
+        for chave in chaves:
+            self._indexar(id, chave)
+        self._chaves_por_id[id] = chaves
+
+    def remove(self, id: int) -> None:
+        anteriores = self._chaves_por_id.pop(id, None)
+        if anteriores is not None:
+            self._desindexar(id, anteriores)
+
+    def _indexar(self, id: int, chave: Hashable) -> None:
+        ids = self._ids_por_chave.get(chave)
+        if ids is None:
+            self._ids_por_chave[chave] = [id]
+            self._removidos_por_chave[chave] = 0
+            self._nova_chave(chave)
+        elif ids[-1] < id:
+            ids.append(id)
+        else:
+            i = bisect.bisect_left(ids, id)
+            if i < len(ids) and ids[i] == id:
+                # O id saiu da chave e voltou antes da compactação: a entrada
+                # antiga volta a valer.
+                self._removidos_por_chave[chave] -= 1
+            else:
+                ids.insert(i, id)
+
+    def _desindexar(self, id: int, chaves: Iterable[Hashable]) -> None:
+        for chave in chaves:
+            ids = self._ids_por_chave[chave]
+            removidos = self._removidos_por_chave[chave] + 1
+            if removidos == len(ids):
+                del self._ids_por_chave[chave]
+                del self._removidos_por_chave[chave]
+                self._chave_removida(chave)
+            elif removidos * 2 > len(ids):
+                # _chaves_por_id ainda tem as chaves antigas deste id (ver update).
+                self._ids_por_chave[chave] = [i for i in ids if i != id and self._contem(i, chave)]
+                self._removidos_por_chave[chave] = 0
+            else:
+                self._removidos_por_chave[chave] = removidos
+
+    def _contem(self, id: int, chave: Hashable) -> bool:
+        return chave in self._chaves_por_id.get(id, ())
+
+    def _ids(self, chave: Hashable, after_id: Optional[int] = None, limit: Optional[int] = None) -> List[int]:
+        # Até `limit` ids da chave maiores que after_id, em ordem crescente.
+        ids = self._ids_por_chave.get(chave, [])
+        inicio = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+        if not self._removidos_por_chave.get(chave):
+            return ids[inicio:] if limit is None else ids[inicio:inicio + limit]
+        chaves_por_id = self._chaves_por_id
+        validos = (ids[i] for i in range(inicio, len(ids)) if chave in chaves_por_id.get(ids[i], ()))
+        return list(itertools.islice(validos, limit))
+
+    def _nova_chave(self, chave) -> None:
+        pass
+
+    def _chave_removida(self, chave) -> None:
+        pass
+
+    def clear(self) -> None:
+        self._ids_por_chave.clear()
+        self._removidos_por_chave.clear()
+        self._chaves_por_id.clear()
+
+    def lookup(self, valor, after_id: Optional[int] = None, limit: Optional[int] = None) -> List[int]:
+        """Até `limit` ids com a chave `valor` e id maior que `after_id`, em ordem de id."""
+        return self._ids(valor, after_id, limit)
+
+
+class SortedIndex(HashIndex):
+    # Intervalos de valores ordenáveis (ex.: faixa de preço). Além de chave -> ids,
+    # mantém a lista ordenada das chaves distintas: um catálogo tem bem menos
+    # preços distintos do que produtos, então o insort fica barato e a consulta
+    # custa O(log k) mais o tamanho do resultado.
+    def __init__(self, key: Callable[[Any], Any]):
+        super().__init__(key)
+        self._chaves_ordenadas: List[Any] = []
+
+    def _nova_chave(self, chave) -> None:
+        bisect.insort(self._chaves_ordenadas, chave)
+
+    def _chave_removida(self, chave) -> None:
+        del self._chaves_ordenadas[bisect.bisect_left(self._chaves_ordenadas, chave)]
+
+    def clear(self) -> None:
+        super().clear()
+        self._chaves_ordenadas.clear()
+
+    def lookup(self, minimo=None, maximo=None) -> List[int]:
+        """Ids com chave em [minimo, maximo], ordenados por (chave, id); None deixa o lado aberto."""
+        chaves = self._chaves_ordenadas
+        inicio = 0 if minimo is None else bisect.bisect_left(chaves, minimo)
+        fim = len(chaves) if maximo is None else bisect.bisect_right(chaves, maximo)
+        ids: List[int] = []
+        for chave in chaves[inicio:fim]:
+            ids.extend(self._ids(chave))
+        return ids
+
+
+def palavras(texto: str) -> Tuple[str, ...]:
+    # Minúsculas e sem acentos: "Café" é encontrado por "cafe" e vice-versa.
+    decomposto = unicodedata.normalize("NFKD", texto.casefold())
+    sem_acentos = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return tuple(sorted(set(re.findall(r"\w+", sem_acentos))))
+
+
+def corresponde(termo: str, texto: str) -> bool:
+    """Mesmo critério de PrefixIndex.lookup, para buscas por varredura."""
+    termos = palavras(termo)
+    candidatas = palavras(texto)
+    return bool(termos) and all(any(p.startswith(t) for p in candidatas) for t in termos)
+
+
+class PrefixIndex(SortedIndex):
+    # Busca por prefixo de palavra: "tv" encontra "Smart TV 4K" e "smart 4" também.
+    # Indexa cada palavra do texto; as palavras distintas ficam ordenadas, então
+    # todas as que começam com um prefixo formam um trecho contíguo da lista.
+    def _chaves(self, item) -> Tuple[str, ...]:
+        return palavras(self._key(item))
+
+    def lookup(self, termo: str) -> List[int]:
+        """Ids cujo texto tem, para cada palavra do termo, uma palavra com esse prefixo."""
+        resultado: Optional[Set[int]] = None
+        for prefixo in palavras(termo):
+            chaves = self._chaves_ordenadas
+            i = bisect.bisect_left(chaves, prefixo)
+            ids: Set[int] = set()
+            while i < len(chaves) and chaves[i].startswith(prefixo):
+                ids.update(self._ids(chaves[i]))
+                i += 1
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return []
+        return sorted(resultado or ())
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from typing import Iterator, List, Sequence
+
+from models import ItemCarrinho, Pedido, StatusPedido
+
+# Log de pedidos só de acréscimo (write-ahead), um registro JSON por linha:
+#   {"id": 1, "total": 25.0, "status": "AGUARDANDO", "itens": [[produto_id, quantidade, preco_unitario]]}
+#
+# Um fsync por pedido limitaria o checkout à latência do disco (~1-10 ms cada).
+# Com group commit, quem grava só enfileira a linha e espera: uma thread única
+# junta tudo o que chegou dentro da janela (ou até max_batch registros), grava
+# com um write e um fsync, e libera todos de uma vez. Cada chamador continua só
+# recebendo retorno depois que o seu pedido está no disco.
+#
+# Regravar um pedido (ex.: mudança de status) acrescenta um novo registro com o
+# mesmo id; no replay vale o último.
+
+
+def _serializar(pedido: Pedido) -> bytes:
+    registro = {
+        "id": pedido.id,
+        "total": pedido.total,
+        "status": pedido.status.value,
+        "itens": [[i.produto_id, i.quantidade, i.preco_unitario] for i in pedido.itens],
+    }
+    return (json.dumps(registro, separators=(",", ":")) + "\n").encode()
+
+
+def _desserializar(linha: bytes) -> Pedido:
+    registro = json.loads(linha)
+    return Pedido(
+        itens=[ItemCarrinho(*item) for item in registro["itens"]],
+        total=registro["total"],
+        id=registro["id"],
+        status=StatusPedido(registro["status"]),
+    )
+
+
+class OrderJournal:
+    def __init__(self, path: str, batch_window: float = 0.002, max_batch: int = 256):
+        if batch_window < 0:
+            raise ValueError("batch_window não pode ser negativo")
+        if max_batch < 1:
+            raise ValueError("max_batch deve ser maior que zero")
+        self.path = path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        # Quantos write+fsync foram feitos; com carga concorrente fica bem abaixo
+        # do número de pedidos gravados.
+        self.lotes_gravados = 0
+
+        self._descartar_registro_incompleto()
+        self._arquivo = open(path, "ab")
+        self._cond = threading.Condition()
+        self._pendentes: List[bytes] = []
+        self._enfileirados = 0
+        self._gravados = 0
+        self._erro = None
+        self._fechado = False
+        self._thread = threading.Thread(target=self._gravar_em_grupo, name="order-journal", daemon=True)
+        self._thread.start()
+
+    def _descartar_registro_incompleto(self) -> None:
+        # Uma queda no meio de um write deixa a última linha pela metade. Ela nunca
+        # foi confirmada a ninguém (o fsync não terminou), então é truncada para que
+        # os próximos registros não sejam colados a ela.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as arquivo:
+            conteudo = arquivo.read()
+            fim_valido = conteudo.rfind(b"\n") + 1
+            if fim_valido < len(conteudo):
+                arquivo.truncate(fim_valido)
+
+    def replay(self) -> Iterator[Pedido]:
+        """Pedidos do log, na ordem em que foram gravados."""
+        with open(self.path, "rb") as arquivo:
+            for linha in arquivo:
+                if linha.endswith(b"\n"):
+                    yield _desserializar(linha)
+
+    def append(self, pedido: Pedido) -> None:
+        self.append_many([pedido])
+
+    def append_many(self, pedidos: Sequence[Pedido]) -> None:
+        """Grava os pedidos e só retorna quando estão no disco."""
+        if not pedidos:
+            return
+        linhas = [_serializar(p) for p in pedidos]
+        with self._cond:
+            if self._fechado:
+                raise RuntimeError("Journal de pedidos já foi fechado")
+            if self._erro is not None:
+                raise self._erro
+            # Acorda a thread de gravação no primeiro registro da janela e quando o
+            # lote enche; nos demais casos ela já está esperando o fim da janela.
+            if not self._pendentes or len(self._pendentes) + len(linhas) >= self.max_batch:
+                self._cond.notify_all()
+            self._pendentes.extend(linhas)
+            self._enfileirados += len(linhas)
+            alvo = self._enfileirados
+            while self._gravados < alvo:
+                if self._erro is not None:
+                    raise self._erro
+                self._cond.wait()
+
+    def _gravar_em_grupo(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pendentes and not self._fechado:
+                    self._cond.wait()
+                if not self._pendentes:
+                    return
+                prazo = time.monotonic() + self.batch_window
+                while len(self._pendentes) < self.max_batch and not self._fechado:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                lote, self._pendentes = self._pendentes, []
+                alvo = self._enfileirados
+
+            # Escrita e fsync fora do lock: novos pedidos seguem enfileirando para
+            # o próximo lote enquanto este vai para o disco.
+            try:
+                self._arquivo.write(b"".join(lote))
+                self._arquivo.flush()
+                os.fsync(self._arquivo.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._erro = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._gravados = alvo
+                self.lotes_gravados += 1
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        # Grava o que ainda estiver pendente antes de fechar o arquivo.
+        with self._cond:
+            self._fechado = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._arquivo.close()
@@ -0,0 +1,108 @@
+import asyncio
+import bisect
+import itertools
+import math
+import random
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# Modelos de latência de banco de dados para a camada de serviço. Cada modelo só
+# sorteia uma duração em segundos; quem espera (com time.sleep ou asyncio.sleep)
+# é o DbLatencySimulator, para que o mesmo modelo sirva aos serviços síncronos
+# e assíncronos.
+
+
+class ConstantLatency:
+    def __init__(self, seconds: float = 0.001):
+        if seconds < 0:
+            raise ValueError("Latência não pode ser negativa")
+        self.seconds = seconds
+
+    def sample(self) -> float:
+        return self.seconds
+
+
+class LogNormalLatency:
+    # Latência de I/O real tem cauda longa à direita: a maioria das consultas fica
+    # perto da mediana e poucas demoram muito mais. A log-normal reproduz isso com
+    # dois parâmetros: a mediana e sigma (quanto maior, mais pesada a cauda).
+    def __init__(self, median: float, sigma: float, seed: Optional[int] = None):
+        if median <= 0:
+            raise ValueError("Mediana deve ser maior que zero")
+        if sigma < 0:
+            raise ValueError("sigma não pode ser negativo")
+        self._mu = math.log(median)
+        self._sigma = sigma
+        self._rng = random.Random(seed)
+
+    def sample(self) -> float:
+        return self._rng.lognormvariate(self._mu, self._sigma)
+
+
+class HistogramLatency:
+    # Reproduz uma distribuição medida em produção: buckets (latência, contagem),
+    # por exemplo exportados de um histograma do banco ou de um relatório do Locust.
+    # Cada sorteio escolhe um bucket com probabilidade proporcional à contagem.
+    def __init__(self, buckets: Sequence[Tuple[float, int]], seed: Optional[int] = None):
+        if not buckets:
+            raise ValueError("Histograma precisa de pelo menos um bucket")
+        if any(latencia < 0 or contagem < 0 for latencia, contagem in buckets):
+            raise ValueError("Latências e contagens não podem ser negativas")
+        self._latencias = [latencia for latencia, _ in buckets]
+        self._acumulado: List[int] = list(itertools.accumulate(c for _, c in buckets))
+        if self._acumulado[-1] == 0:
+            raise ValueError("Histograma precisa de pelo menos uma amostra")
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_samples(cls, samples: Sequence[float], seed: Optional[int] = None) -> "HistogramLatency":
+        contagens = {}
+        for amostra in samples:
+            contagens[amostra] = contagens.get(amostra, 0) + 1
+        return cls(sorted(contagens.items()), seed=seed)
+
+    def sample(self) -> float:
+        alvo = self._rng.random() * self._acumulado[-1]
+        return self._latencias[bisect.bisect_right(self._acumulado, alvo)]
+
+
+class DbLatencySimulator:
+    # Simula uma ida ao banco: primeiro a espera por uma conexão livre do pool
+    # (quando pool_size é informado), depois a latência sorteada pelo modelo com
+    # a conexão ocupada. Com pool pequeno e muitas threads, a fila do pool vira a
+    # parte dominante da latência, como num banco real saturado.
+    def __init__(self, model=None, pool_size: Optional[int] = None):
+        if pool_size is not None and pool_size < 1:
+            raise ValueError("pool_size deve ser maior que zero")
+        self.model = model or ConstantLatency(0.001)
+        self.pool_size = pool_size
+        self._pool = threading.BoundedSemaphore(pool_size) if pool_size else None
+        self._pool_async: Optional[asyncio.Semaphore] = None
+        self._loop_do_pool = None
+
+    def wait(self) -> None:
+        # time.sleep libera o GIL durante a espera, permitindo que outras threads
+        # executem em paralelo — essencial para o ganho de throughput nos testes
+        # de escalabilidade com ThreadPoolExecutor.
+        if self._pool is None:
+            time.sleep(self.model.sample())
+            return
+        with self._pool:
+            time.sleep(self.model.sample())
+
+    async def wait_async(self) -> None:
+        if self.pool_size is None:
+            await asyncio.sleep(self.model.sample())
+            return
+        async with self._semaforo_async():
+            await asyncio.sleep(self.model.sample())
+
+    def _semaforo_async(self) -> asyncio.Semaphore:
+        # asyncio.Semaphore fica preso ao event loop em que é usado; um novo loop
+        # (ex.: cada asyncio.run nos testes) recebe um pool novo.
+        loop = asyncio.get_running_loop()
+        if self._loop_do_pool is not loop:
+            self._pool_async = asyncio.Semaphore(self.pool_size)
+            self._loop_do_pool = loop
+        return self._pool_async
@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import time
+import urllib.parse
+from math import floor
+from typing import Optional, Tuple
+
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport
+
+from storage import _LocksPorItemEmArquivo
+
+# Storage do Flask-Limiter compartilhado por todos os workers da máquina: uma
+# tabela hash de tamanho fixo num arquivo mapeado em memória (mmap). Com
+# memory://, cada worker do gunicorn tem o próprio contador e um cliente
+# consegue workers x 100 req/min; aqui todos enxergam o mesmo.
+#
+#   URI: bfmmap:///caminho/do/arquivo   (ex.: bfmmap:///tmp/bfshop_limites.bin)
+#
+# Cada chave de limite ocupa um slot com a contagem da janela atual e da
+# anterior (sliding window counter, como a estratégia "sliding-window-counter"
+# do limits espera): o peso da janela anterior cai linearmente conforme a atual
+# avança, sem guardar um timestamp por requisição.
+#
+# A tabela é dividida em partições, cada uma com o seu lock (um byte do arquivo
+# de locks, via fcntl): requisições de chaves diferentes quase nunca disputam o
+# mesmo lock, e a sondagem linear fica restrita à partição, então o lock dela
+# basta para inserir. Slots cujas janelas já passaram são reaproveitados; a
+# tabela nunca cresce.
+
+_MAGIC = b"BFL1"
+_CABECALHO = struct.Struct("<4sxxxxqq")  # magic, partições, slots por partição
+# hash da chave (0 = vazio), janela, contagem atual, contagem anterior, expiry
+_SLOT = struct.Struct("<Qqqqd")
+_MAXIMO_SONDAGENS = 32
+# Byte 0 do arquivo de locks protege a criação e o reset da tabela inteira; a
+# partição p usa o byte p + 1.
+_LOCK_DA_TABELA = 0
+
+
+def _hash(chave: str) -> int:
+    h = int.from_bytes(hashlib.blake2b(chave.encode(), digest_size=8).digest(), "little")
+    return h or 1
+
+
+def _rolar(janela_gravada: int, atual: int, anterior: int, janela: int) -> Tuple[int, int]:
+    # Contagens do slot vistas a partir de `janela`: se o slot é da janela
+    # anterior, a contagem atual dele passa a ser a anterior.
+    if janela_gravada == janela:
+        return atual, anterior
+    if janela_gravada == janela - 1:
+        return 0, atual
+    return 0, 0
+
+
+class MappedSlidingWindowStorage(Storage, SlidingWindowCounterSupport):
+    STORAGE_SCHEME = ["bfmmap"]
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        wrap_exceptions: bool = False,
+        partitions: int = 256,
+        slots_per_partition: int = 1024,
+        **options,
+    ):
+        if partitions < 1 or slots_per_partition < 1:
+            raise ValueError("partitions e slots_per_partition devem ser maiores que zero")
+        self.path = urllib.parse.urlparse(uri or "").path
+        if not self.path:
+            raise ValueError("Informe o arquivo da tabela: bfmmap:///caminho/do/arquivo")
+        # Contadores deste processo: chaves que não couberam na partição (a
+        # requisição passa, como num storage fora do ar) e slots reaproveitados.
+        self.tabela_cheia = 0
+        self.reaproveitados = 0
+        self._locks = _LocksPorItemEmArquivo(f"{self.path}.locks")
+
+        with self._locks.get(_LOCK_DA_TABELA):
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            cabecalho = os.pread(self._fd, _CABECALHO.size, 0)
+            if len(cabecalho) == _CABECALHO.size and cabecalho[:4] == _MAGIC:
+                # Outro worker já criou a tabela: vale o tamanho que está no arquivo.
+                _, partitions, slots_per_partition = _CABECALHO.unpack(cabecalho)
+            else:
+                os.ftruncate(self._fd, _CABECALHO.size + partitions * slots_per_partition * _SLOT.size)
+                os.pwrite(self._fd, _CABECALHO.pack(_MAGIC, partitions, slots_per_partition), 0)
+            self._particoes = partitions
+            self._slots_por_particao = slots_per_partition
+            self._buf = mmap.mmap(self._fd, 0)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    def _lock(self, h: int):
+        return self._locks.get(h % self._particoes + 1)
+
+    def _localizar(self, h: int, agora: float, criar: bool) -> Optional[int]:
+        """Offset do slot da chave; com criar, de um slot livre para ela."""
+        slots = self._slots_por_particao
+        inicio = _CABECALHO.size + (h % self._particoes) * slots * _SLOT.size
+        # Bits diferentes dos usados na partição, para espalhar dentro dela.
+        base = (h // self._particoes) % slots
+        livre = None
+        for i in range(min(_MAXIMO_SONDAGENS, slots)):
+            offset = inicio + (base + i) % slots * _SLOT.size
+            hash_slot, janela, _, _, expiry = _SLOT.unpack_from(self._buf, offset)
+            if hash_slot == h:
+                return offset
+            if hash_slot == 0:
+                if not criar:
+                    return None
+                if livre is None:
+                    return offset
+                break
+            # Slot de outra chave sem contagem nas duas últimas janelas: pode ser
+            # reaproveitado, mas a busca continua até o fim da sequência para não
+            # duplicar uma chave que esteja mais adiante.
+            if livre is None and janela < int(agora / expiry) - 1:
+                livre = offset
+        if criar and livre is not None:
+            self.reaproveitados += 1
+        return livre if criar else None
+
+    def _contagens(self, offset: int, h: int, janela: int) -> Tuple[int, int]:
+        hash_slot, janela_gravada, atual, anterior, _ = _SLOT.unpack_from(self._buf, offset)
+        if hash_slot != h:
+            return 0, 0
+        return _rolar(janela_gravada, atual, anterior, janela)
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        agora = time.time()
+        janela = int(agora / expiry)
+        h = _hash(key)
+        with self._lock(h):
+            offset = self._localizar(h, agora, criar=True)
+            if offset is None:
+                self.tabela_cheia += 1
+                return True
+            atual, anterior = self._contagens(offset, h, janela)
+            # Mesmo cálculo do limits: a janela anterior pesa pela fração dela
+            # que ainda cabe nos últimos `expiry` segundos.
+            peso_anterior = 1 - (agora / expiry) % 1
+            if floor(anterior * peso_anterior + atual) + amount > limit:
+                return False
+            _SLOT.pack_into(self._buf, offset, h, janela, atual + amount, anterior, expiry)
+            return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        agora = time.time()
+        h = _hash(key)
+        with self._lock(h):
+            offset = self._localizar(h, agora, criar=False)
+            atual, anterior = (0, 0) if offset is None else self._contagens(offset, h, int(agora / expiry))
+        resto = 1 - (agora / expiry) % 1
+        return anterior, (resto * expiry if anterior else 0.0), atual, resto * expiry + expiry
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        self.clear(key)
+
+    # Operações de janela fixa, exigidas pela interface Storage. As janelas são
+    # alinhadas ao relógio (janela = agora // expiry) em vez de começarem no
+    # primeiro hit, para usarem o mesmo formato de slot.
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        agora = time.time()
+        janela = int(agora / expiry)
+        h = _hash(key)
+        with self._lock(h):
+            offset = self._localizar(h, agora, criar=True)
+            if offset is None:
+                self.tabela_cheia += 1
+                return 0
+            atual, anterior = self._contagens(offset, h, janela)
+            _SLOT.pack_into(self._buf, offset, h, janela, atual + amount, anterior, expiry)
+            return atual + amount
+
+    def _slot_atual(self, key: str) -> Optional[Tuple[int, int, float]]:
+        agora = time.time()
+        h = _hash(key)
+        with self._lock(h):
+            offset = self._localizar(h, agora, criar=False)
+            if offset is None:
+                return None
+            _, janela, atual, _, expiry = _SLOT.unpack_from(self._buf, offset)
+        return janela, atual, expiry
+
+    def get(self, key: str) -> int:
+        slot = self._slot_atual(key)
+        if slot is None:
+            return 0
+        janela, atual, expiry = slot
+        return atual if janela == int(time.time() / expiry) else 0
+
+    def get_expiry(self, key: str) -> float:
+        slot = self._slot_atual(key)
+        if slot is None:
+            return time.time()
+        janela, _, expiry = slot
+        return (janela + 1) * expiry
+
+    def clear(self, key: str) -> None:
+        h = _hash(key)
+        with self._lock(h):
+            offset = self._localizar(h, time.time(), criar=False)
+            if offset is not None:
+                # O hash fica no slot (janela 0 o torna reaproveitável): apagá-lo
+                # quebraria a sequência de sondagem de outras chaves.
+                _SLOT.pack_into(self._buf, offset, h, 0, 0, 0, 1.0)
+
+    def check(self) -> bool:
+        return not self._buf.closed
+
+    def reset(self) -> Optional[int]:
+        with contextlib.ExitStack() as pilha:
+            pilha.enter_context(self._locks.get(_LOCK_DA_TABELA))
+            for particao in range(self._particoes):
+                pilha.enter_context(self._locks.get(particao + 1))
+            ocupados = sum(
+                1
+                for offset in range(_CABECALHO.size, len(self._buf), _SLOT.size)
+                if _SLOT.unpack_from(self._buf, offset)[0]
+            )
+            self._buf[_CABECALHO.size:] = bytes(len(self._buf) - _CABECALHO.size)
+        return ocupados
+
+    def close(self) -> None:
+        self._buf.close()
+        os.close(self._fd)
+        self._locks.close()
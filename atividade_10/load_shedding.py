@@ -0,0 +1,253 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Limite de concorrência adaptativo (AIMD) na frente da camada de serviço. Sob
+# sobrecarga, aceitar todas as requisições só cria fila: a latência de todas
+# cresce até estourar o timeout do cliente, que repete e piora a fila. Aqui o
+# servidor atende no máximo `limite` requisições ao mesmo tempo e recusa cedo
+# (503 + Retry-After) as que teriam de esperar demais, mantendo a latência das
+# aceitas perto da de um servidor sem carga.
+#
+# O limite é descoberto pela latência observada, como no controle de
+# congestionamento do TCP:
+#   - resposta dentro de latency_target com o limite em uso: +1/limite
+#     (cresce ~1 por "janela" de respostas);
+#   - resposta acima de latency_target: limite x backoff, no máximo uma vez por
+#     latency_target, para que uma rajada de respostas lentas da mesma fila
+#     não derrube o limite de uma vez.
+#
+# As requisições são divididas em classes de tráfego (ex.: checkout e catálogo),
+# cada uma com a sua fila. Quem chega com o limite ocupado espera na fila da sua
+# classe por até max_queue_delay dela; se a espera estimada já passa disso, ou a
+# fila está cheia, a recusa é imediata, sem ocupar uma thread esperando à toa.
+# Quando uma vaga abre, as filas são atendidas por prioridade, e cada classe só
+# ocupa até a sua fatia do limite: o que sobra fica para as demais.
+
+
+@dataclass(frozen=True)
+class TrafficClass:
+    name: str
+    # Maior é atendida antes.
+    priority: int = 0
+    # Fração do limite de concorrência que a classe pode ocupar sozinha.
+    share: float = 1.0
+    max_queue: Optional[int] = None
+    # None: o max_queue_delay do limitador.
+    max_queue_delay: Optional[float] = None
+
+
+CLASSE_PADRAO = TrafficClass("padrao")
+
+
+class Sobrecarga(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("servidor sobrecarregado")
+        self.retry_after = retry_after
+
+
+class _Espera:
+    __slots__ = ("evento", "admitida")
+
+    def __init__(self, evento):
+        # threading.Event no app Flask, asyncio.Event no ASGI.
+        self.evento = evento
+        self.admitida = False
+
+
+class _EstadoDaClasse:
+    __slots__ = ("config", "fila", "em_andamento", "admitidas", "recusadas")
+
+    def __init__(self, config: TrafficClass):
+        self.config = config
+        self.fila: deque = deque()
+        self.em_andamento = 0
+        self.admitidas = 0
+        self.recusadas = 0
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial_limit: int = 32,
+        min_limit: int = 1,
+        max_limit: int = 1024,
+        latency_target: float = 0.1,
+        max_queue_delay: float = 0.05,
+        backoff: float = 0.9,
+        classes: Iterable[TrafficClass] = (CLASSE_PADRAO,),
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("É preciso 1 <= min_limit <= initial_limit <= max_limit")
+        if latency_target <= 0 or max_queue_delay < 0:
+            raise ValueError("latency_target deve ser positivo e max_queue_delay não negativo")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff deve estar entre 0 e 1")
+        classes = sorted(classes, key=lambda c: -c.priority)
+        if not classes or any(not 0 < c.share <= 1 for c in classes):
+            raise ValueError("É preciso ao menos uma classe, com share em (0, 1]")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_queue_delay = max_queue_delay
+        self.backoff = backoff
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limite = float(initial_limit)
+        self._em_andamento = 0
+        # Em ordem de prioridade decrescente: a ordem de atendimento das filas.
+        self._classes: Dict[str, _EstadoDaClasse] = {c.name: _EstadoDaClasse(c) for c in classes}
+        self._latencia_media = latency_target / 2
+        self._ultima_reducao = -math.inf
+        self.admitidas = 0
+        self.recusadas = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limite)
+
+    @property
+    def in_flight(self) -> int:
+        return self._em_andamento
+
+    def _classe(self, nome: Optional[str]) -> _EstadoDaClasse:
+        if nome is None:
+            return next(iter(self._classes.values()))
+        try:
+            return self._classes[nome]
+        except KeyError:
+            raise ValueError(f"Classe de tráfego desconhecida: {nome}")
+
+    def _vagas_da_classe(self, classe: _EstadoDaClasse) -> int:
+        return max(1, int(self._limite * classe.config.share))
+
+    def _pode_admitir(self, classe: _EstadoDaClasse) -> bool:
+        return self._em_andamento < self.limit and classe.em_andamento < self._vagas_da_classe(classe)
+
+    def _na_frente(self, classe: _EstadoDaClasse) -> int:
+        # Quem será atendido antes: as filas de prioridade maior ou igual.
+        return sum(
+            len(c.fila) for c in self._classes.values() if c.config.priority >= classe.config.priority
+        )
+
+    def _retry_after(self, classe: _EstadoDaClasse) -> int:
+        espera = self._na_frente(classe) * self._latencia_media / self.limit
+        return max(1, math.ceil(espera))
+
+    def _recusar(self, classe: _EstadoDaClasse) -> Sobrecarga:
+        classe.recusadas += 1
+        self.recusadas += 1
+        return Sobrecarga(self._retry_after(classe))
+
+    def _admitir(self, classe: _EstadoDaClasse) -> None:
+        self._em_andamento += 1
+        classe.em_andamento += 1
+        classe.admitidas += 1
+        self.admitidas += 1
+
+    def _reservar(self, nome_classe: Optional[str], nova_espera) -> Optional[Tuple[_Espera, float]]:
+        """None se admitida já; (espera, prazo) se entrou na fila; Sobrecarga se recusada."""
+        with self._lock:
+            classe = self._classe(nome_classe)
+            na_frente = self._na_frente(classe)
+            if not na_frente and self._pode_admitir(classe):
+                self._admitir(classe)
+                return None
+            config = classe.config
+            if config.max_queue is not None and len(classe.fila) >= config.max_queue:
+                raise self._recusar(classe)
+            max_queue_delay = self.max_queue_delay if config.max_queue_delay is None else config.max_queue_delay
+            espera_estimada = (na_frente + 1) * self._latencia_media / self.limit
+            if espera_estimada > max_queue_delay:
+                raise self._recusar(classe)
+            espera = _Espera(nova_espera())
+            classe.fila.append(espera)
+            return espera, max_queue_delay
+
+    def _desistir(self, nome_classe: Optional[str], espera: _Espera) -> None:
+        with self._lock:
+            if espera.admitida:
+                # Foi admitida entre o fim do timeout e este lock: segue normalmente.
+                return
+            classe = self._classe(nome_classe)
+            classe.fila.remove(espera)
+            raise self._recusar(classe)
+
+    def acquire(self, traffic_class: Optional[str] = None) -> float:
+        """Ocupa uma vaga (esperando até max_queue_delay) e devolve o instante da admissão.
+
+        Sem traffic_class, usa a classe de maior prioridade.
+        """
+        reserva = self._reservar(traffic_class, threading.Event)
+        if reserva is not None:
+            espera, prazo = reserva
+            if not espera.evento.wait(prazo):
+                self._desistir(traffic_class, espera)
+        return self._clock()
+
+    async def acquire_async(self, traffic_class: Optional[str] = None) -> float:
+        reserva = self._reservar(traffic_class, asyncio.Event)
+        if reserva is not None:
+            espera, prazo = reserva
+            try:
+                await asyncio.wait_for(espera.evento.wait(), prazo)
+            except asyncio.TimeoutError:
+                self._desistir(traffic_class, espera)
+        return self._clock()
+
+    def release(self, admitida_em: float, traffic_class: Optional[str] = None) -> None:
+        """Libera a vaga e ajusta o limite pela latência da requisição admitida em admitida_em."""
+        agora = self._clock()
+        latencia = agora - admitida_em
+        with self._lock:
+            limite_em_uso = self._em_andamento >= self.limit
+            self._em_andamento -= 1
+            self._classe(traffic_class).em_andamento -= 1
+            self._latencia_media += 0.1 * (latencia - self._latencia_media)
+            if latencia > self.latency_target:
+                if agora - self._ultima_reducao >= self.latency_target:
+                    self._limite = max(self.min_limit, self._limite * self.backoff)
+                    self._ultima_reducao = agora
+            elif limite_em_uso:
+                # Só cresce quando o limite de fato segurou requisições: com pouca
+                # carga, latência boa não diz nada sobre a capacidade.
+                self._limite = min(self.max_limit, self._limite + 1 / self._limite)
+            self._atender_filas()
+
+    def _atender_filas(self) -> None:
+        # Por prioridade; uma classe parada na própria fatia não bloqueia as
+        # seguintes, que podem usar as vagas restantes.
+        for classe in self._classes.values():
+            if self._em_andamento >= self.limit:
+                return
+            while classe.fila and self._pode_admitir(classe):
+                espera = classe.fila.popleft()
+                espera.admitida = True
+                self._admitir(classe)
+                espera.evento.set()
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "limite": self.limit,
+                "em_andamento": self._em_andamento,
+                "na_fila": sum(len(c.fila) for c in self._classes.values()),
+                "latencia_media_ms": round(self._latencia_media * 1000, 3),
+                "admitidas": self.admitidas,
+                "recusadas": self.recusadas,
+                "classes": {
+                    nome: {
+                        "vagas": self._vagas_da_classe(c),
+                        "em_andamento": c.em_andamento,
+                        "na_fila": len(c.fila),
+                        "admitidas": c.admitidas,
+                        "recusadas": c.recusadas,
+                    }
+                    for nome, c in self._classes.items()
+                },
+            }
@@ -9,12 +9,35 @@ Comando para executar:
 Para maior capacidade (produção), substituir o servidor Flask por:
   gunicorn -w 4 -b 0.0.0.0:5000 app:app
 
+Com vários workers, BF_STORAGE=sqlite faz todos compartilharem o mesmo catálogo,
+estoque e pedidos (arquivo em BF_SQLITE_PATH, padrão bfshop.db):
+  BF_STORAGE=sqlite gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+Sem durabilidade, BF_STORAGE=shm compartilha só catálogo e estoque, em memória
+compartilhada, com leituras sem lock nem IPC:
+  BF_STORAGE=shm gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+O rate limit (memory://) é contado por worker; para um limite de 100/min por IP
+no servidor inteiro, todos os workers podem usar a mesma tabela mapeada em arquivo:
+  BF_LIMITER_URI=bfmmap:///tmp/bfshop_limites.bin gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+Durante o teste, P50/P95/P99 por rota e por operação de serviço podem ser
+acompanhados ao vivo em GET /metrics (formato do Prometheus), sem esperar o
+relatório HTML:
+  curl -s http://localhost:5000/metrics | grep quantile
+
+Para ver se o lock do storage em memória limita o throughput, o profiler de
+contenção dá espera e retenção por operação (add, get, get_all, delete...):
+  BF_PERFIL_DE_LOCKS=1 python app.py
+  curl -s http://localhost:5000/admin/locks
+
 Critério de aprovação:
   - Throughput médio >= 2.000 req/s durante a janela de 60s
   - Taxa de erro < 1%
   - P95 de tempo de resposta < 500ms
 """
 import random
+import uuid
 from locust import HttpUser, task, between
 
 
@@ -60,7 +83,13 @@ class UsuarioBlackFriday(HttpUser):
                 {"produto_id": random.randint(1, 50), "quantidade": random.randint(1, 2)}
             ]
         }
-        self.client.post("/pedidos", json=payload, name="POST /pedidos")
+        # Como um cliente móvel: a repetição após timeout ou 5xx leva a mesma
+        # Idempotency-Key, e o servidor devolve o pedido já criado em vez de
+        # criar outro.
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        resp = self.client.post("/pedidos", json=payload, headers=headers, name="POST /pedidos")
+        if resp.status_code == 0 or resp.status_code >= 500:
+            self.client.post("/pedidos", json=payload, headers=headers, name="POST /pedidos (repetição)")
 
     @task(1)
     def verificar_saude(self):
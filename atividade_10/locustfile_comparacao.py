@@ -0,0 +1,76 @@
+"""
+Comparação de Carga — servidor Flask com threads vs. app assíncrono (ASGI)
+Meta: com o mesmo perfil de usuário, o app ASGI sustenta throughput igual ou maior
+com P95 menor, usando um único processo e um único event loop.
+
+Os dois servidores recebem a mesma carga ao mesmo tempo: metade dos usuários vai
+para cada um, e as requisições aparecem no relatório com prefixo [threads] ou
+[asgi], lado a lado na mesma tabela.
+
+Comandos para executar (três terminais):
+  python app.py                                     # Flask threaded, porta 5000
+  uvicorn app_asgi:app --host 0.0.0.0 --port 8000   # ASGI, porta 8000
+  locust -f locustfile_comparacao.py --headless -u 2000 -r 100 --run-time 60s \\
+    --html relatorio_comparacao.html
+
+Não passar --host: cada classe de usuário já aponta para o seu servidor.
+
+Critério de comparação:
+  - Requests/s e P95 de "[asgi] GET /produtos" vs. "[threads] GET /produtos"
+  - Taxa de erro (exceto 429) < 1% em ambos
+"""
+import random
+from locust import HttpUser, task, between
+
+
+class _UsuarioComparacao(HttpUser):
+    """
+    Mesmo comportamento e mesmos pesos de UsuarioBlackFriday (locustfile_carga.py).
+    """
+    abstract = True
+    wait_time = between(0.1, 0.5)
+    prefixo = ""
+
+    def _get(self, caminho: str, nome: str):
+        with self.client.get(caminho, catch_response=True, name=f"{self.prefixo} {nome}") as resp:
+            # 429 é proteção intencional, igual em locustfile_estresse.py; 422 é
+            # estoque esgotado, resposta de negócio e não falha do servidor.
+            if resp.status_code in (200, 429):
+                resp.success()
+
+    def _post(self, caminho: str, payload: dict, nome: str):
+        with self.client.post(caminho, json=payload, catch_response=True, name=f"{self.prefixo} {nome}") as resp:
+            if resp.status_code in (200, 201, 422, 429):
+                resp.success()
+
+    @task(5)
+    def listar_produtos(self):
+        self._get("/produtos", "GET /produtos")
+
+    @task(3)
+    def buscar_produto(self):
+        self._get(f"/produtos/{random.randint(1, 50)}", "GET /produtos/{id}")
+
+    @task(2)
+    def adicionar_carrinho(self):
+        payload = {"produto_id": random.randint(1, 50), "quantidade": random.randint(1, 3)}
+        self._post("/carrinho", payload, "POST /carrinho")
+
+    @task(1)
+    def criar_pedido(self):
+        payload = {"itens": [{"produto_id": random.randint(1, 50), "quantidade": 1}]}
+        self._post("/pedidos", payload, "POST /pedidos")
+
+    @task(1)
+    def verificar_saude(self):
+        self._get("/saude", "GET /saude")
+
+
+class UsuarioServidorThreads(_UsuarioComparacao):
+    host = "http://localhost:5000"
+    prefixo = "[threads]"
+
+
+class UsuarioServidorAsgi(_UsuarioComparacao):
+    host = "http://localhost:8000"
+    prefixo = "[asgi]"
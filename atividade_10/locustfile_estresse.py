@@ -10,6 +10,9 @@ Interpretação do ponto de quebra (breakpoint):
   - O sistema "aguenta" enquanto a taxa de erro de servidor (5xx) < 5%
   - Respostas 429 (rate limiting) são tratadas como SUCESSO — é comportamento esperado
     sob carga extrema e não indica falha do servidor
+  - Respostas 503 com Retry-After (load shedding: o servidor recusou cedo para
+    manter a latência das requisições aceitas) também; um 503 sem Retry-After
+    continua sendo falha
   - O breakpoint é o número de usuários onde erros 5xx atingem 5%
   - Meta: > 15.000 usuários sem atingir o breakpoint
 
@@ -22,6 +25,10 @@ import logging
 from locust import HttpUser, task, between, events
 
 
+def _recusa_intencional(resp) -> bool:
+    return resp.status_code == 429 or (resp.status_code == 503 and "Retry-After" in resp.headers)
+
+
 class UsuarioEstresse(HttpUser):
     """
     Usuário de estresse com think time reduzido para maximizar a pressão no servidor.
@@ -38,9 +45,10 @@ class UsuarioEstresse(HttpUser):
             catch_response=True,
             name="GET /produtos",
         ) as resp:
-            if resp.status_code == 429:
-                # Locust contabilizaria 429 como falha por padrão; override para success
-                # porque rate limiting é proteção intencional do servidor, não um erro.
+            if _recusa_intencional(resp):
+                # Locust contabilizaria 429/503 como falha por padrão; override para
+                # success porque rate limiting e load shedding são proteção
+                # intencional do servidor, não um erro.
                 resp.success()
             elif resp.status_code >= 500:
                 resp.failure(f"Erro de servidor: {resp.status_code}")
@@ -53,7 +61,7 @@ class UsuarioEstresse(HttpUser):
             catch_response=True,
             name="GET /produtos/{id}",
         ) as resp:
-            if resp.status_code in (200, 404, 429):
+            if resp.status_code in (200, 404) or _recusa_intencional(resp):
                 resp.success()
             elif resp.status_code >= 500:
                 resp.failure(f"Erro de servidor: {resp.status_code}")
@@ -0,0 +1,126 @@
+"""
+Teste de Prioridades — Locust (pico com load shedding)
+Meta: com o servidor saturado, a criação de pedidos mantém o SLO de latência e é
+o catálogo que absorve as recusas (503 + Retry-After).
+
+O servidor atende checkout (carrinho e pedidos) antes de navegação no catálogo,
+e o catálogo ocupa no máximo 70% do limite de concorrência (ver
+api_comum.criar_limitador_de_concorrencia). O perfil de usuário e os pesos das
+tarefas são os de UsuarioBlackFriday (locustfile_carga.py), só que com a carga
+do teste de estresse, para passar da capacidade do servidor.
+
+Comando para executar:
+  locust -f locustfile_prioridades.py --headless -u 15000 -r 500 --run-time 120s \\
+    --host http://localhost:5000 --html relatorio_prioridades.html
+
+Critério de aprovação:
+  - P95 de POST /pedidos < 500ms (mesmo SLO do teste de carga)
+  - Recusas por load shedding em POST /pedidos < 1% das requisições
+  - Recusas por load shedding em GET /produtos >= as de POST /pedidos
+    (proporcionalmente): quem degrada primeiro é o catálogo
+  - Nenhum 5xx além dos 503 com Retry-After
+"""
+import logging
+import random
+import uuid
+from collections import Counter
+from locust import HttpUser, task, between, events
+
+SLO_P95_PEDIDOS_MS = 500
+MAXIMO_RECUSAS_PEDIDOS = 0.01
+
+# Recusas por load shedding, por nome de requisição.
+_recusas = Counter()
+
+
+class UsuarioPrioridades(HttpUser):
+    """
+    Mesmos pesos de UsuarioBlackFriday: catálogo 5 + 3, carrinho 2, pedido 1.
+    """
+    wait_time = between(0.05, 0.2)
+
+    def _requisicao(self, metodo: str, caminho: str, nome: str, sucesso=(200,), **kwargs):
+        with self.client.request(metodo, caminho, catch_response=True, name=nome, **kwargs) as resp:
+            if resp.status_code == 503 and "Retry-After" in resp.headers:
+                # Recusa intencional: contada à parte para comparar as classes
+                # de tráfego, sem entrar na taxa de falha.
+                _recusas[nome] += 1
+                resp.success()
+            elif resp.status_code in sucesso or resp.status_code == 429:
+                resp.success()
+            else:
+                resp.failure(f"Status inesperado: {resp.status_code}")
+
+    @task(5)
+    def listar_produtos(self):
+        self._requisicao("GET", "/produtos", "GET /produtos")
+
+    @task(3)
+    def buscar_produto(self):
+        produto_id = random.randint(1, 50)
+        self._requisicao("GET", f"/produtos/{produto_id}", "GET /produtos/{id}", sucesso=(200, 404))
+
+    @task(2)
+    def adicionar_carrinho(self):
+        payload = {
+            "produto_id": random.randint(1, 50),
+            "quantidade": random.randint(1, 3),
+        }
+        self._requisicao("POST", "/carrinho", "POST /carrinho", sucesso=(200, 201, 404, 422), json=payload)
+
+    @task(1)
+    def criar_pedido(self):
+        payload = {
+            "itens": [
+                {"produto_id": random.randint(1, 50), "quantidade": random.randint(1, 2)}
+            ]
+        }
+        # 422 é estoque esgotado: resposta de negócio, não falha do servidor.
+        self._requisicao(
+            "POST", "/pedidos", "POST /pedidos", sucesso=(201, 404, 422),
+            json=payload, headers={"Idempotency-Key": str(uuid.uuid4())},
+        )
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    _recusas.clear()
+
+
+def _taxa_de_recusa(environment, metodo: str, nome: str) -> float:
+    entrada = environment.stats.get(nome, metodo)
+    return _recusas[nome] / entrada.num_requests if entrada.num_requests else 0.0
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    pedidos = environment.stats.get("POST /pedidos", "POST")
+    catalogo = environment.stats.get("GET /produtos", "GET")
+    p95_pedidos = pedidos.get_response_time_percentile(0.95) or 0
+    p95_catalogo = catalogo.get_response_time_percentile(0.95) or 0
+    recusa_pedidos = _taxa_de_recusa(environment, "POST", "POST /pedidos")
+    recusa_catalogo = _taxa_de_recusa(environment, "GET", "GET /produtos")
+
+    logging.info("=" * 60)
+    logging.info("[PRIORIDADES] Checkout vs. catálogo sob pico")
+    logging.info(f"  POST /pedidos: P95 {p95_pedidos:.0f}ms, recusadas {recusa_pedidos:.2%}")
+    logging.info(f"  GET /produtos: P95 {p95_catalogo:.0f}ms, recusadas {recusa_catalogo:.2%}")
+    logging.info(f"  Falhas (fora recusas intencionais): {environment.stats.total.num_failures}")
+
+    reprovacoes = []
+    if p95_pedidos >= SLO_P95_PEDIDOS_MS:
+        reprovacoes.append(f"P95 de POST /pedidos {p95_pedidos:.0f}ms >= {SLO_P95_PEDIDOS_MS}ms")
+    if recusa_pedidos >= MAXIMO_RECUSAS_PEDIDOS:
+        reprovacoes.append(f"{recusa_pedidos:.2%} dos pedidos recusados")
+    if recusa_pedidos > recusa_catalogo:
+        reprovacoes.append("checkout recusado proporcionalmente mais que o catálogo")
+    if environment.stats.total.num_failures:
+        reprovacoes.append(f"{environment.stats.total.num_failures} falhas")
+
+    if reprovacoes:
+        for motivo in reprovacoes:
+            logging.info(f"  REPROVADO: {motivo}")
+        environment.process_exit_code = 1
+    else:
+        logging.info("  RESULTADO: PASSOU — checkout manteve o SLO e o catálogo degradou primeiro")
+    logging.info("=" * 60)
@@ -0,0 +1,215 @@
+import bisect
+import functools
+import inspect
+import itertools
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Métricas do processo no formato texto do Prometheus (GET /metrics), para
+# acompanhar P50/P95/P99 ao vivo em vez de só no relatório HTML do Locust.
+#
+# As latências vão para histogramas no estilo HDR: buckets log-lineares, com
+# _SUB_BUCKETS subdivisões iguais por potência de 2, de ~1µs a ~64s. Registrar
+# uma amostra é um frexp e um incremento de lista, sem alocação nem ordenação;
+# o quantil lido tem erro relativo de no máximo 1/_SUB_BUCKETS (~3%), e a
+# memória é fixa, independente do número de amostras.
+#
+# Os quantis cobrem só as duas últimas janelas (1 a 2 minutos, por padrão):
+# depois de uma hora de pico, um quantil desde o início do processo quase não
+# se mexeria mais. _sum e _count são acumulados, como o Prometheus espera de um
+# summary.
+
+_SUB_BUCKETS = 32
+# frexp(v) = (m, e) com v = m * 2**e e 0.5 <= m < 1: e = -19 em ~1µs, e = 7 em 64s.
+_EXPOENTE_MINIMO = -19
+_EXPOENTE_MAXIMO = 7
+_N_BUCKETS = (_EXPOENTE_MAXIMO - _EXPOENTE_MINIMO) * _SUB_BUCKETS
+
+QUANTIS = (0.5, 0.95, 0.99)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _bucket(valor: float) -> int:
+    if valor <= 0:
+        return 0
+    m, e = math.frexp(valor)
+    i = (e - _EXPOENTE_MINIMO) * _SUB_BUCKETS + int((m - 0.5) * 2 * _SUB_BUCKETS)
+    return 0 if i < 0 else min(i, _N_BUCKETS - 1)
+
+
+def _limite_superior(bucket: int) -> float:
+    e, sub = divmod(bucket, _SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 1) / (2 * _SUB_BUCKETS), e + _EXPOENTE_MINIMO)
+
+
+class LatencyHistogram:
+    def __init__(self, janela: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        if janela <= 0:
+            raise ValueError("janela deve ser maior que zero")
+        self.janela = janela
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._inicio_da_janela = clock()
+        self._atual = [0] * _N_BUCKETS
+        self._anterior = [0] * _N_BUCKETS
+        self.contagem = 0
+        self.soma = 0.0
+
+    def _rodar(self, agora: float) -> None:
+        passadas = int((agora - self._inicio_da_janela) // self.janela)
+        # Mais de uma janela sem amostras: a anterior também já saiu do período.
+        self._anterior = self._atual if passadas == 1 else [0] * _N_BUCKETS
+        self._atual = [0] * _N_BUCKETS
+        self._inicio_da_janela += passadas * self.janela
+
+    def registrar(self, segundos: float) -> None:
+        bucket = _bucket(segundos)
+        with self._lock:
+            agora = self._clock()
+            if agora - self._inicio_da_janela >= self.janela:
+                self._rodar(agora)
+            self._atual[bucket] += 1
+            self.contagem += 1
+            self.soma += segundos
+
+    def quantis(self, quantis: Sequence[float] = QUANTIS) -> List[Optional[float]]:
+        """Limite superior do bucket de cada quantil nas duas últimas janelas; None sem amostras."""
+        with self._lock:
+            agora = self._clock()
+            if agora - self._inicio_da_janela >= self.janela:
+                self._rodar(agora)
+            acumuladas = list(itertools.accumulate(a + b for a, b in zip(self._atual, self._anterior)))
+        total = acumuladas[-1]
+        if not total:
+            return [None] * len(quantis)
+        return [_limite_superior(bisect.bisect_left(acumuladas, max(1, math.ceil(q * total)))) for q in quantis]
+
+
+class Contador:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valor = 0.0
+
+    def incrementar(self, valor: float = 1) -> None:
+        with self._lock:
+            self.valor += valor
+
+
+# Coletor: função chamada a cada exportação, que devolve amostras já prontas
+# (nome, tipo, ajuda, rótulos, valor) — para contadores mantidos por outros
+# objetos, como os locks dos storages, sem duplicá-los aqui.
+Amostra = Tuple[str, str, str, Dict[str, str], float]
+
+
+class MetricsRegistry:
+    def __init__(self, janela: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.janela = janela
+        self._clock = clock
+        self._lock = threading.Lock()
+        # nome -> (tipo, ajuda)
+        self._familias: Dict[str, Tuple[str, str]] = {}
+        self._series: Dict[Tuple[str, tuple], object] = {}
+        self._coletores: List[Callable[[], Iterable[Amostra]]] = []
+
+    def _serie(self, nome: str, tipo: str, ajuda: str, rotulos: dict, criar: Callable[[], object]):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        serie = self._series.get(chave)
+        if serie is not None:
+            return serie
+        with self._lock:
+            familia = self._familias.setdefault(nome, (tipo, ajuda))
+            if familia[0] != tipo:
+                raise ValueError(f"Métrica {nome} já registrada como {familia[0]}")
+            return self._series.setdefault(chave, criar())
+
+    def histograma(self, nome: str, ajuda: str, **rotulos: str) -> LatencyHistogram:
+        return self._serie(nome, "summary", ajuda, rotulos, lambda: LatencyHistogram(self.janela, self._clock))
+
+    def contador(self, nome: str, ajuda: str, **rotulos: str) -> Contador:
+        return self._serie(nome, "counter", ajuda, rotulos, Contador)
+
+    def registrar_coletor(self, coletor: Callable[[], Iterable[Amostra]]) -> None:
+        self._coletores.append(coletor)
+
+    def _linhas(self) -> Dict[str, List[str]]:
+        linhas: Dict[str, List[str]] = {}
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: item[0])
+            familias = dict(self._familias)
+        for (nome, rotulos), serie in series:
+            tipo, ajuda = familias[nome]
+            saida = linhas.setdefault(nome, _cabecalho(nome, tipo, ajuda))
+            rotulos = dict(rotulos)
+            if isinstance(serie, LatencyHistogram):
+                for q, valor in zip(QUANTIS, serie.quantis(QUANTIS)):
+                    saida.append(_linha(nome, {**rotulos, "quantile": str(q)}, math.nan if valor is None else valor))
+                saida.append(_linha(f"{nome}_sum", rotulos, serie.soma))
+                saida.append(_linha(f"{nome}_count", rotulos, serie.contagem))
+            else:
+                saida.append(_linha(nome, rotulos, serie.valor))
+        for coletor in self._coletores:
+            for nome, tipo, ajuda, rotulos, valor in coletor():
+                linhas.setdefault(nome, _cabecalho(nome, tipo, ajuda)).append(_linha(nome, rotulos, valor))
+        return linhas
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _linha(nome: str, rotulos: dict, valor: float) -> str:
+    if rotulos:
+        nome += "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in rotulos.items()) + "}"
+    if math.isnan(valor):
+        return f"{nome} NaN"
+    return f"{nome} {valor:.17g}" if isinstance(valor, float) else f"{nome} {valor}"
+
+
+def _cabecalho(nome: str, tipo: str, ajuda: str) -> List[str]:
+    return [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+
+
+def exportar(*registros: MetricsRegistry) -> str:
+    """Formato texto do Prometheus com as métricas de todos os registros."""
+    linhas = []
+    for registro in registros:
+        for familia in registro._linhas().values():
+            linhas.extend(familia)
+    return "\n".join(linhas) + "\n"
+
+
+# Registro do processo, usado por @medir nos serviços: as mesmas instâncias de
+# serviço atendem todas as rotas, então as séries são compartilhadas.
+REGISTRO = MetricsRegistry()
+LATENCIA_DE_SERVICO = "bfshop_servico_latencia_segundos"
+
+
+def medir(funcao):
+    """Registra a duração de cada chamada em LATENCIA_DE_SERVICO{operacao="Classe.metodo"}."""
+    histograma = REGISTRO.histograma(
+        LATENCIA_DE_SERVICO,
+        "Latência dos métodos da camada de serviço, incluindo a latência simulada de banco.",
+        operacao=funcao.__qualname__,
+    )
+    perf_counter = time.perf_counter
+
+    if inspect.iscoroutinefunction(funcao):
+        @functools.wraps(funcao)
+        async def medida_async(*args, **kwargs):
+            inicio = perf_counter()
+            try:
+                return await funcao(*args, **kwargs)
+            finally:
+                histograma.registrar(perf_counter() - inicio)
+        return medida_async
+
+    @functools.wraps(funcao)
+    def medida(*args, **kwargs):
+        inicio = perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            histograma.registrar(perf_counter() - inicio)
+    return medida
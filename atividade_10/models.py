@@ -1,5 +1,8 @@
+import threading
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
-from typing import Optional, List
+from typing import Iterable, Optional, Union
 from enum import Enum
 
 
@@ -9,7 +12,25 @@ class StatusPedido(Enum):
     CANCELADO = "CANCELADO"
 
 
-@dataclass
+# Transições permitidas entre status. Cancelar devolve o estoque, inclusive de
+# um pedido já confirmado; CANCELADO é final.
+TRANSICOES_DE_STATUS = {
+    StatusPedido.AGUARDANDO: frozenset({StatusPedido.CONFIRMADO, StatusPedido.CANCELADO}),
+    StatusPedido.CONFIRMADO: frozenset({StatusPedido.CANCELADO}),
+    StatusPedido.CANCELADO: frozenset(),
+}
+
+
+class TransicaoInvalida(ValueError):
+    # Subclasse de ValueError como os demais erros de regra de negócio; a API a
+    # distingue para responder 409 (conflito com o estado atual) em vez de 404/422.
+    pass
+
+
+# slots=True: sem __dict__ por instância. Com milhões de pedidos e itens em
+# memória depois de uma promoção, o dict de atributos de cada objeto era a maior
+# parte do custo.
+@dataclass(slots=True)
 class Produto:
     nome: str
     preco: float
@@ -27,16 +48,87 @@ class Produto:
             raise ValueError("Estoque não pode ser negativo")
 
 
-@dataclass
+@dataclass(slots=True)
 class ItemCarrinho:
     produto_id: int
     quantidade: int
     preco_unitario: float
 
 
-@dataclass
+class TabelaDeItens:
+    # Armazenamento colunar dos itens de pedido: uma coluna array por campo, com
+    # os itens de todos os pedidos lado a lado. Cada item custa 24 bytes (dois
+    # int64 e um double) em vez de um objeto ItemCarrinho mais um float e a lista
+    # que o contém. Só cresce: itens não são removidos, como os pedidos.
+    def __init__(self):
+        self._produto_ids = array("q")
+        self._quantidades = array("q")
+        self._precos = array("d")
+        # Calcular o início e estender as três colunas precisa ser atômico, senão
+        # os itens de dois pedidos gravados ao mesmo tempo se intercalariam.
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._produto_ids)
+
+    def adicionar(self, itens: Iterable[ItemCarrinho]) -> "ItensPedido":
+        with self._lock:
+            inicio = len(self._produto_ids)
+            for item in itens:
+                self._produto_ids.append(item.produto_id)
+                self._quantidades.append(item.quantidade)
+                self._precos.append(item.preco_unitario)
+            return ItensPedido(self, inicio, len(self._produto_ids) - inicio)
+
+    def _item(self, posicao: int) -> ItemCarrinho:
+        return ItemCarrinho(self._produto_ids[posicao], self._quantidades[posicao], self._precos[posicao])
+
+
+class ItensPedido(Sequence):
+    # Os itens de um pedido como uma fatia de TabelaDeItens. Os ItemCarrinho são
+    # criados na leitura; quem só guarda o pedido não paga por eles.
+    __slots__ = ("_tabela", "_inicio", "_tamanho")
+
+    def __init__(self, tabela: TabelaDeItens, inicio: int, tamanho: int):
+        self._tabela = tabela
+        self._inicio = inicio
+        self._tamanho = tamanho
+
+    def __len__(self) -> int:
+        return self._tamanho
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self[i] for i in range(*indice.indices(self._tamanho))]
+        if indice < 0:
+            indice += self._tamanho
+        if not 0 <= indice < self._tamanho:
+            raise IndexError("índice de item fora do pedido")
+        return self._tabela._item(self._inicio + indice)
+
+    def __iter__(self):
+        for posicao in range(self._inicio, self._inicio + self._tamanho):
+            yield self._tabela._item(posicao)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ItensPedido, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ItensPedido({list(self)!r})"
+
+    def __reduce__(self):
+        # Serializada (pickle do SQLiteStorage) como lista simples, sem arrastar
+        # a tabela inteira junto.
+        return list, (list(self),)
+
+
+@dataclass(slots=True)
 class Pedido:
-    itens: List[ItemCarrinho]
+    # Lista de ItemCarrinho ao ser montado; o PedidoRepository troca por
+    # ItensPedido (colunar) ao gravar.
+    itens: Union[list, ItensPedido]
     total: float
     id: Optional[int] = None
     # default_factory é necessário porque dataclass não aceita objetos mutáveis
@@ -0,0 +1,87 @@
+import threading
+from collections import Counter
+from typing import Iterable
+
+from models import Pedido, StatusPedido
+
+# Agregados de vendas mantidos a cada pedido criado ou mudança de status, para
+# que o relatório custe O(produtos vendidos) em vez de varrer todos os pedidos.
+#
+# Valores em centavos (int): somar milhões de floats acumularia erro de
+# arredondamento; a conversão para reais só acontece na leitura.
+
+
+def _centavos(valor: float) -> int:
+    return round(valor * 100)
+
+
+class AgregadosDeVendas:
+    def __init__(self, pedidos: Iterable[Pedido] = ()):
+        # Um lock só para todos os contadores: cada atualização são poucas
+        # operações de dict, e o relatório precisa de uma leitura consistente.
+        self._lock = threading.Lock()
+        self._pedidos_por_status: Counter = Counter()
+        self._centavos_por_status: Counter = Counter()
+        # Vendas por produto contam apenas pedidos não cancelados.
+        self._unidades_por_produto: Counter = Counter()
+        self._centavos_por_produto: Counter = Counter()
+        for pedido in pedidos:
+            self.registrar_pedido(pedido)
+
+    def registrar_pedido(self, pedido: Pedido) -> None:
+        self._contar_pedido(pedido, 1)
+
+    def remover_pedido(self, pedido: Pedido) -> None:
+        """Desfaz registrar_pedido (ex.: a gravação do pedido falhou)."""
+        self._contar_pedido(pedido, -1)
+
+    def _contar_pedido(self, pedido: Pedido, sinal: int) -> None:
+        with self._lock:
+            self._pedidos_por_status[pedido.status] += sinal
+            self._centavos_por_status[pedido.status] += sinal * _centavos(pedido.total)
+            if pedido.status is not StatusPedido.CANCELADO:
+                self._somar_itens(pedido, sinal)
+
+    def registrar_mudanca_de_status(self, pedido: Pedido, anterior: StatusPedido) -> None:
+        """Move o pedido de `anterior` para pedido.status nos contadores."""
+        if anterior is pedido.status:
+            return
+        with self._lock:
+            total = _centavos(pedido.total)
+            self._pedidos_por_status[anterior] -= 1
+            self._centavos_por_status[anterior] -= total
+            self._pedidos_por_status[pedido.status] += 1
+            self._centavos_por_status[pedido.status] += total
+            if pedido.status is StatusPedido.CANCELADO:
+                self._somar_itens(pedido, -1)
+            elif anterior is StatusPedido.CANCELADO:
+                self._somar_itens(pedido, 1)
+
+    def _somar_itens(self, pedido: Pedido, sinal: int) -> None:
+        for item in pedido.itens:
+            self._unidades_por_produto[item.produto_id] += sinal * item.quantidade
+            self._centavos_por_produto[item.produto_id] += sinal * _centavos(item.preco_unitario * item.quantidade)
+
+    def relatorio(self) -> dict:
+        with self._lock:
+            por_status = {
+                status.value: {
+                    "pedidos": self._pedidos_por_status[status],
+                    "receita": self._centavos_por_status[status] / 100,
+                }
+                for status in StatusPedido
+            }
+            produtos = [
+                {
+                    "produto_id": produto_id,
+                    "unidades": self._unidades_por_produto[produto_id],
+                    "receita": self._centavos_por_produto[produto_id] / 100,
+                }
+                for produto_id in sorted(self._unidades_por_produto)
+                if self._unidades_por_produto[produto_id]
+            ]
+            receita = sum(
+                centavos for status, centavos in self._centavos_por_status.items()
+                if status is not StatusPedido.CANCELADO
+            )
+        return {"receita_total": receita / 100, "por_status": por_status, "produtos": produtos}
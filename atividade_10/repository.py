@@ -1,46 +1,212 @@
-from typing import Optional
-from models import Produto, Pedido
-from storage import InMemoryStorage
+import itertools
+from contextlib import contextmanager, ExitStack
+from typing import Iterable, Iterator, List, Optional, Sequence
+from indexes import HashIndex, PrefixIndex, SortedIndex, corresponde
+from journal import OrderJournal
+from models import ItensPedido, Produto, Pedido, StatusPedido, TabelaDeItens
+from storage import InMemoryStorage, ShardedInMemoryStorage
+
+
+class IdAllocator:
+    # Ids sequenciais sem lock: next() de itertools.count é executado inteiro em C
+    # sob o GIL, então duas threads nunca recebem o mesmo valor — diferente de
+    # um contador com `+= 1`, que lê e grava em passos separados e pode repetir ids
+    # sob concorrência.
+    def __init__(self, start: int = 1):
+        self._contador = itertools.count(start)
+
+    def next_id(self) -> int:
+        return next(self._contador)
+
+
+def _declarar_indices(storage, indices: dict) -> None:
+    # Só o InMemoryStorage mantém índices secundários; nos demais backends as
+    # consultas por índice caem na varredura de find_all.
+    if hasattr(storage, "add_index"):
+        for nome, indice in indices.items():
+            storage.add_index(nome, indice)
+
+
+def _inserir(storage, ids: IdAllocator, item) -> None:
+    # Backends compartilhados entre processos alocam o id no próprio storage
+    # (insert_many): cada worker tem o seu IdAllocator, e dois workers partindo
+    # do mesmo max_id entregariam o mesmo id a pedidos diferentes.
+    if hasattr(storage, "insert_many"):
+        storage.insert_many([item])
+    else:
+        item.id = ids.next_id()
+        storage.add(item.id, item)
+
+
+def _tem_indice(storage, nome: str) -> bool:
+    return nome in getattr(storage, "indexes", {})
 
 
 class ProdutoRepository:
     def __init__(self, storage: InMemoryStorage = None):
         self.storage = storage or InMemoryStorage()
-        self._next_id = 1
+        # Continua a partir do maior id já gravado: com um storage durável, um
+        # restart não pode reaproveitar ids e sobrescrever registros existentes.
+        self._ids = IdAllocator((self.storage.max_id() or 0) + 1)
+        _declarar_indices(self.storage, {
+            "preco": SortedIndex(lambda p: p.preco),
+            "nome": PrefixIndex(lambda p: p.nome),
+        })
+
+    @property
+    def version(self) -> int:
+        # Avança a cada save/delete; camadas acima usam o valor para saber se
+        # o catálogo mudou sem precisar lê-lo.
+        return self.storage.version
 
     def save(self, produto: Produto) -> Produto:
         # Funciona tanto como insert (id None) quanto como update (id existente),
         # simplificando o contrato da camada de serviço.
         if produto.id is None:
-            produto.id = self._next_id
-            self._next_id += 1
-        self.storage.add(produto.id, produto)
+            _inserir(self.storage, self._ids, produto)
+        else:
+            self.storage.add(produto.id, produto)
         return produto
 
     def find_by_id(self, id: int) -> Optional[Produto]:
         return self.storage.get(id)
 
-    def find_all(self) -> list:
+    def find_many(self, ids: Iterable[int]) -> list:
+        return self.storage.get_many(ids)
+
+    def find_page(self, after_id: Optional[int], limit: int) -> list:
+        return self.storage.get_page(after_id, limit)
+
+    def find_all(self) -> Sequence:
         return self.storage.get_all()
 
+    def iter_after(self, after_id: Optional[int], batch_size: int) -> Iterator[Produto]:
+        # Produtos com id maior que after_id, em ordem de id, lidos uma página
+        # por vez: ao contrário de find_all, nunca materializa o catálogo inteiro.
+        while True:
+            pagina = self.storage.get_page(after_id, batch_size)
+            yield from pagina
+            if len(pagina) < batch_size:
+                return
+            after_id = pagina[-1].id
+
+    def find_by_price_range(self, minimo: Optional[float] = None, maximo: Optional[float] = None) -> list:
+        # Ordenado por preço (e id, no empate); None deixa o lado da faixa aberto.
+        if _tem_indice(self.storage, "preco"):
+            return self.storage.lookup("preco", minimo, maximo)
+        produtos = [
+            p for p in self.storage.get_all()
+            if (minimo is None or p.preco >= minimo) and (maximo is None or p.preco <= maximo)
+        ]
+        return sorted(produtos, key=lambda p: (p.preco, p.id))
+
+    def search_by_name(self, termo: str) -> list:
+        # Produtos em que cada palavra do termo é prefixo de alguma palavra do
+        # nome, sem diferenciar maiúsculas nem acentos; ordenados por id.
+        if _tem_indice(self.storage, "nome"):
+            return self.storage.lookup("nome", termo)
+        return sorted((p for p in self.storage.get_all() if corresponde(termo, p.nome)), key=lambda p: p.id)
+
+    @contextmanager
+    def lock_items(self, ids: Iterable[int]):
+        # Adquire os locks dos produtos sempre em ordem crescente de id: dois
+        # pedidos com os mesmos produtos em ordens diferentes nunca ficam
+        # esperando um pelo outro (deadlock). Só os produtos envolvidos ficam
+        # bloqueados; o resto do catálogo segue disponível.
+        with ExitStack() as stack:
+            for id in sorted(set(ids)):
+                stack.enter_context(self.storage.item_lock(id))
+            yield
+
     def delete(self, id: int) -> bool:
         return self.storage.delete(id)
 
 
 class PedidoRepository:
-    def __init__(self, storage: InMemoryStorage = None):
+    def __init__(self, storage: InMemoryStorage = None, journal: OrderJournal = None):
         self.storage = storage or InMemoryStorage()
-        self._next_id = 1
+        # Storage visível a outros processos (ex.: SQLite com vários workers), que
+        # aloca os ids dos pedidos novos.
+        self.compartilhado = hasattr(self.storage, "insert_many")
+        if journal is not None and self.compartilhado:
+            # O journal é por processo e grava antes do storage; com o id alocado
+            # por um storage compartilhado (e já durável) não há o que registrar.
+            raise ValueError("Journal de pedidos só é suportado com storage em memória")
+        self.journal = journal
+        # Só storages em memória guardam os próprios objetos; os demais gravam
+        # uma cópia serializada, que volta com itens em lista a cada get. Lá, a
+        # tabela colunar do processo só cresceria a cada regravação, sem nunca
+        # ser lida.
+        self._itens = (
+            TabelaDeItens() if isinstance(self.storage, (InMemoryStorage, ShardedInMemoryStorage)) else None
+        )
+        # Com journal, o storage em memória é reconstruído a partir do log antes
+        # de calcular o próximo id.
+        if journal is not None:
+            for pedido in journal.replay():
+                self.storage.add(pedido.id, self._compactar(pedido))
+        # Continua a partir do maior id já gravado: com um storage durável, um
+        # restart não pode reaproveitar ids e sobrescrever registros existentes.
+        self._ids = IdAllocator((self.storage.max_id() or 0) + 1)
+        _declarar_indices(self.storage, {"status": HashIndex(lambda p: p.status)})
+
+    @property
+    def version(self) -> int:
+        return self.storage.version
 
     def save(self, pedido: Pedido) -> Pedido:
-        if pedido.id is None:
-            pedido.id = self._next_id
-            self._next_id += 1
-        self.storage.add(pedido.id, pedido)
+        return self.save_many([pedido])[0]
+
+    def save_many(self, pedidos: List[Pedido]) -> List[Pedido]:
+        # Com journal, todos os pedidos entram no mesmo group commit: um lote de
+        # pedidos espera um fsync, não um por pedido.
+        if self.compartilhado:
+            # Storage compartilhado entre processos: os pedidos novos recebem o id
+            # do próprio storage, numa única transação (sem journal, ver __init__).
+            novos = [self._compactar(p) for p in pedidos if p.id is None]
+            for pedido in pedidos:
+                if pedido.id is not None:
+                    self.storage.add(pedido.id, self._compactar(pedido))
+            self.storage.insert_many(novos)
+            return pedidos
+        for pedido in pedidos:
+            if pedido.id is None:
+                pedido.id = self._ids.next_id()
+            self._compactar(pedido)
+        # Log antes do storage: um pedido só fica visível depois de durável.
+        if self.journal is not None:
+            self.journal.append_many(pedidos)
+        for pedido in pedidos:
+            self.storage.add(pedido.id, pedido)
+        return pedidos
+
+    def lock_order(self, id: int):
+        # Serializa mudanças de status de um mesmo pedido (ex.: dois cancelamentos
+        # simultâneos devolveriam o estoque duas vezes). Pedidos diferentes não
+        # disputam nenhum lock.
+        return self.storage.item_lock(id)
+
+    def _compactar(self, pedido: Pedido) -> Pedido:
+        # Itens passam para a tabela colunar na primeira gravação; regravações
+        # (ex.: mudança de status) reaproveitam a mesma fatia.
+        if self._itens is not None and not isinstance(pedido.itens, ItensPedido):
+            pedido.itens = self._itens.adicionar(pedido.itens)
         return pedido
 
     def find_by_id(self, id: int) -> Optional[Pedido]:
         return self.storage.get(id)
 
-    def find_all(self) -> list:
+    def find_all(self) -> Sequence:
         return self.storage.get_all()
+
+    def find_by_status(
+        self, status: StatusPedido, after_id: Optional[int] = None, limit: Optional[int] = None
+    ) -> list:
+        # Até `limit` pedidos com id maior que after_id, ordenados por id.
+        if _tem_indice(self.storage, "status"):
+            return self.storage.lookup("status", status, after_id=after_id, limit=limit)
+        pedidos = sorted(
+            (p for p in self.storage.get_all() if p.status == status and (after_id is None or p.id > after_id)),
+            key=lambda p: p.id,
+        )
+        return pedidos[:limit]
@@ -1,40 +1,114 @@
-import time
-from typing import Optional
-from models import Produto, ItemCarrinho, Pedido
+import asyncio
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from models import Produto, ItemCarrinho, Pedido, StatusPedido, TRANSICOES_DE_STATUS, TransicaoInvalida
 from repository import ProdutoRepository, PedidoRepository
+from latency import DbLatencySimulator
+from metrics import medir
+from relatorios import AgregadosDeVendas
 
 
+def _inteiro(valor) -> bool:
+    # bool é subclasse de int, mas true não é uma quantidade.
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+# Os métodos públicos dos serviços levam @medir: a latência de cada operação
+# aparece em GET /metrics (ver metrics.py), separada da latência da rota.
 class ProdutoService:
-    def __init__(self, repository: ProdutoRepository = None):
+    def __init__(self, repository: ProdutoRepository = None, latency: DbLatencySimulator = None):
         self.repository = repository or ProdutoRepository()
+        # Latência de banco simulada em cada consulta. Padrão: 1ms constante,
+        # sem limite de conexões.
+        self.latency = latency or DbLatencySimulator()
 
+    @medir
     def cadastrar_produto(self, nome: str, preco: float, estoque: int) -> Produto:
         produto = Produto(nome=nome, preco=preco, estoque=estoque)
         produto.validar()
         return self.repository.save(produto)
 
-    def listar_produtos(self) -> list:
-        # sleep libera o GIL durante a espera, permitindo que outras threads
-        # executem em paralelo — essencial para o ganho de throughput nos testes
-        # de escalabilidade com ThreadPoolExecutor.
-        time.sleep(0.001)  # simula latência de I/O de banco de dados
+    @medir
+    def listar_produtos(self) -> Sequence:
+        self.latency.wait()  # simula latência de I/O de banco de dados
         return self.repository.find_all()
 
+    @medir
+    def listar_produtos_paginado(
+        self, limite: int, cursor: Optional[int] = None
+    ) -> Tuple[list, Optional[int]]:
+        # Retorna a página e o cursor da próxima (None na última). Um item a mais
+        # é lido só para saber se existe próxima página sem outra consulta.
+        self.latency.wait()
+        return self._listar_produtos_paginado(limite, cursor)
+
+    def _listar_produtos_paginado(self, limite: int, cursor: Optional[int]) -> Tuple[list, Optional[int]]:
+        produtos = self.repository.find_page(cursor, limite + 1)
+        if len(produtos) > limite:
+            produtos = produtos[:limite]
+            return produtos, produtos[-1].id
+        return produtos, None
+
+    @medir
     def buscar_produto(self, id: int) -> Optional[Produto]:
-        time.sleep(0.001)
+        self.latency.wait()
+        return self._buscar_produto(id)
+
+    def _buscar_produto(self, id: int) -> Produto:
         produto = self.repository.find_by_id(id)
         if produto is None:
             raise ValueError(f"Produto com id {id} não encontrado")
         return produto
 
+    @medir
+    def buscar_produtos(self, ids: List[int]) -> list:
+        # Uma única ida ao "banco" para todos os ids, em vez de uma latência
+        # por produto. Ids inexistentes são omitidos do resultado.
+        self.latency.wait()
+        return self.repository.find_many(ids)
+
+    @medir
+    def pesquisar_produtos(
+        self,
+        termo: Optional[str] = None,
+        preco_min: Optional[float] = None,
+        preco_max: Optional[float] = None,
+        limite: int = 100,
+    ) -> list:
+        self.latency.wait()
+        return self._pesquisar_produtos(termo, preco_min, preco_max, limite)
+
+    def _pesquisar_produtos(
+        self, termo: Optional[str], preco_min: Optional[float], preco_max: Optional[float], limite: int
+    ) -> list:
+        # Com termo, o índice de nome seleciona os candidatos (ordem de id) e a
+        # faixa de preço só filtra; sem termo, a própria faixa usa o índice de
+        # preço (ordem de preço).
+        if not termo:
+            return self.repository.find_by_price_range(preco_min, preco_max)[:limite]
+        produtos = []
+        for produto in self.repository.search_by_name(termo):
+            if preco_min is not None and produto.preco < preco_min:
+                continue
+            if preco_max is not None and produto.preco > preco_max:
+                continue
+            produtos.append(produto)
+            if len(produtos) == limite:
+                break
+        return produtos
+
+    @medir
     def atualizar_estoque(self, id: int, quantidade: int) -> Produto:
-        produto = self.repository.find_by_id(id)
-        if produto is None:
-            raise ValueError(f"Produto com id {id} não encontrado")
-        if produto.estoque < quantidade:
-            raise ValueError(f"Estoque insuficiente para o produto {id}")
-        produto.estoque -= quantidade
-        return self.repository.save(produto)
+        # Verificação e baixa sob o lock do produto: sem ele, duas threads podem
+        # ler o mesmo estoque, passar na verificação e vender além do disponível.
+        with self.repository.lock_items([id]):
+            produto = self.repository.find_by_id(id)
+            if produto is None:
+                raise ValueError(f"Produto com id {id} não encontrado")
+            if produto.estoque < quantidade:
+                raise ValueError(f"Estoque insuficiente para o produto {id}")
+            produto.estoque -= quantidade
+            return self.repository.save(produto)
 
 
 class PedidoService:
@@ -42,36 +116,277 @@ class PedidoService:
         self,
         produto_repo: ProdutoRepository = None,
         pedido_repo: PedidoRepository = None,
+        latency: DbLatencySimulator = None,
     ):
         self.produto_repo = produto_repo or ProdutoRepository()
         self.pedido_repo = pedido_repo or PedidoRepository()
+        self.latency = latency or DbLatencySimulator()
+        # Reconstruídos uma vez a partir dos pedidos já gravados (storage durável
+        # ou journal) e, daí em diante, atualizados a cada pedido. Com um storage
+        # compartilhado, os outros workers também gravam pedidos: os agregados
+        # passam a ser derivados só do storage (ver relatorio_de_vendas).
+        self._sincronizacao_das_vendas = threading.Lock()
+        self._versao_das_vendas = self.pedido_repo.version
+        self.vendas = AgregadosDeVendas(self.pedido_repo.find_all())
 
+    @medir
     def criar_pedido(self, itens: list) -> Pedido:
         """
         itens: lista de dicts com chaves produto_id e quantidade
         """
-        time.sleep(0.001)  # simula latência de transação no banco
-        itens_pedido = []
-        total = 0.0
+        self.latency.wait()  # simula latência de transação no banco
+        return self._criar_pedido(itens)
 
-        for item in itens:
-            produto_id = item["produto_id"]
-            quantidade = item["quantidade"]
+    @medir
+    def listar_pedidos_por_status(self, status: StatusPedido, limite: int = 100) -> list:
+        self.latency.wait()
+        return self.pedido_repo.find_by_status(status, limit=limite)
 
-            produto = self.produto_repo.find_by_id(produto_id)
-            if produto is None:
-                raise ValueError(f"Produto {produto_id} não encontrado")
-            if produto.estoque < quantidade:
-                raise ValueError(f"Estoque insuficiente para produto {produto_id}")
+    @medir
+    def criar_pedidos_em_lote(self, pedidos: List[list]) -> List[Union[Pedido, ValueError]]:
+        """
+        pedidos: lista de pedidos, cada um no mesmo formato de itens de criar_pedido.
+        Retorna, na mesma ordem, o Pedido criado ou o ValueError que o recusou.
+        """
+        # Uma única transação simulada para o lote inteiro. Cada pedido continua
+        # sendo reservado de forma atômica e independente: a recusa de um (ex.:
+        # estoque insuficiente) não desfaz nem impede os demais.
+        self.latency.wait()
+        return self._criar_pedidos_em_lote(pedidos)
+
+    def _criar_pedidos_em_lote(self, pedidos: List[list]) -> List[Union[Pedido, ValueError]]:
+        resultados: List[Union[Pedido, ValueError]] = []
+        for itens in pedidos:
+            try:
+                resultados.append(self._montar_pedido(itens))
+            except ValueError as e:
+                resultados.append(e)
+        # Os aceitos são gravados juntos, no mesmo group commit do journal.
+        self._gravar_pedidos([r for r in resultados if isinstance(r, Pedido)])
+        return resultados
+
+    def _criar_pedido(self, itens: list) -> Pedido:
+        return self._gravar_pedidos([self._montar_pedido(itens)])[0]
+
+    def _gravar_pedidos(self, pedidos: List[Pedido]) -> List[Pedido]:
+        # Os agregados recebem os pedidos antes de eles ficarem visíveis: depois
+        # do save, uma confirmação ou cancelamento concorrente já moveria o
+        # pedido de status nos agregados, e o registro feito em seguida o
+        # contaria de novo, com o status já alterado.
+        registrar = not self.pedido_repo.compartilhado
+        if registrar:
+            for pedido in pedidos:
+                self.vendas.registrar_pedido(pedido)
+        # O estoque já foi reservado: se a gravação (storage ou journal) falhar,
+        # nenhum dos pedidos existe, e reservas e agregados são desfeitos.
+        try:
+            self.pedido_repo.save_many(pedidos)
+        except BaseException:
+            for pedido in pedidos:
+                if registrar:
+                    self.vendas.remover_pedido(pedido)
+                self._devolver_estoque(pedido)
+            raise
+        return pedidos
+
+    @medir
+    def confirmar_pedido(self, id: int) -> Pedido:
+        self.latency.wait()
+        return self._mudar_status(id, StatusPedido.CONFIRMADO)
+
+    @medir
+    def cancelar_pedido(self, id: int) -> Pedido:
+        self.latency.wait()
+        return self._mudar_status(id, StatusPedido.CANCELADO)
 
+    def _buscar_pedido(self, id: int) -> Pedido:
+        pedido = self.pedido_repo.find_by_id(id)
+        if pedido is None:
+            raise ValueError(f"Pedido com id {id} não encontrado")
+        return pedido
+
+    def _mudar_status(self, id: int, novo: StatusPedido) -> Pedido:
+        # Verificado antes do lock para não criar locks para ids inexistentes.
+        self._buscar_pedido(id)
+        # Só o lock deste pedido e, no cancelamento, os dos seus produtos: o custo
+        # é O(itens do pedido) e o resto da loja segue sem esperar. A ordem é
+        # sempre pedido -> produtos, e a reserva de estoque nunca pega lock de
+        # pedido, então não há ciclo de espera entre os dois caminhos.
+        with self.pedido_repo.lock_order(id):
+            pedido = self._buscar_pedido(id)
+            anterior = pedido.status
+            if novo not in TRANSICOES_DE_STATUS[anterior]:
+                raise TransicaoInvalida(
+                    f"Pedido {id} está {anterior.value} e não pode ficar {novo.value}"
+                )
+            if novo is StatusPedido.CANCELADO:
+                self._devolver_estoque(pedido)
+            pedido.status = novo
+            self.pedido_repo.save(pedido)
+            if not self.pedido_repo.compartilhado:
+                self.vendas.registrar_mudanca_de_status(pedido, anterior)
+        return pedido
+
+    def _devolver_estoque(self, pedido: Pedido) -> None:
+        quantidades: Dict[int, int] = {}
+        for item in pedido.itens:
+            quantidades[item.produto_id] = quantidades.get(item.produto_id, 0) + item.quantidade
+        with self.produto_repo.lock_items(quantidades):
+            for produto_id, quantidade in quantidades.items():
+                produto = self.produto_repo.find_by_id(produto_id)
+                # Produto removido do catálogo depois da venda: não há estoque
+                # para onde devolver.
+                if produto is not None:
+                    produto.estoque += quantidade
+                    self.produto_repo.save(produto)
+
+    @medir
+    def relatorio_de_vendas(self) -> dict:
+        # Só lê os agregados em memória: sem ida ao "banco" e sem varrer pedidos.
+        if self.pedido_repo.compartilhado:
+            self._sincronizar_vendas()
+        return self.vendas.relatorio()
+
+    def _sincronizar_vendas(self) -> None:
+        # Storage compartilhado: a versão do storage é a mesma para todos os
+        # workers e muda a cada pedido gravado por qualquer um deles. Os
+        # agregados são refeitos a partir do storage quando ela mudou; lida antes
+        # da varredura, uma gravação concorrente só faz a próxima chamada
+        # refazê-los de novo.
+        with self._sincronizacao_das_vendas:
+            versao = self.pedido_repo.version
+            if versao != self._versao_das_vendas:
+                self.vendas = AgregadosDeVendas(self.pedido_repo.find_all())
+                self._versao_das_vendas = versao
+
+    def _montar_pedido(self, itens: list) -> Pedido:
+        # Valida e reserva o estoque; o pedido devolvido ainda não foi gravado.
+        # Todos os itens são validados antes da reserva: num lote, um item
+        # malformado que estourasse no meio deixaria a reserva dos pedidos
+        # anteriores feita e nunca gravada.
+        if not isinstance(itens, list):
+            raise ValueError("itens deve ser uma lista")
+        quantidades: Dict[int, int] = {}
+        for item in itens:
+            if not isinstance(item, dict) or not {"produto_id", "quantidade"} <= item.keys():
+                raise ValueError("Cada item deve ter produto_id e quantidade")
+            if not (_inteiro(item["produto_id"]) and _inteiro(item["quantidade"])):
+                raise ValueError("produto_id e quantidade devem ser inteiros")
+            if item["quantidade"] <= 0:
+                raise ValueError("Quantidade deve ser maior que zero")
+            # Itens repetidos do mesmo produto são somados: a verificação de
+            # estoque precisa considerar a quantidade total do pedido.
+            quantidades[item["produto_id"]] = (
+                quantidades.get(item["produto_id"], 0) + item["quantidade"]
+            )
+        produtos = self._reservar_estoque(quantidades)
+
+        itens_pedido = []
+        total = 0.0
+        for item in itens:
+            produto = produtos[item["produto_id"]]
             item_carrinho = ItemCarrinho(
-                produto_id=produto_id,
-                quantidade=quantidade,
+                produto_id=produto.id,
+                quantidade=item["quantidade"],
                 preco_unitario=produto.preco,
             )
             itens_pedido.append(item_carrinho)
-            total += produto.preco * quantidade
+            total += produto.preco * item["quantidade"]
 
         # round(total, 2) corrige acúmulo de erro de ponto flutuante em somas de preços.
-        pedido = Pedido(itens=itens_pedido, total=round(total, 2))
-        return self.pedido_repo.save(pedido)
+        return Pedido(itens=itens_pedido, total=round(total, 2))
+
+    def _reservar_estoque(self, quantidades: Dict[int, int]) -> Dict[int, Produto]:
+        # Reserva tudo-ou-nada: todos os produtos do pedido ficam bloqueados
+        # enquanto o estoque é verificado e baixado, então ou o pedido inteiro é
+        # reservado ou nenhum estoque é alterado. A latência simulada fica fora
+        # dos locks para que o tempo retido seja só o das operações em memória.
+        with self.produto_repo.lock_items(quantidades):
+            produtos = {}
+            for produto_id, quantidade in quantidades.items():
+                produto = self.produto_repo.find_by_id(produto_id)
+                if produto is None:
+                    raise ValueError(f"Produto {produto_id} não encontrado")
+                if produto.estoque < quantidade:
+                    raise ValueError(f"Estoque insuficiente para produto {produto_id}")
+                produtos[produto_id] = produto
+            for produto_id, produto in produtos.items():
+                produto.estoque -= quantidades[produto_id]
+                self.produto_repo.save(produto)
+        return produtos
+
+
+# Variantes para o app assíncrono (app_asgi.py): mesmas regras de negócio, mas a
+# latência simulada é aguardada com asyncio.sleep, que suspende só a corrotina em
+# vez de ocupar uma thread. As operações em memória (inclusive os locks de reserva
+# de estoque, retidos sem nenhum await no meio) continuam síncronas e curtas.
+# Os métodos assíncronos têm nome próprio (sufixo _async, como acquire_async e
+# wait_async): os síncronos herdados continuam valendo, e uma instância destas
+# classes serve onde se espera a versão síncrona.
+class ProdutoServiceAsync(ProdutoService):
+    @medir
+    async def listar_produtos_async(self) -> Sequence:
+        await self.latency.wait_async()
+        return self.repository.find_all()
+
+    @medir
+    async def listar_produtos_paginado_async(
+        self, limite: int, cursor: Optional[int] = None
+    ) -> Tuple[list, Optional[int]]:
+        await self.latency.wait_async()
+        return self._listar_produtos_paginado(limite, cursor)
+
+    @medir
+    async def buscar_produto_async(self, id: int) -> Optional[Produto]:
+        await self.latency.wait_async()
+        return self._buscar_produto(id)
+
+    @medir
+    async def buscar_produtos_async(self, ids: List[int]) -> list:
+        await self.latency.wait_async()
+        return self.repository.find_many(ids)
+
+    @medir
+    async def pesquisar_produtos_async(
+        self,
+        termo: Optional[str] = None,
+        preco_min: Optional[float] = None,
+        preco_max: Optional[float] = None,
+        limite: int = 100,
+    ) -> list:
+        await self.latency.wait_async()
+        return self._pesquisar_produtos(termo, preco_min, preco_max, limite)
+
+
+class PedidoServiceAsync(PedidoService):
+    @medir
+    async def criar_pedido_async(self, itens: list) -> Pedido:
+        await self.latency.wait_async()
+        return await self._gravar(self._criar_pedido, itens)
+
+    @medir
+    async def criar_pedidos_em_lote_async(self, pedidos: List[list]) -> List[Union[Pedido, ValueError]]:
+        await self.latency.wait_async()
+        return await self._gravar(self._criar_pedidos_em_lote, pedidos)
+
+    @medir
+    async def listar_pedidos_por_status_async(self, status: StatusPedido, limite: int = 100) -> list:
+        await self.latency.wait_async()
+        return self.pedido_repo.find_by_status(status, limit=limite)
+
+    @medir
+    async def confirmar_pedido_async(self, id: int) -> Pedido:
+        await self.latency.wait_async()
+        return await self._gravar(self._mudar_status, id, StatusPedido.CONFIRMADO)
+
+    @medir
+    async def cancelar_pedido_async(self, id: int) -> Pedido:
+        await self.latency.wait_async()
+        return await self._gravar(self._mudar_status, id, StatusPedido.CANCELADO)
+
+    async def _gravar(self, funcao, *argumentos):
+        # Com journal, a gravação espera o fsync do lote: roda numa thread para não
+        # parar as demais corrotinas do event loop durante a janela de group commit.
+        if self.pedido_repo.journal is None:
+            return funcao(*argumentos)
+        return await asyncio.to_thread(funcao, *argumentos)
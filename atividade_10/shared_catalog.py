@@ -0,0 +1,251 @@
+import os
+import struct
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterable, List, Optional
+
+from models import Produto
+from storage import _LocksPorItemEmArquivo
+
+# Catálogo de produtos num bloco de memória compartilhada, para que todos os workers
+# do gunicorn leiam o mesmo catálogo e o mesmo estoque sem ida e volta de IPC.
+#
+# Layout do bloco:
+#   cabeçalho  | magic, capacidade, maior id usado, versão, bytes usados de nomes
+#   registros  | capacidade x registro de tamanho fixo, endereçado pelo id (slot = id)
+#   nomes      | tabela de strings UTF-8 só de acréscimo; o registro guarda offset e tamanho
+#
+# Leituras não usam lock: cada registro tem um contador de sequência (seqlock). O
+# escritor o torna ímpar antes de gravar e par de novo depois; o leitor repete a
+# leitura se viu um valor ímpar ou se o contador mudou durante a cópia. Escritas são
+# serializadas entre processos por um lock de arquivo.
+#
+# Um worker que morre no meio de uma escrita deixa o contador ímpar para sempre.
+# Por isso o leitor só repete a leitura sem lock algumas vezes; depois, pega o
+# lock de escrita (que o kernel solta quando o processo morre). Com o lock, nenhum
+# escritor está ativo: contador ainda ímpar é escrita interrompida, e o registro é
+# reparado. Se nem o lock vier a tempo, a leitura falha com TimeoutError.
+
+_MAGIC = b"BFC1"
+_CABECALHO = struct.Struct("<4sxxxxqqqq")  # magic, capacidade, maior_id, versão, nomes_usados
+# seq, id, preco, estoque, offset do nome, tamanho do nome, ativo
+_REGISTRO = struct.Struct("<qqdqIHBx")
+_OFFSET_MAIOR_ID = 16
+_OFFSET_VERSAO = 24
+_OFFSET_NOMES_USADOS = 32
+_QWORD = struct.Struct("<q")
+
+# Byte 0 do arquivo de locks é o lock de escrita do bloco inteiro; os bytes de 1 à
+# capacidade são os locks de item (ids começam em 1), usados na reserva de
+# estoque; o byte seguinte é o lock da carga inicial (bootstrap_lock).
+_LOCK_DE_ESCRITA = 0
+
+# Leituras sem lock antes de recorrer ao lock de escrita, e quanto esperar por ele.
+_TENTATIVAS_SEM_LOCK = 100
+_ESPERA_MAXIMA_DE_LEITURA = 5.0
+
+
+class SharedMemoryCatalog:
+    def __init__(self, name: str, capacity: int = 100_000, names_size: Optional[int] = None):
+        if capacity < 1:
+            raise ValueError("capacity deve ser maior que zero")
+        self.name = name
+        self._caminho_locks = os.path.join(tempfile.gettempdir(), f"{name}.locks")
+        self._locks = _LocksPorItemEmArquivo(self._caminho_locks)
+        tamanho_nomes = names_size if names_size is not None else capacity * 64
+
+        # Criação e anexação sob o lock de escrita: um worker que anexa nunca lê
+        # um cabeçalho que outro worker ainda está inicializando.
+        with self._locks.get(_LOCK_DE_ESCRITA):
+            try:
+                tamanho = _CABECALHO.size + capacity * _REGISTRO.size + tamanho_nomes
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=tamanho)
+                _CABECALHO.pack_into(self._shm.buf, 0, _MAGIC, capacity, 0, 0, 0)
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(name=name)
+        # O resource_tracker do multiprocessing apaga o bloco quando o processo que o
+        # registrou termina — com workers reiniciados pelo gunicorn, isso apagaria o
+        # catálogo dos demais. O bloco vive até unlink() ser chamado explicitamente.
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        magic, self._capacidade, _, _, _ = _CABECALHO.unpack_from(self._shm.buf, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Bloco de memória compartilhada {name!r} não é um catálogo")
+        self._buf = self._shm.buf
+        self._inicio_registros = _CABECALHO.size
+        self._inicio_nomes = _CABECALHO.size + self._capacidade * _REGISTRO.size
+        self._tamanho_nomes = len(self._buf) - self._inicio_nomes
+
+    def _ler_qword(self, offset: int) -> int:
+        return _QWORD.unpack_from(self._buf, offset)[0]
+
+    def _offset(self, id: int) -> int:
+        if not 1 <= id <= self._capacidade:
+            raise ValueError(f"id {id} fora da capacidade do catálogo ({self._capacidade})")
+        return self._inicio_registros + (id - 1) * _REGISTRO.size
+
+    @property
+    def version(self) -> int:
+        return self._ler_qword(_OFFSET_VERSAO)
+
+    def _ler_registro(self, id: int):
+        offset = self._offset(id)
+        for _ in range(_TENTATIVAS_SEM_LOCK):
+            seq_antes = self._ler_qword(offset)
+            if seq_antes % 2:
+                continue
+            registro = _REGISTRO.unpack_from(self._buf, offset)
+            if self._ler_qword(offset) == seq_antes:
+                return registro
+        # Escritor lento (ex.: preemptado no meio da escrita) ou morto.
+        lock = self._locks.get(_LOCK_DE_ESCRITA)
+        if not lock.acquire(timeout=_ESPERA_MAXIMA_DE_LEITURA):
+            raise TimeoutError(f"Registro {id} do catálogo compartilhado em escrita há mais de "
+                               f"{_ESPERA_MAXIMA_DE_LEITURA}s")
+        try:
+            seq = self._ler_qword(offset)
+            if seq % 2:
+                # Escrita interrompida: _escrever grava o registro inteiro de uma
+                # vez, então o conteúdo é o anterior ou o novo; basta fechar a
+                # sequência.
+                _QWORD.pack_into(self._buf, offset, seq + 1)
+            return _REGISTRO.unpack_from(self._buf, offset)
+        finally:
+            lock.release()
+
+    def _produto(self, registro) -> Optional[Produto]:
+        _, id, preco, estoque, offset_nome, tamanho_nome, ativo = registro
+        if not ativo:
+            return None
+        inicio = self._inicio_nomes + offset_nome
+        nome = bytes(self._buf[inicio:inicio + tamanho_nome]).decode("utf-8")
+        return Produto(nome=nome, preco=preco, estoque=estoque, id=id)
+
+    def get(self, id: int) -> Optional[Produto]:
+        if not 1 <= id <= self._capacidade:
+            return None
+        return self._produto(self._ler_registro(id))
+
+    def get_many(self, ids: Iterable[int]) -> list:
+        produtos = (self.get(id) for id in ids)
+        return [p for p in produtos if p is not None]
+
+    def get_page(self, after: Optional[int], limit: int) -> list:
+        maior_id = self._ler_qword(_OFFSET_MAIOR_ID)
+        produtos = []
+        id = 1 if after is None else after + 1
+        while id <= maior_id and len(produtos) < limit:
+            produto = self._produto(self._ler_registro(id))
+            if produto is not None:
+                produtos.append(produto)
+            id += 1
+        return produtos
+
+    def get_all(self) -> list:
+        return self.get_page(None, self._capacidade)
+
+    def max_id(self) -> Optional[int]:
+        for id in range(self._ler_qword(_OFFSET_MAIOR_ID), 0, -1):
+            if self._ler_registro(id)[6]:
+                return id
+        return None
+
+    def item_lock(self, id: int):
+        # Lock entre processos para leitura-modificação-escrita de um produto
+        # (reserva de estoque). Diferente do lock de escrita: é retido durante a
+        # reserva inteira, que por sua vez chama add() para gravar o estoque novo.
+        self._offset(id)
+        return self._locks.get(id)
+
+    def _escrever(self, offset: int, valores) -> None:
+        seq = self._ler_qword(offset)
+        _QWORD.pack_into(self._buf, offset, seq + 1)
+        _REGISTRO.pack_into(self._buf, offset, seq + 1, *valores)
+        _QWORD.pack_into(self._buf, offset, seq + 2)
+
+    def _avancar_versao(self) -> None:
+        _QWORD.pack_into(self._buf, _OFFSET_VERSAO, self._ler_qword(_OFFSET_VERSAO) + 1)
+
+    def add(self, id: int, item: Produto) -> None:
+        self._offset(id)
+        with self._locks.get(_LOCK_DE_ESCRITA):
+            self._gravar(id, item)
+
+    def insert_many(self, items: List[Produto]) -> List[int]:
+        # Ids alocados no próprio bloco, sob o lock de escrita: um contador por
+        # worker daria o mesmo id a produtos cadastrados em workers diferentes.
+        with self._locks.get(_LOCK_DE_ESCRITA):
+            proximo = self._ler_qword(_OFFSET_MAIOR_ID) + 1
+            if proximo + len(items) - 1 > self._capacidade:
+                raise ValueError(f"Catálogo compartilhado cheio (capacidade {self._capacidade})")
+            for id, item in enumerate(items, proximo):
+                try:
+                    item.id = id
+                    self._gravar(id, item)
+                except BaseException:
+                    item.id = None
+                    raise
+        return [item.id for item in items]
+
+    def bootstrap_lock(self):
+        # Lock entre processos para a carga inicial (ex.: semear o catálogo só se
+        # estiver vazio); fora dos bytes de escrita e de item.
+        return self._locks.get(self._capacidade + 1)
+
+    def _gravar(self, id: int, item: Produto) -> None:
+        # Chamado sob o lock de escrita.
+        offset = self._offset(id)
+        nome = item.nome.encode("utf-8")
+        _, _, _, _, offset_nome, tamanho_nome, ativo = _REGISTRO.unpack_from(self._buf, offset)
+        inicio = self._inicio_nomes + offset_nome
+        # Baixa de estoque regrava o produto com o mesmo nome: reaproveita a
+        # string já gravada em vez de crescer a tabela a cada pedido.
+        if not (ativo and bytes(self._buf[inicio:inicio + tamanho_nome]) == nome):
+            offset_nome = self._ler_qword(_OFFSET_NOMES_USADOS)
+            if offset_nome + len(nome) > self._tamanho_nomes:
+                raise ValueError("Tabela de nomes do catálogo compartilhado está cheia")
+            inicio = self._inicio_nomes + offset_nome
+            self._buf[inicio:inicio + len(nome)] = nome
+            _QWORD.pack_into(self._buf, _OFFSET_NOMES_USADOS, offset_nome + len(nome))
+            tamanho_nome = len(nome)
+        self._escrever(offset, (id, item.preco, item.estoque, offset_nome, tamanho_nome, 1))
+        if id > self._ler_qword(_OFFSET_MAIOR_ID):
+            _QWORD.pack_into(self._buf, _OFFSET_MAIOR_ID, id)
+        self._avancar_versao()
+
+    def delete(self, id: int) -> bool:
+        if not 1 <= id <= self._capacidade:
+            return False
+        offset = self._offset(id)
+        with self._locks.get(_LOCK_DE_ESCRITA):
+            registro = _REGISTRO.unpack_from(self._buf, offset)
+            if not registro[6]:
+                return False
+            self._escrever(offset, registro[1:6] + (0,))
+            self._avancar_versao()
+            return True
+
+    def clear(self) -> None:
+        with self._locks.get(_LOCK_DE_ESCRITA):
+            for id in range(1, self._ler_qword(_OFFSET_MAIOR_ID) + 1):
+                offset = self._offset(id)
+                registro = _REGISTRO.unpack_from(self._buf, offset)
+                if registro[6]:
+                    self._escrever(offset, registro[1:6] + (0,))
+            _QWORD.pack_into(self._buf, _OFFSET_MAIOR_ID, 0)
+            _QWORD.pack_into(self._buf, _OFFSET_NOMES_USADOS, 0)
+            self._avancar_versao()
+
+    def close(self) -> None:
+        self._buf = None
+        self._shm.close()
+        self._locks.close()
+
+    def unlink(self) -> None:
+        # Remove o bloco do sistema; processos que ainda o têm mapeado continuam
+        # funcionando até fecharem, mas novos workers criarão um catálogo vazio.
+        shared_memory.SharedMemory(name=self.name).unlink()
+        try:
+            os.remove(self._caminho_locks)
+        except FileNotFoundError:
+            pass
@@ -1,35 +1,719 @@
+import bisect
+import heapq
+import itertools
+import os
+import pickle
+import sqlite3
+import sys
 import threading
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
+try:
+    import fcntl
+except ImportError:  # Windows: sem locks de arquivo, só exclusão entre threads.
+    fcntl = None
+
+# Sentinela para distinguir "id ausente" de "id presente com valor None".
+_AUSENTE = object()
+
+
+class _LocksPorItem:
+    # Locks por id, criados na primeira aquisição e descartados quando ninguém
+    # mais os retém nem espera por eles: a tabela só guarda os ids com operação
+    # em andamento. Guardar um lock por id para sempre custaria um lock por
+    # pedido já confirmado ou cancelado, crescendo com o histórico de pedidos.
+    # Cada entrada é [lock, usuários]; a contagem é mantida sob _guarda, retido
+    # só pelo tempo de um acesso ao dict (nunca durante a espera pelo item).
+    def __init__(self):
+        self._guarda = threading.Lock()
+        self._locks: Dict[int, list] = {}
+
+    def get(self, id: int) -> "_LockDeItem":
+        return _LockDeItem(self, id)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def _reservar(self, id: int) -> threading.Lock:
+        with self._guarda:
+            entrada = self._locks.get(id)
+            if entrada is None:
+                entrada = self._locks[id] = [threading.Lock(), 0]
+            entrada[1] += 1
+            return entrada[0]
+
+    def _devolver(self, id: int, liberar: bool) -> None:
+        with self._guarda:
+            entrada = self._locks[id]
+            if liberar:
+                entrada[0].release()
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._locks[id]
+
+
+class _LockDeItem:
+    # Lock de um id de _LocksPorItem. Não guarda estado próprio: pode ser
+    # recriado a cada uso, como os repositórios fazem.
+    __slots__ = ("_tabela", "_id")
+
+    def __init__(self, tabela: _LocksPorItem, id: int):
+        self._tabela = tabela
+        self._id = id
+
+    def acquire(self, timeout: float = -1) -> bool:
+        if self._tabela._reservar(self._id).acquire(timeout=timeout):
+            return True
+        self._tabela._devolver(self._id, liberar=False)
+        return False
+
+    def release(self) -> None:
+        self._tabela._devolver(self._id, liberar=True)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _LockComEspera:
+    # threading.Lock que conta quantas aquisições precisaram esperar e por quanto
+    # tempo (GET /metrics). O caso sem disputa custa uma tentativa sem bloqueio;
+    # só quem encontra o lock ocupado mede o relógio. Os contadores são
+    # atualizados já com o lock retido, então não precisam de outro lock.
+    __slots__ = ("_lock", "aquisicoes", "esperas", "tempo_de_espera")
 
-class InMemoryStorage:
     def __init__(self):
+        self._lock = threading.Lock()
+        self.aquisicoes = 0
+        self.esperas = 0
+        self.tempo_de_espera = 0.0
+
+    def __enter__(self):
+        if not self._lock.acquire(False):
+            inicio = time.perf_counter()
+            self._lock.acquire()
+            self.esperas += 1
+            self.tempo_de_espera += time.perf_counter() - inicio
+        self.aquisicoes += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+# Profiler de contenção do lock do InMemoryStorage, opcional (lock_profiler=...):
+# por operação do storage (add, get, get_all, delete...), quantas aquisições
+# encontraram o lock ocupado, quanto tempo esperaram e quanto tempo o lock ficou
+# retido. Se o lock único é o teto de escalabilidade, aparece aqui como ocupação
+# perto de 100% e espera crescendo com o número de threads.
+#
+# O nome da operação é o do método que entrou no `with self._lock` (lido do
+# frame de quem chamou): sem profiler, os métodos do storage ficam exatamente
+# como estão, sem custo algum. As estatísticas de cada lock são atualizadas com
+# o próprio lock retido, então são exatas sem um lock a mais — que seria, ele
+# mesmo, um novo ponto de contenção.
+
+class _EstatisticasDaOperacao:
+    __slots__ = ("aquisicoes", "disputas", "espera", "espera_maxima", "retencao", "retencao_maxima")
+
+    def __init__(self):
+        self.aquisicoes = 0
+        self.disputas = 0
+        self.espera = 0.0
+        self.espera_maxima = 0.0
+        self.retencao = 0.0
+        self.retencao_maxima = 0.0
+
+    def somar(self, outra: "_EstatisticasDaOperacao") -> None:
+        self.aquisicoes += outra.aquisicoes
+        self.disputas += outra.disputas
+        self.espera += outra.espera
+        self.espera_maxima = max(self.espera_maxima, outra.espera_maxima)
+        self.retencao += outra.retencao
+        self.retencao_maxima = max(self.retencao_maxima, outra.retencao_maxima)
+
+
+class _LockPerfilado(_LockComEspera):
+    __slots__ = ("_clock", "_operacoes", "_operacao_atual", "_adquirido_em")
+
+    def __init__(self, clock):
+        super().__init__()
+        self._clock = clock
+        self._operacoes: Dict[str, _EstatisticasDaOperacao] = {}
+        self._operacao_atual: Optional[_EstatisticasDaOperacao] = None
+        self._adquirido_em = 0.0
+
+    def __enter__(self):
+        nome = sys._getframe(1).f_code.co_name
+        inicio = self._clock()
+        disputado = not self._lock.acquire(False)
+        if disputado:
+            self._lock.acquire()
+        agora = self._clock()
+        self.aquisicoes += 1
+        operacao = self._operacoes.get(nome)
+        if operacao is None:
+            operacao = self._operacoes[nome] = _EstatisticasDaOperacao()
+        operacao.aquisicoes += 1
+        if disputado:
+            espera = agora - inicio
+            self.esperas += 1
+            self.tempo_de_espera += espera
+            operacao.disputas += 1
+            operacao.espera += espera
+            if espera > operacao.espera_maxima:
+                operacao.espera_maxima = espera
+        self._operacao_atual = operacao
+        self._adquirido_em = agora
+        return self
+
+    def __exit__(self, *exc):
+        retencao = self._clock() - self._adquirido_em
+        operacao = self._operacao_atual
+        operacao.retencao += retencao
+        if retencao > operacao.retencao_maxima:
+            operacao.retencao_maxima = retencao
+        self._lock.release()
+
+    def estatisticas(self) -> Dict[str, _EstatisticasDaOperacao]:
+        # Cópia tirada com o lock retido: não enxerga uma operação pela metade.
+        with self._lock:
+            copias = {}
+            for nome, operacao in self._operacoes.items():
+                copia = copias[nome] = _EstatisticasDaOperacao()
+                copia.somar(operacao)
+            return copias
+
+
+class LockProfiler:
+    """Contenção por operação somada de todos os InMemoryStorage criados com este profiler."""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._inicio = clock()
+        self._registro = threading.Lock()
+        self._locks: List[_LockPerfilado] = []
+
+    def _novo_lock(self) -> _LockPerfilado:
+        lock = _LockPerfilado(self._clock)
+        with self._registro:
+            self._locks.append(lock)
+        return lock
+
+    def relatorio(self) -> dict:
+        duracao = self._clock() - self._inicio
+        with self._registro:
+            locks = list(self._locks)
+        total: Dict[str, _EstatisticasDaOperacao] = {}
+        for lock in locks:
+            for nome, operacao in lock.estatisticas().items():
+                total.setdefault(nome, _EstatisticasDaOperacao()).somar(operacao)
+        operacoes = {}
+        # Quem mais esperou primeiro: é onde a contenção está custando.
+        for nome, op in sorted(total.items(), key=lambda item: (-item[1].espera, -item[1].retencao)):
+            operacoes[nome] = {
+                "aquisicoes": op.aquisicoes,
+                "disputas": op.disputas,
+                "taxa_de_disputa": op.disputas / op.aquisicoes,
+                "espera_total_s": op.espera,
+                "espera_media_us": op.espera / op.disputas * 1e6 if op.disputas else 0.0,
+                "espera_maxima_us": op.espera_maxima * 1e6,
+                "retencao_total_s": op.retencao,
+                "retencao_media_us": op.retencao / op.aquisicoes * 1e6,
+                "retencao_maxima_us": op.retencao_maxima * 1e6,
+                # Fração do tempo com o lock retido por esta operação. Com vários
+                # storages no mesmo profiler é a soma entre eles e pode passar de 1.
+                "ocupacao": op.retencao / duracao if duracao > 0 else 0.0,
+            }
+        return {"duracao_s": duracao, "storages": len(locks), "operacoes": operacoes}
+
+    def formatar(self) -> str:
+        relatorio = self.relatorio()
+        linhas = [
+            f"{relatorio['storages']} storage(s) em {relatorio['duracao_s']:.1f}s",
+            f"{'operação':<12}{'aquisições':>12}{'disputas':>10}{'espera total':>14}"
+            f"{'espera máx':>12}{'retenção méd':>14}{'retenção máx':>14}{'ocupação':>10}",
+        ]
+        for nome, op in relatorio["operacoes"].items():
+            linhas.append(
+                f"{nome:<12}{op['aquisicoes']:>12}{op['taxa_de_disputa']:>10.2%}"
+                f"{op['espera_total_s'] * 1000:>12.2f}ms{op['espera_maxima_us']:>10.0f}µs"
+                f"{op['retencao_media_us']:>12.2f}µs{op['retencao_maxima_us']:>12.0f}µs{op['ocupacao']:>10.2%}"
+            )
+        return "\n".join(linhas)
+
+
+def _indexar_id(ids_ordenados: List[int], id: int) -> None:
+    # Ids vêm de um contador crescente, então o caso comum é um append O(1);
+    # insort cobre ids fora de ordem (ex.: gravados com id explícito).
+    if not ids_ordenados or id > ids_ordenados[-1]:
+        ids_ordenados.append(id)
+    else:
+        bisect.insort(ids_ordenados, id)
+
+
+def _desindexar_id(ids_ordenados: List[int], id: int) -> None:
+    i = bisect.bisect_left(ids_ordenados, id)
+    if i < len(ids_ordenados) and ids_ordenados[i] == id:
+        del ids_ordenados[i]
+
+
+def _ids_da_pagina(ids_ordenados: List[int], after: Optional[int], limit: int) -> List[int]:
+    inicio = 0 if after is None else bisect.bisect_right(ids_ordenados, after)
+    return ids_ordenados[inicio:inicio + limit]
+
+
+class InMemoryStorage:
+    def __init__(self, lock_profiler: Optional[LockProfiler] = None):
         self._data: Dict[int, Any] = {}
         # Lock garante atomicidade em cenários com múltiplas threads simultâneas,
         # como nos testes de escalabilidade com ThreadPoolExecutor.
-        self._lock = threading.Lock()
+        self.lock_profiler = lock_profiler
+        self._lock = _LockComEspera() if lock_profiler is None else lock_profiler._novo_lock()
+        # Snapshot imutável publicado para get_all. None indica que houve escrita
+        # desde a última publicação e que a próxima leitura precisa reconstruí-lo.
+        self._snapshot: Optional[tuple] = ()
+        # Versão incrementada a cada escrita; identifica o estado do storage.
+        self._version = 0
+        self._item_locks = _LocksPorItem()
+        # Índice ordenado de ids para paginação por cursor sem ordenar o dict.
+        self._ids_ordenados: List[int] = []
+        # Índices secundários por nome (ver indexes.py), mantidos a cada escrita.
+        self.indexes: Dict[str, Any] = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def estatisticas_de_lock(self) -> dict:
+        lock = self._lock
+        return {
+            "aquisicoes": lock.aquisicoes,
+            "esperas": lock.esperas,
+            "tempo_de_espera_s": lock.tempo_de_espera,
+        }
+
+    def add_index(self, name: str, index) -> None:
+        # Declarar o mesmo índice de novo (ex.: dois repositórios sobre o mesmo
+        # storage) mantém o existente.
+        with self._lock:
+            if name in self.indexes:
+                return
+            for id, item in self._data.items():
+                index.update(id, item)
+            self.indexes[name] = index
+
+    def lookup(self, index: str, *args, **kwargs) -> list:
+        # Consulta um índice secundário; os argumentos dependem do tipo de índice.
+        # Só a consulta ao índice (já limitada, quando há limit) roda sob o lock;
+        # os itens são buscados depois, sem ele. Um dict.get é atômico no CPython,
+        # e um id removido nesse meio-tempo é omitido, como se a consulta tivesse
+        # rodado depois da remoção.
+        with self._lock:
+            ids = self.indexes[index].lookup(*args, **kwargs)
+        data = self._data
+        itens = [data.get(id, _AUSENTE) for id in ids]
+        return [item for item in itens if item is not _AUSENTE]
 
     def add(self, id: int, item: Any) -> None:
         with self._lock:
+            anterior = self._data.get(id, _AUSENTE)
             self._data[id] = item
+            self._version += 1
+            if anterior is _AUSENTE:
+                _indexar_id(self._ids_ordenados, id)
+            for index in self.indexes.values():
+                index.update(id, item)
+            # Regravar o mesmo objeto (ex.: save após decrementar estoque) não muda
+            # a sequência de referências, então o snapshot atual continua válido.
+            if anterior is not item:
+                self._snapshot = None
 
     def get(self, id: int) -> Optional[Any]:
         with self._lock:
             return self._data.get(id)
 
-    def get_all(self) -> list:
+    def get_many(self, ids: Iterable[int]) -> list:
+        # Um único acquire para todos os ids; ids ausentes são omitidos e a
+        # ordem de entrada é preservada.
         with self._lock:
-            # Cópia defensiva: evita que o chamador itere sobre o dict
-            # enquanto outra thread o modifica fora do lock.
-            return list(self._data.values())
+            data = self._data
+            return [data[id] for id in ids if id in data]
+
+    def get_page(self, after: Optional[int], limit: int) -> list:
+        # Até `limit` itens com id maior que `after` (o cursor), em ordem de id.
+        # Custo O(log n + limit), independente do tamanho do storage.
+        with self._lock:
+            data = self._data
+            return [data[id] for id in _ids_da_pagina(self._ids_ordenados, after, limit)]
+
+    def max_id(self) -> Optional[int]:
+        with self._lock:
+            return self._ids_ordenados[-1] if self._ids_ordenados else None
+
+    def item_lock(self, id: int) -> _LockDeItem:
+        # Lock de um único item para operações de leitura-modificação-escrita
+        # (ex.: baixa de estoque). Independente de self._lock, que protege só o
+        # dict: leituras de outros itens seguem livres durante a operação.
+        return self._item_locks.get(id)
+
+    def get_all(self) -> tuple:
+        # Caminho rápido sem lock e sem cópia: a tupla publicada é imutável, então
+        # pode ser compartilhada entre todos os leitores até a próxima escrita.
+        # Ler uma tupla anterior a uma escrita concorrente equivale a ter lido
+        # antes dela.
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(self._data.values())
+            return self._snapshot
 
     def delete(self, id: int) -> bool:
         with self._lock:
             if id in self._data:
                 del self._data[id]
+                _desindexar_id(self._ids_ordenados, id)
+                for index in self.indexes.values():
+                    index.remove(id)
+                self._version += 1
+                self._snapshot = None
                 return True
             return False
 
     def clear(self) -> None:
         with self._lock:
             self._data.clear()
+            self._ids_ordenados.clear()
+            for index in self.indexes.values():
+                index.clear()
+            self._version += 1
+            self._snapshot = ()
+
+
+# Variante com lock striping: os ids são distribuídos em N shards, cada um com
+# seu próprio dict e lock. Operações em ids de shards diferentes não disputam o
+# mesmo lock, então um GET /produtos/<id> não espera um POST /pedidos que está
+# gravando outro produto. Mesmo contrato de InMemoryStorage.
+class ShardedInMemoryStorage:
+    def __init__(self, n_shards: int = 16):
+        if n_shards < 1:
+            raise ValueError("n_shards deve ser maior que zero")
+        self._n_shards = n_shards
+        self._shards: List[Dict[int, Any]] = [{} for _ in range(n_shards)]
+        self._locks = [threading.Lock() for _ in range(n_shards)]
+        # Uma versão por shard, sempre alterada sob o lock do próprio shard.
+        self._versions = [0] * n_shards
+        self._item_locks = _LocksPorItem()
+        self._ids_ordenados: List[List[int]] = [[] for _ in range(n_shards)]
+
+    @property
+    def version(self) -> int:
+        # A soma de contadores monotônicos também é monotônica: qualquer escrita
+        # em qualquer shard a incrementa, sem precisar de um contador global
+        # (que voltaria a ser um ponto único de contenção).
+        return sum(self._versions)
+
+    def _indice(self, id: int) -> int:
+        # hash() de int é o próprio valor, então ids sequenciais caem em
+        # shards consecutivos e a carga fica uniforme entre os stripes.
+        return hash(id) % self._n_shards
+
+    def add(self, id: int, item: Any) -> None:
+        i = self._indice(id)
+        with self._locks[i]:
+            if id not in self._shards[i]:
+                _indexar_id(self._ids_ordenados[i], id)
+            self._shards[i][id] = item
+            self._versions[i] += 1
+
+    def get(self, id: int) -> Optional[Any]:
+        i = self._indice(id)
+        with self._locks[i]:
+            return self._shards[i].get(id)
+
+    def get_many(self, ids: Iterable[int]) -> list:
+        # Agrupa os ids por shard para adquirir cada lock uma única vez,
+        # depois remonta o resultado na ordem de entrada.
+        ids = list(ids)
+        por_shard: Dict[int, List[int]] = {}
+        for id in ids:
+            por_shard.setdefault(self._indice(id), []).append(id)
+        encontrados: Dict[int, Any] = {}
+        for i, ids_do_shard in por_shard.items():
+            shard = self._shards[i]
+            with self._locks[i]:
+                for id in ids_do_shard:
+                    if id in shard:
+                        encontrados[id] = shard[id]
+        return [encontrados[id] for id in ids if id in encontrados]
+
+    def get_page(self, after: Optional[int], limit: int) -> list:
+        # Cada shard contribui com até `limit` candidatos já ordenados; o merge
+        # das listas ordenadas devolve os `limit` menores ids após o cursor.
+        candidatos = []
+        for shard, lock, ids_ordenados in zip(self._shards, self._locks, self._ids_ordenados):
+            with lock:
+                candidatos.append([
+                    (id, shard[id]) for id in _ids_da_pagina(ids_ordenados, after, limit)
+                ])
+        mesclados = heapq.merge(*candidatos, key=lambda par: par[0])
+        return [item for _, item in itertools.islice(mesclados, limit)]
+
+    def max_id(self) -> Optional[int]:
+        maiores = []
+        for lock, ids_ordenados in zip(self._locks, self._ids_ordenados):
+            with lock:
+                if ids_ordenados:
+                    maiores.append(ids_ordenados[-1])
+        return max(maiores, default=None)
+
+    def item_lock(self, id: int) -> _LockDeItem:
+        return self._item_locks.get(id)
+
+    def get_all(self) -> list:
+        # Cada shard é copiado sob o seu próprio lock, um de cada vez: nunca há
+        # dois locks retidos ao mesmo tempo, o que elimina risco de deadlock.
+        # A visão resultante não é um snapshot atômico do storage inteiro.
+        itens = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                itens.extend(shard.values())
+        return itens
+
+    def delete(self, id: int) -> bool:
+        i = self._indice(id)
+        with self._locks[i]:
+            if id in self._shards[i]:
+                del self._shards[i][id]
+                _desindexar_id(self._ids_ordenados[i], id)
+                self._versions[i] += 1
+                return True
+            return False
+
+    def clear(self) -> None:
+        for i, (shard, lock) in enumerate(zip(self._shards, self._locks)):
+            with lock:
+                shard.clear()
+                self._ids_ordenados[i].clear()
+                self._versions[i] += 1
+
+
+class _LockDeItemEmArquivo:
+    # Lock de um item visível entre processos: trava o byte `id` de um arquivo de
+    # locks com fcntl.lockf. Locks fcntl pertencem ao processo, não à thread, então
+    # um lock local por item (de _LocksPorItem) garante a exclusão entre threads
+    # do mesmo worker antes de disputar o byte com os outros workers.
+    def __init__(self, fd: int, id: int, lock_local: _LockDeItem):
+        self._fd = fd
+        self._id = id
+        self._lock_local = lock_local
+
+    def __enter__(self):
+        self._lock_local.acquire()
+        if fcntl is not None:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._id)
+            except BaseException:
+                self._lock_local.release()
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self) -> None:
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._id)
+        self._lock_local.release()
+
+    def acquire(self, timeout: float) -> bool:
+        # Como __enter__, mas desiste depois de `timeout` segundos.
+        limite = time.monotonic() + timeout
+        if not self._lock_local.acquire(timeout=timeout):
+            return False
+        if fcntl is None:
+            return True
+        while True:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self._id)
+                return True
+            except OSError:
+                if time.monotonic() >= limite:
+                    self._lock_local.release()
+                    return False
+                time.sleep(0.001)
+
+
+class _LocksPorItemEmArquivo:
+    def __init__(self, caminho: str):
+        self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+        self._locais = _LocksPorItem()
+
+    def get(self, id: int) -> _LockDeItemEmArquivo:
+        return _LockDeItemEmArquivo(self._fd, id, self._locais.get(id))
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+# Storage durável em SQLite com o mesmo contrato de InMemoryStorage. Cada item é
+# gravado serializado com pickle, então qualquer modelo (Produto, Pedido) cabe na
+# mesma tabela genérica (id, item). Vários processos (ex.: workers do gunicorn)
+# podem abrir o mesmo arquivo e enxergam o mesmo conjunto de itens.
+#
+# Diferente do storage em memória, get/get_all devolvem cópias desserializadas:
+# alterações num objeto só são persistidas quando ele é gravado de novo com add
+# (que é o que os repositórios já fazem em save).
+class SQLiteStorage:
+    def __init__(self, path: str, table: str = "itens"):
+        if not table.isidentifier():
+            raise ValueError("Nome de tabela inválido")
+        self.path = path
+        self.table = table
+        # Pool de conexões por thread: sqlite3.Connection não deve ser usada por
+        # duas threads ao mesmo tempo, e abrir uma conexão por operação custaria
+        # mais que a própria consulta. Cada thread abre a sua na primeira operação
+        # e a reutiliza; a lista permite fechar todas em close().
+        self._local = threading.local()
+        self._conexoes: List[sqlite3.Connection] = []
+        self._conexoes_lock = threading.Lock()
+        # SQL fixo por tabela, montado uma única vez: o módulo sqlite3 mantém um
+        # cache de statements compilados por conexão, e reusar exatamente o mesmo
+        # texto faz cada consulta ser preparada só na primeira execução.
+        self._sql_add = f"INSERT OR REPLACE INTO {table} (id, item) VALUES (?, ?)"
+        self._sql_insert = f"INSERT INTO {table} (item) VALUES (?)"
+        self._sql_update = f"UPDATE {table} SET item = ? WHERE id = ?"
+        self._sql_get = f"SELECT item FROM {table} WHERE id = ?"
+        self._sql_get_all = f"SELECT item FROM {table} ORDER BY id"
+        self._sql_get_page = f"SELECT item FROM {table} WHERE id > ? ORDER BY id LIMIT ?"
+        self._sql_delete = f"DELETE FROM {table} WHERE id = ?"
+        self._sql_clear = f"DELETE FROM {table}"
+        self._sql_max_id = f"SELECT MAX(id) FROM {table}"
+        self._sql_version = "SELECT versao FROM _versoes WHERE tabela = ?"
+        self._sql_bump = "UPDATE _versoes SET versao = versao + 1 WHERE tabela = ?"
+
+        conn = self._conexao()
+        with conn:
+            # AUTOINCREMENT: o id de um item novo é alocado pelo próprio banco e
+            # nunca é reaproveitado, nem depois de um delete do maior id.
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, item BLOB NOT NULL)")
+            # Versão guardada no próprio banco, alterada na mesma transação da
+            # escrita: todos os processos enxergam a mesma versão do catálogo.
+            conn.execute("CREATE TABLE IF NOT EXISTS _versoes (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO _versoes (tabela, versao) VALUES (?, 0)", (table,))
+        self._item_locks = _LocksPorItemEmArquivo(f"{path}.{table}.locks")
+
+    def _conexao(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # timeout: espera até 5s por um lock de escrita de outro processo
+            # antes de falhar com "database is locked".
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            # WAL: leitores não bloqueiam o escritor nem são bloqueados por ele.
+            # synchronous=NORMAL é seguro em WAL (não corrompe o banco) e evita um
+            # fsync por commit; o custo é perder os últimos commits numa queda de
+            # energia, não num crash do processo.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conexoes_lock:
+                self._conexoes.append(conn)
+        return conn
+
+    @property
+    def version(self) -> int:
+        return self._conexao().execute(self._sql_version, (self.table,)).fetchone()[0]
+
+    def add(self, id: int, item: Any) -> None:
+        conn = self._conexao()
+        with conn:
+            conn.execute(self._sql_add, (id, pickle.dumps(item, pickle.HIGHEST_PROTOCOL)))
+            conn.execute(self._sql_bump, (self.table,))
+
+    def insert_many(self, items: List[Any]) -> List[int]:
+        """Grava itens novos com ids alocados pelo banco e os atribui a item.id.
+
+        Com vários workers no mesmo arquivo, um contador de ids por processo
+        entregaria o mesmo id a dois itens novos, e o segundo add sobrescreveria
+        o primeiro. Aqui o id sai do INSERT, e o lote inteiro é uma transação:
+        ou todos os itens são gravados, ou nenhum.
+        """
+        conn = self._conexao()
+        try:
+            with conn:
+                for item in items:
+                    # O item serializado carrega o próprio id, que só existe depois
+                    # do INSERT: a linha entra vazia e é preenchida antes do commit.
+                    item.id = conn.execute(self._sql_insert, (b"",)).lastrowid
+                    conn.execute(self._sql_update, (pickle.dumps(item, pickle.HIGHEST_PROTOCOL), item.id))
+                conn.execute(self._sql_bump, (self.table,))
+        except BaseException:
+            for item in items:
+                item.id = None
+            raise
+        return [item.id for item in items]
+
+    def bootstrap_lock(self) -> _LockDeItemEmArquivo:
+        # Lock entre processos para a carga inicial (ex.: semear o catálogo só se
+        # estiver vazio). Byte 0 do arquivo de locks: nenhum item tem id 0.
+        return self._item_locks.get(0)
+
+    def get(self, id: int) -> Optional[Any]:
+        linha = self._conexao().execute(self._sql_get, (id,)).fetchone()
+        return pickle.loads(linha[0]) if linha else None
+
+    def get_many(self, ids: Iterable[int]) -> list:
+        ids = list(ids)
+        encontrados: Dict[int, Any] = {}
+        conn = self._conexao()
+        # Lotes de até 500 ids por consulta, abaixo do limite de parâmetros do SQLite.
+        for inicio in range(0, len(ids), 500):
+            lote = ids[inicio:inicio + 500]
+            sql = f"SELECT id, item FROM {self.table} WHERE id IN ({','.join('?' * len(lote))})"
+            for id, item in conn.execute(sql, lote):
+                encontrados[id] = pickle.loads(item)
+        return [encontrados[id] for id in ids if id in encontrados]
+
+    def get_page(self, after: Optional[int], limit: int) -> list:
+        linhas = self._conexao().execute(self._sql_get_page, (-1 if after is None else after, limit))
+        return [pickle.loads(item) for (item,) in linhas]
+
+    def get_all(self) -> list:
+        return [pickle.loads(item) for (item,) in self._conexao().execute(self._sql_get_all)]
+
+    def max_id(self) -> Optional[int]:
+        return self._conexao().execute(self._sql_max_id).fetchone()[0]
+
+    def item_lock(self, id: int) -> _LockDeItemEmArquivo:
+        # Lock entre processos: a baixa de estoque lê e regrava o item, e dois
+        # workers fazendo isso ao mesmo tempo no mesmo produto venderiam além
+        # do estoque mesmo com cada escrita sendo atômica no SQLite.
+        return self._item_locks.get(id)
+
+    def delete(self, id: int) -> bool:
+        conn = self._conexao()
+        with conn:
+            removido = conn.execute(self._sql_delete, (id,)).rowcount > 0
+            if removido:
+                conn.execute(self._sql_bump, (self.table,))
+        return removido
+
+    def clear(self) -> None:
+        conn = self._conexao()
+        with conn:
+            conn.execute(self._sql_clear)
+            conn.execute(self._sql_bump, (self.table,))
+
+    def close(self) -> None:
+        with self._conexoes_lock:
+            for conn in self._conexoes:
+                conn.close()
+            self._conexoes.clear()
+        self._local = threading.local()
+        self._item_locks.close()
@@ -10,7 +10,50 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from storage import InMemoryStorage
 from repository import ProdutoRepository, PedidoRepository
 from service import ProdutoService, PedidoService
-from app import app as flask_app
+from app import app as flask_app, limiter
+
+
+# Relatórios de contenção de locks guardados pelos testes (título -> texto).
+_RELATORIOS_DE_LOCKS = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--lentos", action="store_true", help="roda também os testes marcados com @pytest.mark.lento"
+    )
+    parser.addoption(
+        "--perfil-de-locks",
+        action="store_true",
+        help="mostra no resumo final a contenção nos locks dos storages medida pelos testes de escalabilidade",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "lento: teste de vários segundos, fora da execução padrão (use --lentos)")
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    for titulo, relatorio in config.stash.get(_RELATORIOS_DE_LOCKS, {}).items():
+        terminalreporter.write_sep("-", titulo)
+        terminalreporter.write_line(relatorio)
+
+
+@pytest.fixture(scope="session")
+def relatorios_de_locks(request):
+    """Dict onde os testes guardam relatórios de contenção (título -> texto) para o
+    resumo final; None sem --perfil-de-locks."""
+    if not request.config.getoption("--perfil-de-locks"):
+        return None
+    return request.config.stash.setdefault(_RELATORIOS_DE_LOCKS, {})
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--lentos"):
+        return
+    pular = pytest.mark.skip(reason="teste lento; rode com --lentos")
+    for item in items:
+        if "lento" in item.keywords:
+            item.add_marker(pular)
 
 
 @pytest.fixture
@@ -48,6 +91,9 @@ def produto_populado(produto_service):
 @pytest.fixture
 def flask_client():
     flask_app.config["TESTING"] = True
+    # O storage memory:// do limiter é global ao processo: sem o reset, um teste
+    # que esgota o limite de /produtos faria os testes seguintes receberem 429.
+    limiter.reset()
     # O context manager garante que o app context do Flask seja encerrado
     # após cada teste, evitando que o estado do limiter vaze entre testes.
     with flask_app.test_client() as client:
@@ -0,0 +1,611 @@
+"""
+Testes da API REST — comportamento das otimizações da camada HTTP
+
+Usa o test client do Flask sobre o app global (catálogo semeado com 50 produtos).
+Os testes não assumem valores absolutos de estoque, já que outros testes podem
+alterar o mesmo catálogo.
+"""
+import time
+import uuid
+
+import pytest
+
+import app as api
+import api_comum
+from api_comum import MAXIMO_IDS_POR_BUSCA, TAMANHO_MAXIMO_LOTE
+from idempotencia import ChaveReutilizada, IdempotencyCache
+from load_shedding import AdaptiveConcurrencyLimiter, TrafficClass
+from metrics import LatencyHistogram
+from storage import InMemoryStorage, LockProfiler
+
+
+class TestCacheListagemProdutos:
+    def test_listagem_cacheada_igual_a_serializacao_direta(self, flask_client):
+        resp = flask_client.get("/produtos")
+        assert resp.status_code == 200
+        esperado = [
+            {"id": p.id, "nome": p.nome, "preco": p.preco, "estoque": p.estoque}
+            for p in api._api.produto_service.listar_produtos()
+        ]
+        assert resp.get_json() == esperado
+
+    def test_requisicoes_repetidas_nao_chamam_o_servico(self, flask_client, mocker):
+        flask_client.get("/produtos")
+        espiao = mocker.spy(api._api.produto_service, "listar_produtos")
+
+        for _ in range(5):
+            assert flask_client.get("/produtos").status_code == 200
+
+        assert espiao.call_count == 0
+
+    def test_escrita_no_catalogo_invalida_cache_e_etag(self, flask_client):
+        primeira = flask_client.get("/produtos")
+        produto = api._api.produto_service.buscar_produto(1)
+
+        api._api.produto_service.atualizar_estoque(produto.id, 1)
+
+        segunda = flask_client.get("/produtos")
+        assert segunda.headers["ETag"] != primeira.headers["ETag"]
+        estoque = {p["id"]: p["estoque"] for p in segunda.get_json()}
+        assert estoque[produto.id] == produto.estoque
+
+
+class TestRequisicoesCondicionais:
+    def test_listagem_responde_304_sem_chamar_servico(self, flask_client, mocker):
+        etag = flask_client.get("/produtos").headers["ETag"]
+        espiao = mocker.spy(api._api.produto_service, "listar_produtos")
+
+        resp = flask_client.get("/produtos", headers={"If-None-Match": etag})
+
+        assert resp.status_code == 304
+        assert resp.data == b""
+        assert resp.headers["ETag"] == etag
+        assert espiao.call_count == 0
+
+    def test_produto_responde_304_sem_chamar_servico(self, flask_client, mocker):
+        etag = flask_client.get("/produtos/1").headers["ETag"]
+        espiao = mocker.spy(api._api.produto_service, "buscar_produto")
+
+        resp = flask_client.get("/produtos/1", headers={"If-None-Match": etag})
+
+        assert resp.status_code == 304
+        assert espiao.call_count == 0
+
+    def test_etag_de_um_produto_nao_vale_para_outro(self, flask_client):
+        etag = flask_client.get("/produtos/1").headers["ETag"]
+        resp = flask_client.get("/produtos/2", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+
+    def test_catalogo_alterado_responde_200_com_nova_etag(self, flask_client):
+        etag = flask_client.get("/produtos/1").headers["ETag"]
+        api._api.produto_service.atualizar_estoque(1, 1)
+
+        resp = flask_client.get("/produtos/1", headers={"If-None-Match": etag})
+
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+
+class TestPedidosEmLote:
+    def test_lote_retorna_resultado_por_pedido_na_ordem(self, flask_client):
+        resp = flask_client.post("/pedidos/lote", json={"pedidos": [
+            {"itens": [{"produto_id": 1, "quantidade": 1}]},
+            {"itens": [{"produto_id": 99999, "quantidade": 1}]},
+            {"sem_itens": True},
+            {"itens": [{"produto_id": 2, "quantidade": 2}]},
+        ]})
+
+        assert resp.status_code == 200
+        resultados = resp.get_json()["resultados"]
+        assert [r["status"] for r in resultados] == [201, 422, 400, 201]
+        assert resultados[0]["pedido"]["itens"][0]["produto_id"] == 1
+        assert "não encontrado" in resultados[1]["erro"]
+        assert resultados[3]["pedido"]["itens"][0]["quantidade"] == 2
+
+    def test_itens_malformados_recebem_400_na_propria_posicao(self, flask_client):
+        estoque = flask_client.get("/produtos/3").get_json()["estoque"]
+
+        resp = flask_client.post("/pedidos/lote", json={"pedidos": [
+            {"itens": ["produto 3"]},
+            {"itens": [{"produto_id": 3, "quantidade": "1"}]},
+            {"itens": [{"produto_id": 3}]},
+            {"itens": [{"quantidade": 1}]},
+            {"itens": {"produto_id": 3, "quantidade": 1}},
+            "pedido",
+        ]})
+
+        assert resp.status_code == 200
+        assert [r["status"] for r in resp.get_json()["resultados"]] == [400] * 6
+        assert flask_client.get("/produtos/3").get_json()["estoque"] == estoque
+
+    def test_lote_sem_lista_de_pedidos_retorna_400(self, flask_client):
+        assert flask_client.post("/pedidos/lote", json={"itens": []}).status_code == 400
+
+    def test_lote_com_corpo_que_nao_e_objeto_retorna_400(self, flask_client):
+        for corpo in ([1, 2], "pedidos", 7):
+            resp = flask_client.post("/pedidos/lote", json=corpo)
+            assert resp.status_code == 400
+            assert "pedidos é obrigatório" in resp.get_json()["erro"]
+
+    def test_lote_acima_do_maximo_retorna_400(self, flask_client):
+        pedidos = [{"itens": []}] * (TAMANHO_MAXIMO_LOTE + 1)
+        assert flask_client.post("/pedidos/lote", json={"pedidos": pedidos}).status_code == 400
+
+
+class TestBuscaDeVariosProdutos:
+    def test_retorna_produtos_na_ordem_pedida_omitindo_inexistentes(self, flask_client):
+        resp = flask_client.get("/produtos?ids=9,1,99999,5,1")
+
+        assert resp.status_code == 200
+        assert [p["id"] for p in resp.get_json()] == [9, 1, 5]
+        assert "ETag" in resp.headers
+
+    def test_uma_unica_chamada_ao_servico(self, flask_client, mocker):
+        espiao_lote = mocker.spy(api._api.produto_service, "buscar_produtos")
+        espiao_unitario = mocker.spy(api._api.produto_service, "buscar_produto")
+
+        flask_client.get("/produtos?ids=1,2,3,4,5")
+
+        assert espiao_lote.call_count == 1
+        assert espiao_unitario.call_count == 0
+
+    def test_ids_invalidos_retornam_400(self, flask_client):
+        assert flask_client.get("/produtos?ids=1,abc").status_code == 400
+
+    def test_ids_acima_do_maximo_retornam_400(self, flask_client):
+        ids = ",".join(str(i) for i in range(MAXIMO_IDS_POR_BUSCA + 1))
+        assert flask_client.get(f"/produtos?ids={ids}").status_code == 400
+
+
+class TestPaginacaoEProjecao:
+    def test_percorre_catalogo_inteiro_por_cursor(self, flask_client):
+        completo = [p["id"] for p in flask_client.get("/produtos").get_json()]
+
+        vistos, cursor = [], None
+        while True:
+            url = "/produtos?limit=7" + (f"&cursor={cursor}" if cursor else "")
+            resp = flask_client.get(url)
+            assert resp.status_code == 200
+            pagina = resp.get_json()
+            assert len(pagina) <= 7
+            vistos.extend(p["id"] for p in pagina)
+            cursor = resp.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        assert vistos == sorted(completo)
+
+    def test_ultima_pagina_nao_tem_proximo_cursor(self, flask_client):
+        resp = flask_client.get("/produtos?limit=1000")
+        assert "X-Next-Cursor" not in resp.headers
+
+    def test_projecao_retorna_apenas_campos_pedidos(self, flask_client):
+        resp = flask_client.get("/produtos?limit=3&fields=id,preco")
+        assert resp.status_code == 200
+        assert all(set(p) == {"id", "preco"} for p in resp.get_json())
+
+    def test_projecao_sem_paginacao_e_com_ids(self, flask_client):
+        # Respostas em partes são fechadas, como faria o servidor WSGI: só então
+        # a vaga do load shedding é devolvida.
+        with flask_client.get("/produtos?fields=nome") as resp:
+            listagem = resp.get_json()
+        assert len(listagem) >= 50 and all(set(p) == {"nome"} for p in listagem)
+
+        busca = flask_client.get("/produtos?ids=2,3&fields=id").get_json()
+        assert busca == [{"id": 2}, {"id": 3}]
+
+    def test_parametros_invalidos_retornam_400(self, flask_client):
+        for url in (
+            "/produtos?fields=id,senha",
+            "/produtos?limit=0",
+            f"/produtos?limit={10**6}",
+            "/produtos?limit=abc",
+            "/produtos?cursor=-1",
+        ):
+            assert flask_client.get(url).status_code == 400, url
+
+
+class TestBuscaPorIndices:
+    def test_busca_por_prefixo_do_nome(self, flask_client):
+        resp = flask_client.get("/produtos/busca?q=black fri 0&fields=id,nome")
+        assert resp.status_code == 200
+        # "0" é prefixo de "01".."09": os nove primeiros produtos do catálogo semeado.
+        assert [p["id"] for p in resp.get_json()] == list(range(1, 10))
+
+    def test_faixa_de_preco_ordenada_por_preco(self, flask_client):
+        resp = flask_client.get("/produtos/busca?preco_min=20&preco_max=30")
+        precos = [p["preco"] for p in resp.get_json()]
+        assert precos == sorted(precos)
+        assert precos and all(20 <= preco <= 30 for preco in precos)
+
+    def test_nome_e_faixa_de_preco_combinados_com_limite(self, flask_client):
+        resp = flask_client.get("/produtos/busca?q=produto&preco_max=20&limit=2")
+        assert [p["id"] for p in resp.get_json()] == [1, 2]
+
+    def test_parametros_invalidos_retornam_400(self, flask_client):
+        for url in (
+            "/produtos/busca",
+            "/produtos/busca?preco_min=abc",
+            "/produtos/busca?preco_min=-1",
+            "/produtos/busca?preco_min=50&preco_max=10",
+            "/produtos/busca?q=tv&limit=0",
+        ):
+            assert flask_client.get(url).status_code == 400, url
+
+    def test_pedidos_por_status(self, flask_client):
+        criado = flask_client.post("/pedidos", json={"itens": [{"produto_id": 4, "quantidade": 1}]}).get_json()
+
+        # limit máximo: outros módulos de teste podem ter criado mais de 100 pedidos antes.
+        resp = flask_client.get("/pedidos?status=aguardando&limit=1000")
+        assert resp.status_code == 200
+        assert criado["id"] in [p["id"] for p in resp.get_json()]
+        assert all(p["status"] == "AGUARDANDO" for p in resp.get_json())
+        cancelados = flask_client.get("/pedidos?status=CANCELADO").get_json()
+        assert criado["id"] not in [p["id"] for p in cancelados]
+        assert all(p["status"] == "CANCELADO" for p in cancelados)
+
+    def test_status_ausente_ou_invalido_retorna_400(self, flask_client):
+        assert flask_client.get("/pedidos").status_code == 400
+        assert flask_client.get("/pedidos?status=ENVIADO").status_code == 400
+
+
+class TestListagemEmPartes:
+    def _esperado(self, campos=("id", "nome", "preco", "estoque")):
+        produtos = api._api.produto_service.listar_produtos()
+        return api.jsonify([{c: getattr(p, c) for c in campos} for p in produtos]).get_data()
+
+    def test_projecao_e_transmitida_em_partes(self, flask_client):
+        with flask_client.get("/produtos?fields=id,preco") as resp:
+            assert resp.is_streamed
+            assert resp.headers["ETag"].startswith('"produtos-v')
+            assert resp.get_data() == self._esperado(("id", "preco"))
+
+    def test_catalogo_acima_do_limite_nao_e_guardado_em_cache(self, flask_client, mocker, monkeypatch):
+        monkeypatch.setattr(api_comum, "MAXIMO_PRODUTOS_EM_CACHE", 10)
+        api._api.produto_service.atualizar_estoque(1, 1)  # nova versão: sem cache válido
+        espiao = mocker.spy(api._api.produto_service, "listar_produtos_paginado")
+
+        respostas = [flask_client.get("/produtos") for _ in range(3)]
+
+        assert all(r.is_streamed for r in respostas)
+        assert espiao.call_count == 3
+        assert respostas[-1].get_data() == self._esperado()
+        for resp in respostas:
+            resp.close()
+
+    def test_catalogo_grande_e_lido_em_paginas(self, flask_client, mocker, monkeypatch):
+        # Acima do limite do cache, a listagem não passa por get_all: num storage
+        # SQLite isso desserializaria o catálogo inteiro antes da primeira parte.
+        monkeypatch.setattr(api_comum, "MAXIMO_PRODUTOS_EM_CACHE", 10)
+        monkeypatch.setattr(api_comum, "TAMANHO_PARTE_JSON", 7)
+        storage = api._api.produto_repo.storage
+        espiao_tudo = mocker.spy(storage, "get_all")
+        espiao_pagina = mocker.spy(storage, "get_page")
+
+        with flask_client.get("/produtos") as resp:
+            corpo = resp.get_data()
+
+        assert espiao_tudo.call_count == 0
+        assert max(c.args[1] for c in espiao_pagina.call_args_list[1:]) == 7
+        assert corpo == self._esperado()
+
+    def test_vaga_e_latencia_valem_ate_a_ultima_parte(self, flask_client, monkeypatch):
+        # O corpo é gerado depois que a rota retorna: a vaga do load shedding só
+        # é devolvida, e a latência só é registrada, quando o envio termina.
+        espera = 0.05
+        para_dict = api_comum.produto_para_dict
+
+        def produto_lento(produto, campos=api_comum.CAMPOS_PRODUTO):
+            time.sleep(espera / 50)
+            return para_dict(produto, campos)
+
+        monkeypatch.setattr(api_comum, "produto_para_dict", produto_lento)
+        serie = 'bfshop_requisicao_latencia_segundos_sum{rota="listar_produtos"}'
+        metricas = flask_client.get("/metrics").get_data(as_text=True)
+        antes = _amostra(metricas, serie) if serie in metricas else 0
+
+        resp = flask_client.get("/produtos?fields=id")
+        assert api._api.limitador.in_flight == 1
+        resp.get_data()
+        resp.close()
+
+        assert api._api.limitador.in_flight == 0
+        depois = _amostra(flask_client.get("/metrics").get_data(as_text=True), serie)
+        assert depois - antes >= espera
+
+
+class TestRelatorioDeVendas:
+    def test_pedido_criado_entra_no_relatorio(self, flask_client):
+        antes = flask_client.get("/relatorios/vendas").get_json()
+        flask_client.post("/pedidos", json={"itens": [{"produto_id": 6, "quantidade": 3}]})
+        depois = flask_client.get("/relatorios/vendas").get_json()
+
+        preco = api._api.produto_service.buscar_produto(6).preco
+        assert depois["receita_total"] == round(antes["receita_total"] + 3 * preco, 2)
+        assert depois["por_status"]["AGUARDANDO"]["pedidos"] == antes["por_status"]["AGUARDANDO"]["pedidos"] + 1
+        def unidades(relatorio):
+            return {p["produto_id"]: p["unidades"] for p in relatorio["produtos"]}.get(6, 0)
+
+        assert unidades(depois) == unidades(antes) + 3
+
+    def test_nao_varre_os_pedidos(self, flask_client, mocker):
+        espiao = mocker.spy(api._api.pedido_repo, "find_all")
+        assert flask_client.get("/relatorios/vendas").status_code == 200
+        assert espiao.call_count == 0
+
+
+class TestCicloDeVidaDoPedido:
+    def _criar(self, flask_client, produto_id=7, quantidade=2):
+        resp = flask_client.post("/pedidos", json={"itens": [{"produto_id": produto_id, "quantidade": quantidade}]})
+        assert resp.status_code == 201
+        return resp.get_json()["id"]
+
+    def test_confirmar_pedido(self, flask_client):
+        id = self._criar(flask_client)
+        resp = flask_client.post(f"/pedidos/{id}/confirmar")
+        assert resp.status_code == 200
+        assert resp.get_json()["status"] == "CONFIRMADO"
+        assert api._api.pedido_repo.find_by_id(id).status.value == "CONFIRMADO"
+
+    def test_cancelar_devolve_estoque(self, flask_client):
+        estoque_antes = api._api.produto_service.buscar_produto(7).estoque
+        id = self._criar(flask_client, quantidade=3)
+        assert api._api.produto_service.buscar_produto(7).estoque == estoque_antes - 3
+
+        resp = flask_client.post(f"/pedidos/{id}/cancelar")
+        assert resp.status_code == 200
+        assert resp.get_json()["status"] == "CANCELADO"
+        assert api._api.produto_service.buscar_produto(7).estoque == estoque_antes
+
+    def test_pedido_confirmado_pode_ser_cancelado(self, flask_client):
+        estoque_antes = api._api.produto_service.buscar_produto(7).estoque
+        id = self._criar(flask_client)
+        flask_client.post(f"/pedidos/{id}/confirmar")
+        assert flask_client.post(f"/pedidos/{id}/cancelar").status_code == 200
+        assert api._api.produto_service.buscar_produto(7).estoque == estoque_antes
+
+    def test_transicao_invalida_retorna_409(self, flask_client):
+        id = self._criar(flask_client)
+        assert flask_client.post(f"/pedidos/{id}/cancelar").status_code == 200
+        estoque = api._api.produto_service.buscar_produto(7).estoque
+
+        for acao in ("confirmar", "cancelar"):
+            resp = flask_client.post(f"/pedidos/{id}/{acao}")
+            assert resp.status_code == 409
+            assert "CANCELADO" in resp.get_json()["erro"]
+        # Cancelar de novo não devolve o estoque uma segunda vez.
+        assert api._api.produto_service.buscar_produto(7).estoque == estoque
+
+    def test_pedido_inexistente_retorna_404(self, flask_client):
+        assert flask_client.post("/pedidos/99999/confirmar").status_code == 404
+        assert flask_client.post("/pedidos/99999/cancelar").status_code == 404
+
+    def test_relatorio_acompanha_o_cancelamento(self, flask_client):
+        id = self._criar(flask_client)
+        antes = flask_client.get("/relatorios/vendas").get_json()
+        flask_client.post(f"/pedidos/{id}/cancelar")
+        depois = flask_client.get("/relatorios/vendas").get_json()
+
+        assert depois["por_status"]["CANCELADO"]["pedidos"] == antes["por_status"]["CANCELADO"]["pedidos"] + 1
+        assert depois["receita_total"] < antes["receita_total"]
+
+
+class TestIdempotencia:
+    def _post(self, flask_client, chave, quantidade=1):
+        return flask_client.post(
+            "/pedidos",
+            json={"itens": [{"produto_id": 8, "quantidade": quantidade}]},
+            headers={"Idempotency-Key": chave},
+        )
+
+    def test_repeticao_devolve_o_mesmo_pedido_sem_criar_outro(self, flask_client):
+        chave = str(uuid.uuid4())
+        primeira = self._post(flask_client, chave)
+        estoque = api._api.produto_service.buscar_produto(8).estoque
+        total_pedidos = len(api._api.pedido_repo.find_all())
+
+        segunda = self._post(flask_client, chave)
+
+        assert segunda.status_code == primeira.status_code == 201
+        assert segunda.get_json() == primeira.get_json()
+        assert segunda.headers["Idempotent-Replayed"] == "true"
+        assert "Idempotent-Replayed" not in primeira.headers
+        assert api._api.produto_service.buscar_produto(8).estoque == estoque
+        assert len(api._api.pedido_repo.find_all()) == total_pedidos
+
+    def test_erro_de_negocio_tambem_e_repetido(self, flask_client):
+        chave = str(uuid.uuid4())
+        primeira = self._post(flask_client, chave, quantidade=10**9)
+        assert primeira.status_code == 422
+        segunda = self._post(flask_client, chave, quantidade=10**9)
+        assert segunda.status_code == 422
+        assert segunda.get_json() == primeira.get_json()
+
+    def test_mesma_chave_com_outro_corpo_retorna_422(self, flask_client):
+        chave = str(uuid.uuid4())
+        self._post(flask_client, chave, quantidade=1)
+        resp = self._post(flask_client, chave, quantidade=2)
+        assert resp.status_code == 422
+        assert "Idempotency-Key" in resp.get_json()["erro"]
+
+    def test_chave_longa_demais_retorna_400(self, flask_client):
+        assert self._post(flask_client, "x" * 256).status_code == 400
+
+    def test_estatisticas_expostas(self, flask_client):
+        antes = flask_client.get("/admin/idempotencia").get_json()
+        chave = str(uuid.uuid4())
+        self._post(flask_client, chave)
+        self._post(flask_client, chave)
+        depois = flask_client.get("/admin/idempotencia").get_json()
+        assert depois["faltas"] == antes["faltas"] + 1
+        assert depois["acertos"] == antes["acertos"] + 1
+
+    def test_lru_limita_o_numero_de_entradas(self):
+        cache = IdempotencyCache(max_entries=3)
+        for chave in "abc":
+            cache.executar(chave, {}, lambda: chave)
+        cache.executar("a", {}, lambda: "nunca")  # "a" volta a ser a mais recente
+        cache.executar("d", {}, lambda: "d")
+
+        assert len(cache) == 3
+        assert cache.despejadas == 1
+        assert cache.executar("a", {}, lambda: "nunca") == ("a", True)
+        assert cache.executar("b", {}, lambda: "b de novo") == ("b de novo", False)
+
+    def test_entrada_expira_depois_do_ttl(self):
+        agora = [0.0]
+        cache = IdempotencyCache(ttl=10.0, clock=lambda: agora[0])
+        assert cache.executar("k", {}, lambda: 1) == (1, False)
+        agora[0] = 9.9
+        assert cache.executar("k", {}, lambda: 2) == (1, True)
+        agora[0] = 10.0
+        assert cache.executar("k", {}, lambda: 3) == (3, False)
+        assert cache.expiradas == 1
+
+    def test_excecao_inesperada_libera_a_chave(self):
+        cache = IdempotencyCache()
+
+        def falhar():
+            raise RuntimeError("banco fora do ar")
+
+        with pytest.raises(RuntimeError):
+            cache.executar("k", {}, falhar)
+        assert cache.executar("k", {}, lambda: "ok") == ("ok", False)
+        with pytest.raises(ChaveReutilizada):
+            cache.executar("k", {"outro": 1}, lambda: "nunca")
+
+
+class TestLoadShedding:
+    @pytest.fixture
+    def servidor_saturado(self, monkeypatch):
+        # Uma vaga só, já ocupada, e nenhuma espera permitida na fila.
+        limitador = AdaptiveConcurrencyLimiter(
+            initial_limit=1,
+            max_queue_delay=0.0,
+            classes=(TrafficClass("checkout", priority=1), TrafficClass("catalogo")),
+        )
+        monkeypatch.setattr(api._api, "limitador", limitador)
+        admitida_em = limitador.acquire("catalogo")
+        yield limitador
+        limitador.release(admitida_em, "catalogo")
+
+    def test_sobrecarga_retorna_503_com_retry_after(self, flask_client, servidor_saturado):
+        resp = flask_client.get("/produtos")
+        assert resp.status_code == 503
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert servidor_saturado.estatisticas()["recusadas"] == 1
+
+    def test_rotas_classificadas_por_trafego(self, flask_client, servidor_saturado):
+        flask_client.get("/produtos")
+        flask_client.post("/pedidos", json={"itens": [{"produto_id": 1, "quantidade": 1}]})
+        classes = servidor_saturado.estatisticas()["classes"]
+        assert classes["catalogo"]["recusadas"] == 1
+        assert classes["checkout"]["recusadas"] == 1
+
+    def test_saude_e_diagnostico_nao_sao_descartados(self, flask_client, servidor_saturado):
+        assert flask_client.get("/saude").status_code == 200
+        resp = flask_client.get("/admin/carga")
+        assert resp.status_code == 200
+        assert resp.get_json()["em_andamento"] == 1
+
+    def test_vaga_e_liberada_ao_fim_da_requisicao(self, flask_client):
+        assert flask_client.get("/produtos/1").status_code == 200
+        assert flask_client.post("/pedidos", json={"itens": [{"produto_id": 10**6, "quantidade": 1}]}).status_code == 422
+        assert api._api.limitador.in_flight == 0
+
+
+def _amostra(metricas: str, serie: str) -> float:
+    for linha in metricas.splitlines():
+        nome, _, valor = linha.rpartition(" ")
+        if nome == serie:
+            return float(valor)
+    raise AssertionError(f"{serie} ausente de /metrics")
+
+
+class TestMetricas:
+    def test_quantis_do_histograma_tem_erro_relativo_pequeno(self):
+        histograma = LatencyHistogram()
+        amostras = [i / 10_000 for i in range(1, 10_001)]  # 0,1ms a 1s
+        for amostra in amostras:
+            histograma.registrar(amostra)
+        for quantil, valor in zip((0.5, 0.95, 0.99), histograma.quantis()):
+            exato = amostras[int(quantil * len(amostras)) - 1]
+            assert exato <= valor <= exato * 1.04
+        assert histograma.contagem == len(amostras)
+
+    def test_quantis_cobrem_so_as_ultimas_duas_janelas(self):
+        agora = [0.0]
+        histograma = LatencyHistogram(janela=60.0, clock=lambda: agora[0])
+        for _ in range(100):
+            histograma.registrar(1.0)
+        agora[0] = 61.0
+        histograma.registrar(0.001)
+        assert histograma.quantis([0.5])[0] > 0.9  # janela anterior ainda conta
+        agora[0] = 121.0
+        assert histograma.quantis([0.5])[0] < 0.0011
+        agora[0] = 300.0
+        assert histograma.quantis() == [None, None, None]
+        # _sum e _count continuam acumulados.
+        assert histograma.contagem == 101
+
+    def test_expoe_latencia_por_rota_e_por_operacao_de_servico(self, flask_client):
+        flask_client.get("/produtos/1")
+        resp = flask_client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.content_type.startswith("text/plain; version=0.0.4")
+        texto = resp.get_data(as_text=True)
+        assert "# TYPE bfshop_requisicao_latencia_segundos summary" in texto
+        assert _amostra(texto, 'bfshop_requisicao_latencia_segundos_count{rota="buscar_produto"}') >= 1
+        assert _amostra(texto, 'bfshop_requisicao_latencia_segundos{rota="buscar_produto",quantile="0.99"}') > 0
+        assert _amostra(texto, 'bfshop_requisicoes_total{rota="buscar_produto",status="200"}') >= 1
+        assert _amostra(
+            texto, 'bfshop_servico_latencia_segundos_count{operacao="ProdutoService.buscar_produto"}'
+        ) >= 1
+        assert _amostra(texto, 'bfshop_storage_lock_aquisicoes_total{storage="produtos"}') > 0
+
+    def test_metrics_fora_do_rate_limit(self, flask_client):
+        # 100/min é o limite padrão; um scraper a cada poucos segundos passaria disso.
+        assert all(flask_client.get("/metrics").status_code == 200 for _ in range(110))
+
+    def test_recusas_sao_contadas_sem_entrar_nos_quantis(self, flask_client, monkeypatch):
+        limitador = AdaptiveConcurrencyLimiter(
+            initial_limit=1,
+            max_queue_delay=0.0,
+            classes=(TrafficClass("checkout", priority=1), TrafficClass("catalogo")),
+        )
+        monkeypatch.setattr(api._api, "limitador", limitador)
+        antes = flask_client.get("/metrics").get_data(as_text=True)
+        admitida_em = limitador.acquire("catalogo")
+        try:
+            assert flask_client.get("/relatorios/vendas").status_code == 503
+            depois = flask_client.get("/metrics")
+        finally:
+            limitador.release(admitida_em, "catalogo")
+
+        assert depois.status_code == 200
+        depois = depois.get_data(as_text=True)
+        assert _amostra(depois, 'bfshop_requisicoes_total{rota="relatorio_de_vendas",status="503"}') >= 1
+        serie = 'bfshop_requisicao_latencia_segundos_count{rota="relatorio_de_vendas"}'
+        contagem_antes = _amostra(antes, serie) if serie in antes else 0
+        contagem_depois = _amostra(depois, serie) if serie in depois else 0
+        assert contagem_depois == contagem_antes
+
+
+class TestContencaoDeLocks:
+    def test_desligado_por_padrao(self, flask_client):
+        resp = flask_client.get("/admin/locks")
+        assert resp.status_code == 404
+        assert "BF_PERFIL_DE_LOCKS" in resp.get_json()["erro"]
+
+    def test_relatorio_sob_demanda(self, flask_client, monkeypatch):
+        storage = InMemoryStorage(lock_profiler=LockProfiler())
+        storage.add(1, "item")
+        storage.get(1)
+        monkeypatch.setattr(api._api, "storages", {"produtos": storage, "pedidos": InMemoryStorage()})
+
+        resp = flask_client.get("/admin/locks")
+        assert resp.status_code == 200
+        relatorio = resp.get_json()
+        assert set(relatorio) == {"produtos"}
+        assert relatorio["produtos"]["operacoes"]["get"]["aquisicoes"] == 1
+        assert relatorio["produtos"]["operacoes"]["add"]["aquisicoes"] == 1
@@ -0,0 +1,265 @@
+"""
+Testes da variante assíncrona (ASGI) — app_asgi.py
+
+O app é chamado diretamente pelo protocolo ASGI (scope/receive/send) dentro de um
+event loop, sem servidor externo, como o test client faz para o Flask.
+"""
+import asyncio
+import json
+import time
+import pytest
+
+import app_asgi
+from api_comum import ROTAS
+from load_shedding import AdaptiveConcurrencyLimiter, TrafficClass
+from models import StatusPedido
+from repository import PedidoRepository
+from service import PedidoServiceAsync
+from storage import InMemoryStorage
+
+
+async def _chamar(metodo: str, caminho: str, corpo=None, headers=None, ip="127.0.0.1"):
+    caminho, _, query = caminho.partition("?")
+    dados = json.dumps(corpo).encode() if corpo is not None else b""
+    scope = {
+        "type": "http",
+        "method": metodo,
+        "path": caminho,
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": (ip, 50000),
+    }
+    mensagens = []
+
+    async def receive():
+        return {"type": "http.request", "body": dados, "more_body": False}
+
+    async def send(mensagem):
+        mensagens.append(mensagem)
+
+    await app_asgi.app(scope, receive, send)
+    status = mensagens[0]["status"]
+    resp_headers = {k.decode(): v.decode() for k, v in mensagens[0]["headers"]}
+    corpo_resp = b"".join(m["body"] for m in mensagens[1:])
+    return status, resp_headers, json.loads(corpo_resp) if corpo_resp else None
+
+
+async def _chamar_bruto(metodo: str, caminho: str):
+    # Para respostas que não são JSON (GET /metrics).
+    mensagens = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensagem):
+        mensagens.append(mensagem)
+
+    scope = {"type": "http", "method": metodo, "path": caminho, "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 50000)}
+    await app_asgi.app(scope, receive, send)
+    resp_headers = {k.decode(): v.decode() for k, v in mensagens[0]["headers"]}
+    return mensagens[0]["status"], resp_headers, b"".join(m["body"] for m in mensagens[1:]).decode()
+
+
+def chamar(*args, **kwargs):
+    return asyncio.run(_chamar(*args, **kwargs))
+
+
+@pytest.fixture(autouse=True)
+def limiter_zerado():
+    asyncio.run(app_asgi._limiter_storage.reset())
+
+
+class TestRotasAsgi:
+    def test_listagem_igual_ao_catalogo(self):
+        status, headers, corpo = chamar("GET", "/produtos")
+        assert status == 200
+        assert headers["etag"].startswith('"produtos-v')
+        assert [p["id"] for p in corpo] == [p.id for p in app_asgi._api.produto_repo.find_all()]
+
+    def test_listagem_responde_304_com_etag_atual(self):
+        _, headers, _ = chamar("GET", "/produtos")
+        status, _, corpo = chamar("GET", "/produtos", headers={"If-None-Match": headers["etag"]})
+        assert status == 304 and corpo is None
+
+    def test_paginacao_e_projecao(self):
+        status, headers, corpo = chamar("GET", "/produtos?limit=5&fields=id")
+        assert status == 200
+        assert corpo == [{"id": i} for i in range(1, 6)]
+        assert headers["x-next-cursor"] == "5"
+
+    def test_produto_inexistente_retorna_404(self):
+        status, _, corpo = chamar("GET", "/produtos/99999")
+        assert status == 404 and "não encontrado" in corpo["erro"]
+
+    def test_criar_pedido_baixa_estoque(self):
+        estoque_antes = app_asgi._api.produto_repo.find_by_id(3).estoque
+        status, _, corpo = chamar("POST", "/pedidos", {"itens": [{"produto_id": 3, "quantidade": 2}]})
+        assert status == 201 and corpo["status"] == "AGUARDANDO"
+        assert app_asgi._api.produto_repo.find_by_id(3).estoque == estoque_antes - 2
+
+    def test_corpo_invalido_retorna_400(self):
+        assert chamar("POST", "/pedidos", {"sem_itens": []})[0] == 400
+        assert chamar("POST", "/pedidos/lote", [1, 2])[0] == 400
+
+    def test_projecao_e_enviada_em_partes_sem_content_length(self):
+        status, headers, corpo = chamar("GET", "/produtos?fields=id")
+        assert status == 200 and "content-length" not in headers
+        assert corpo == [{"id": p.id} for p in app_asgi._api.produto_repo.find_all()]
+
+    def test_relatorio_de_vendas(self):
+        status, _, corpo = chamar("GET", "/relatorios/vendas")
+        assert status == 200 and set(corpo) == {"receita_total", "por_status", "produtos"}
+
+    def test_busca_e_pedidos_por_status(self):
+        status, _, corpo = chamar("GET", "/produtos/busca?q=friday+50&fields=id")
+        assert status == 200 and corpo == [{"id": 50}]
+        status, _, corpo = chamar("GET", "/pedidos?status=AGUARDANDO")
+        assert status == 200 and all(p["status"] == "AGUARDANDO" for p in corpo)
+        assert chamar("GET", "/pedidos")[0] == 400
+
+    def test_confirmar_e_cancelar_pedido(self):
+        estoque_antes = app_asgi._api.produto_repo.find_by_id(4).estoque
+        _, _, pedido = chamar("POST", "/pedidos", {"itens": [{"produto_id": 4, "quantidade": 2}]})
+
+        status, _, corpo = chamar("POST", f"/pedidos/{pedido['id']}/confirmar")
+        assert status == 200 and corpo["status"] == "CONFIRMADO"
+        status, _, corpo = chamar("POST", f"/pedidos/{pedido['id']}/cancelar")
+        assert status == 200 and corpo["status"] == "CANCELADO"
+        assert app_asgi._api.produto_repo.find_by_id(4).estoque == estoque_antes
+        assert chamar("POST", f"/pedidos/{pedido['id']}/confirmar")[0] == 409
+        assert chamar("POST", "/pedidos/99999/cancelar")[0] == 404
+
+    def test_repeticoes_com_idempotency_key_criam_um_pedido(self):
+        total_antes = len(app_asgi._api.pedido_repo.find_all())
+        headers = {"idempotency-key": "asgi-repetida"}
+        corpo = {"itens": [{"produto_id": 5, "quantidade": 1}]}
+
+        async def repeticoes():
+            return await asyncio.gather(*(
+                _chamar("POST", "/pedidos", corpo, headers=headers, ip=f"10.1.0.{i}") for i in range(10)
+            ))
+
+        respostas = asyncio.run(repeticoes())
+        assert {r[0] for r in respostas} == {201}
+        assert len({r[2]["id"] for r in respostas}) == 1
+        assert sum(r[1].get("idempotent-replayed") == "true" for r in respostas) == 9
+        assert len(app_asgi._api.pedido_repo.find_all()) == total_antes + 1
+
+    def test_rota_e_metodo_desconhecidos(self):
+        assert chamar("GET", "/inexistente")[0] == 404
+        assert chamar("DELETE", "/produtos")[0] == 405
+
+
+class TestRateLimitingAsgi:
+    def test_rate_limit_retorna_429_com_retry_after(self):
+        async def rajada():
+            return [await _chamar("GET", "/produtos/1") for _ in range(105)]
+
+        respostas = asyncio.run(rajada())
+        bloqueadas = [r for r in respostas if r[0] == 429]
+        assert len(bloqueadas) == 5
+        assert "retry-after" in bloqueadas[0][1]
+
+    def test_saude_nao_e_limitado(self):
+        for _ in range(105):
+            assert chamar("GET", "/saude")[0] == 200
+
+
+class TestMetricasAsgi:
+    def test_metrics_com_latencia_por_rota_fora_do_rate_limit(self):
+        chamar("GET", "/produtos/1")
+        for _ in range(105):
+            status, headers, _ = asyncio.run(_chamar_bruto("GET", "/metrics"))
+            assert status == 200
+        assert headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    def test_metrics_expoe_rota_servico_e_locks(self):
+        chamar("GET", "/produtos/1")
+        _, _, texto = asyncio.run(_chamar_bruto("GET", "/metrics"))
+        assert 'bfshop_requisicao_latencia_segundos_count{rota="buscar_produto"}' in texto
+        assert 'bfshop_requisicoes_total{rota="buscar_produto",status="200"}' in texto
+        assert 'bfshop_servico_latencia_segundos_count{operacao="ProdutoServiceAsync.buscar_produto_async"}' in texto
+        assert 'bfshop_storage_lock_aquisicoes_total{storage="produtos"}' in texto
+
+
+class TestLoadSheddingAsgi:
+    def test_sobrecarga_retorna_503_e_saude_continua_respondendo(self, monkeypatch):
+        limitador = AdaptiveConcurrencyLimiter(
+            initial_limit=1,
+            max_queue_delay=0.0,
+            classes=(TrafficClass("checkout", priority=1), TrafficClass("catalogo")),
+        )
+        monkeypatch.setattr(app_asgi._api, "limitador", limitador)
+        admitida_em = limitador.acquire("checkout")
+
+        status, headers, _ = chamar("GET", "/produtos/1")
+        assert status == 503 and int(headers["retry-after"]) >= 1
+        assert chamar("GET", "/saude")[0] == 200
+        assert chamar("GET", "/admin/carga")[2]["recusadas"] == 1
+
+        limitador.release(admitida_em, "checkout")
+        assert chamar("GET", "/produtos/1")[0] == 200
+        assert limitador.in_flight == 0
+
+
+class TestConcorrenciaAsgi:
+    def test_requisicoes_concorrentes_compartilham_o_event_loop(self, monkeypatch):
+        # 500 buscas vindas de IPs distintos (para não esbarrar no rate limit) e
+        # um limite de concorrência que comporta todas: o que se mede aqui é o
+        # event loop, não o load shedding, que recusaria parte da rajada.
+        monkeypatch.setattr(app_asgi._api, "limitador", AdaptiveConcurrencyLimiter(
+            initial_limit=500, max_limit=500, classes=(TrafficClass("checkout"), TrafficClass("catalogo"))
+        ))
+        # Em série, a latência simulada somaria ~500ms; no event loop as esperas
+        # se sobrepõem e o lote inteiro termina em uma fração disso, sem threads.
+        async def rajada():
+            return await asyncio.gather(*(
+                _chamar("GET", f"/produtos/{i % 50 + 1}", ip=f"10.0.{i // 250}.{i % 250}")
+                for i in range(500)
+            ))
+
+        inicio = time.perf_counter()
+        respostas = asyncio.run(rajada())
+        duracao = time.perf_counter() - inicio
+
+        assert all(r[0] == 200 for r in respostas)
+        assert duracao < 0.25, f"500 requisições concorrentes levaram {duracao*1000:.0f}ms"
+
+
+class TestRotasCompartilhadas:
+    def test_servicos_assincronos_mantem_os_metodos_sincronos(self):
+        # As variantes com await têm nome próprio: o mesmo método devolve o
+        # mesmo tipo de resultado com o serviço síncrono ou o assíncrono.
+        servico = PedidoServiceAsync(app_asgi._api.produto_repo, PedidoRepository(InMemoryStorage()))
+        assert servico.listar_pedidos_por_status(StatusPedido.AGUARDANDO) == []
+        assert asyncio.run(servico.listar_pedidos_por_status_async(StatusPedido.AGUARDANDO)) == []
+
+    def test_flask_e_asgi_servem_a_mesma_tabela_de_rotas(self):
+        from app import app as flask_app
+
+        regras = {(r.rule, m) for r in flask_app.url_map.iter_rules() for m in r.methods if r.endpoint != "static"}
+        assert {(r.caminho, r.metodo) for r in ROTAS} <= regras
+        assert len(app_asgi._rotas) == len(ROTAS)
+
+
+class TestListagemEmPartesAsgi:
+    def test_vaga_so_e_devolvida_depois_da_ultima_parte(self):
+        ocupadas = []
+
+        async def enviar_e_observar():
+            scope = {"type": "http", "method": "GET", "path": "/produtos", "query_string": b"fields=id",
+                     "headers": [], "client": ("10.9.0.1", 50000)}
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(mensagem):
+                if mensagem["type"] == "http.response.body":
+                    ocupadas.append(app_asgi._api.limitador.in_flight)
+
+            await app_asgi.app(scope, receive, send)
+
+        asyncio.run(enviar_e_observar())
+        assert ocupadas and all(n == 1 for n in ocupadas)
+        assert app_asgi._api.limitador.in_flight == 0
@@ -0,0 +1,647 @@
+"""
+Testes de Concorrência — ThreadPoolExecutor
+Meta: nenhuma venda além do estoque (oversell) com dezenas de threads disputando
+o mesmo produto.
+
+Os testes operam diretamente sobre a camada de serviço, como os de escalabilidade,
+e verificam invariantes de estado em vez de tempo.
+"""
+import concurrent.futures
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+from limits import parse
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from api_comum import semear_catalogo, vendas_parciais_por_worker
+from idempotencia import IdempotencyCache
+from latency import ConstantLatency, DbLatencySimulator
+from limiter_storage import MappedSlidingWindowStorage
+from load_shedding import AdaptiveConcurrencyLimiter, Sobrecarga, TrafficClass
+from metrics import LatencyHistogram
+from shared_catalog import SharedMemoryCatalog
+from models import ItemCarrinho, Pedido, Produto, StatusPedido
+from relatorios import AgregadosDeVendas
+from storage import InMemoryStorage, SQLiteStorage
+from repository import ProdutoRepository, PedidoRepository
+from service import ProdutoService, PedidoService
+
+N_THREADS = 32
+
+
+def _tentar_pedido(pedido_service, itens) -> bool:
+    try:
+        pedido_service.criar_pedido(itens)
+        return True
+    except ValueError:
+        return False
+
+
+class TestReservaDeEstoque:
+    def test_sku_concorrido_por_32_threads_nao_vende_alem_do_estoque(
+        self, produto_service, pedido_service
+    ):
+        produto = produto_service.cadastrar_produto("Console Black Friday", 4000.0, 500)
+        itens = [{"produto_id": produto.id, "quantidade": 1}]
+
+        # 4x mais tentativas do que unidades em estoque.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            resultados = list(executor.map(
+                lambda _: _tentar_pedido(pedido_service, itens), range(2000)
+            ))
+
+        vendidos = sum(resultados)
+        assert vendidos == 500, f"{vendidos} pedidos aceitos para 500 unidades em estoque"
+        assert produto_service.buscar_produto(produto.id).estoque == 0
+        assert len(pedido_service.pedido_repo.find_all()) == 500
+
+    def test_pedidos_multi_item_em_ordens_opostas_nao_travam(
+        self, produto_service, pedido_service
+    ):
+        # Metade dos pedidos lista A antes de B e a outra metade B antes de A:
+        # sem a aquisição ordenada dos locks, o padrão clássico de deadlock.
+        a = produto_service.cadastrar_produto("Produto A", 10.0, 10_000)
+        b = produto_service.cadastrar_produto("Produto B", 20.0, 10_000)
+        ordens = [
+            [{"produto_id": a.id, "quantidade": 1}, {"produto_id": b.id, "quantidade": 1}],
+            [{"produto_id": b.id, "quantidade": 1}, {"produto_id": a.id, "quantidade": 1}],
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            futures = [
+                executor.submit(pedido_service.criar_pedido, ordens[i % 2])
+                for i in range(1000)
+            ]
+            concluidos, pendentes = concurrent.futures.wait(futures, timeout=30)
+
+        assert not pendentes, "Pedidos multi-item não terminaram — possível deadlock"
+        assert produto_service.buscar_produto(a.id).estoque == 9_000
+        assert produto_service.buscar_produto(b.id).estoque == 9_000
+
+    def test_pedido_recusado_nao_reserva_nenhum_item(self, produto_service, pedido_service):
+        a = produto_service.cadastrar_produto("Produto A", 10.0, 5)
+        b = produto_service.cadastrar_produto("Produto B", 20.0, 1)
+
+        with pytest.raises(ValueError, match="Estoque insuficiente"):
+            pedido_service.criar_pedido([
+                {"produto_id": a.id, "quantidade": 2},
+                {"produto_id": b.id, "quantidade": 2},
+            ])
+
+        assert produto_service.buscar_produto(a.id).estoque == 5
+        assert produto_service.buscar_produto(b.id).estoque == 1
+
+    def test_item_malformado_no_lote_recusa_so_a_propria_entrada(self, produto_service, pedido_service):
+        produto = produto_service.cadastrar_produto("Produto A", 10.0, 1000)
+        valido = [{"produto_id": produto.id, "quantidade": 1}]
+
+        resultados = pedido_service.criar_pedidos_em_lote([
+            valido,
+            [{"produto_id": produto.id}],
+            [{"produto_id": produto.id, "quantidade": "2"}],
+            [valido[0], "item"],
+            {"produto_id": produto.id},
+            valido,
+        ])
+
+        assert [type(r) for r in resultados] == [Pedido] + [ValueError] * 4 + [Pedido]
+        assert produto_service.buscar_produto(produto.id).estoque == 998
+        assert len(pedido_service.pedido_repo.find_all()) == 2
+
+    def test_falha_ao_gravar_o_lote_devolve_todas_as_reservas(self, produto_service, pedido_service, mocker):
+        produto = produto_service.cadastrar_produto("Produto A", 10.0, 1000)
+        mocker.patch.object(pedido_service.pedido_repo, "save_many", side_effect=OSError("disco cheio"))
+
+        with pytest.raises(OSError):
+            pedido_service.criar_pedidos_em_lote([[{"produto_id": produto.id, "quantidade": 5}]] * 3)
+
+        assert produto_service.buscar_produto(produto.id).estoque == 1000
+        assert pedido_service.relatorio_de_vendas()["receita_total"] == 0
+
+    def test_atualizar_estoque_concorrente_nao_fica_negativo(self, produto_service):
+        produto = produto_service.cadastrar_produto("Fone Bluetooth", 150.0, 100)
+
+        def baixar(_):
+            try:
+                produto_service.atualizar_estoque(produto.id, 3)
+                return True
+            except ValueError:
+                return False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            aceitas = sum(executor.map(baixar, range(200)))
+
+        assert aceitas == 33
+        assert produto_service.buscar_produto(produto.id).estoque == 1
+
+
+class TestAgregadosDeVendas:
+    def test_agregados_concorrentes_iguais_a_varredura_dos_pedidos(self, produto_service, pedido_service):
+        a = produto_service.cadastrar_produto("Produto A", 10.10, 100_000)
+        b = produto_service.cadastrar_produto("Produto B", 0.30, 100_000)
+        pedidos = [
+            [{"produto_id": a.id, "quantidade": 1 + i % 3}, {"produto_id": b.id, "quantidade": 7}]
+            for i in range(1000)
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            list(executor.map(pedido_service.criar_pedido, pedidos[:500]))
+            lotes = [pedidos[i:i + 50] for i in range(500, 1000, 50)]
+            list(executor.map(pedido_service.criar_pedidos_em_lote, lotes))
+
+        relatorio = pedido_service.relatorio_de_vendas()
+        varredura = AgregadosDeVendas(pedido_service.pedido_repo.find_all()).relatorio()
+        assert relatorio == varredura
+        assert relatorio["por_status"]["AGUARDANDO"]["pedidos"] == 1000
+        unidades = {p["produto_id"]: p["unidades"] for p in relatorio["produtos"]}
+        assert unidades == {a.id: sum(1 + i % 3 for i in range(1000)), b.id: 7000}
+        # Em centavos, sem erro acumulado de ponto flutuante.
+        assert relatorio["receita_total"] == round(unidades[a.id] * 10.10 + 7000 * 0.30, 2)
+
+    def test_workers_no_mesmo_sqlite_veem_o_mesmo_relatorio(self, tmp_path):
+        # Dois workers sobre o mesmo arquivo: o relatório de cada um inclui os
+        # pedidos e cancelamentos do outro, e um worker novo (restart) parte
+        # dos pedidos já gravados.
+        caminho = str(tmp_path / "bfshop.db")
+
+        def worker():
+            produto_repo = ProdutoRepository(SQLiteStorage(caminho, "produtos"))
+            return PedidoService(produto_repo, PedidoRepository(SQLiteStorage(caminho, "pedidos")))
+
+        a, b = worker(), worker()
+        produto = ProdutoService(a.produto_repo).cadastrar_produto("Produto A", 10.0, 100)
+        itens = [{"produto_id": produto.id, "quantidade": 2}]
+        a.criar_pedido(itens)
+        cancelado = b.criar_pedido(itens)
+        b.criar_pedidos_em_lote([itens, itens])
+        a.cancelar_pedido(cancelado.id)
+
+        relatorios = [a.relatorio_de_vendas(), b.relatorio_de_vendas(), worker().relatorio_de_vendas()]
+        assert relatorios[0] == relatorios[1] == relatorios[2]
+        assert relatorios[0]["por_status"]["AGUARDANDO"] == {"pedidos": 3, "receita": 60.0}
+        assert relatorios[0]["por_status"]["CANCELADO"]["pedidos"] == 1
+
+    def test_relatorio_recusado_com_catalogo_compartilhado_e_pedidos_por_worker(self):
+        catalogo = SharedMemoryCatalog(f"bfshop_teste_{uuid.uuid4().hex[:12]}", capacity=10)
+        try:
+            assert vendas_parciais_por_worker(catalogo, InMemoryStorage())
+            assert not vendas_parciais_por_worker(InMemoryStorage(), InMemoryStorage())
+        finally:
+            catalogo.close()
+            catalogo.unlink()
+
+    def test_cancelamento_retira_vendas_do_produto(self):
+        pedido = Pedido(itens=[ItemCarrinho(3, 2, 50.0)], total=100.0, id=1)
+        vendas = AgregadosDeVendas([pedido])
+
+        pedido.status = StatusPedido.CANCELADO
+        vendas.registrar_mudanca_de_status(pedido, StatusPedido.AGUARDANDO)
+
+        relatorio = vendas.relatorio()
+        assert relatorio["receita_total"] == 0
+        assert relatorio["produtos"] == []
+        assert relatorio["por_status"]["CANCELADO"] == {"pedidos": 1, "receita": 100.0}
+        assert relatorio["por_status"]["AGUARDANDO"] == {"pedidos": 0, "receita": 0.0}
+
+
+class TestCicloDeVidaDoPedido:
+    def test_criar_confirmar_e_cancelar_em_paralelo_conserva_o_estoque(
+        self, produto_service, pedido_service
+    ):
+        estoque_inicial = 300
+        produtos = [
+            produto_service.cadastrar_produto(f"Produto {i}", 10.0 + i, estoque_inicial)
+            for i in range(4)
+        ]
+
+        def operar(semente):
+            # Metade das operações cria pedidos (às vezes recusados por falta de
+            # estoque); a outra metade confirma ou cancela um id sorteado, que pode
+            # já estar cancelado, estar sendo cancelado por outra thread ou nem
+            # existir ainda.
+            sorteio = random.Random(semente)
+            try:
+                if sorteio.random() < 0.5:
+                    pedido_service.criar_pedido([
+                        {"produto_id": p.id, "quantidade": sorteio.randint(1, 3)}
+                        for p in sorteio.sample(produtos, 2)
+                    ])
+                elif sorteio.random() < 0.4:
+                    pedido_service.confirmar_pedido(sorteio.randint(1, semente // 2 + 1))
+                else:
+                    pedido_service.cancelar_pedido(sorteio.randint(1, semente // 2 + 1))
+            except ValueError:
+                pass
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            futures = [executor.submit(operar, i) for i in range(4000)]
+            _, pendentes = concurrent.futures.wait(futures, timeout=60)
+        assert not pendentes, "Operações não terminaram — possível deadlock"
+
+        pedidos = pedido_service.pedido_repo.find_all()
+        status = {p.status for p in pedidos}
+        assert status == set(StatusPedido), f"mistura de operações não exercitou todos os status: {status}"
+        # Conservação: cada unidade está no estoque ou num pedido não cancelado.
+        vendidas = {p.id: 0 for p in produtos}
+        for pedido in pedidos:
+            if pedido.status is not StatusPedido.CANCELADO:
+                for item in pedido.itens:
+                    vendidas[item.produto_id] += item.quantidade
+        for produto in produtos:
+            estoque = produto_service.buscar_produto(produto.id).estoque
+            assert estoque + vendidas[produto.id] == estoque_inicial
+        assert pedido_service.relatorio_de_vendas() == AgregadosDeVendas(pedidos).relatorio()
+
+    def test_cancelamento_logo_apos_a_gravacao_conta_o_pedido_uma_vez(self, produto_service, pedido_service, mocker):
+        # O cancelamento de outra requisição chega assim que o pedido fica
+        # visível, antes de criar_pedido retornar.
+        produto = produto_service.cadastrar_produto("Mouse", 20.0, 10)
+        salvar = pedido_service.pedido_repo.save_many
+
+        def salvar_e_cancelar(pedidos):
+            # O próprio cancelamento grava pelo save_many original.
+            gravacao.stop()
+            salvos = salvar(pedidos)
+            pedido_service.cancelar_pedido(pedidos[0].id)
+            return salvos
+
+        gravacao = mocker.patch.object(pedido_service.pedido_repo, "save_many", side_effect=salvar_e_cancelar)
+        pedido_service.criar_pedido([{"produto_id": produto.id, "quantidade": 1}])
+
+        relatorio = pedido_service.relatorio_de_vendas()
+        assert relatorio == AgregadosDeVendas(pedido_service.pedido_repo.find_all()).relatorio()
+        assert relatorio["receita_total"] == 0
+        assert relatorio["por_status"]["AGUARDANDO"]["pedidos"] == 0
+        assert relatorio["por_status"]["CANCELADO"]["pedidos"] == 1
+
+    def test_cancelamentos_simultaneos_devolvem_o_estoque_uma_vez(self, produto_service, pedido_service):
+        produto = produto_service.cadastrar_produto("Notebook", 3000.0, 10)
+        pedido = pedido_service.criar_pedido([{"produto_id": produto.id, "quantidade": 4}])
+
+        def cancelar(_):
+            try:
+                pedido_service.cancelar_pedido(pedido.id)
+                return True
+            except ValueError:
+                return False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            aceitos = sum(executor.map(cancelar, range(N_THREADS)))
+
+        assert aceitos == 1
+        assert produto_service.buscar_produto(produto.id).estoque == 10
+        assert pedido_service.relatorio_de_vendas()["por_status"]["CANCELADO"]["pedidos"] == 1
+
+
+class TestIdempotencia:
+    def test_repeticoes_simultaneas_esperam_a_original(self, produto_service, produto_repo, pedido_repo):
+        produto = produto_service.cadastrar_produto("Smartphone", 2000.0, 100)
+        # 20ms de latência simulada mantêm a original em andamento enquanto as
+        # demais threads chegam com a mesma chave.
+        pedido_service = PedidoService(produto_repo, pedido_repo, DbLatencySimulator(ConstantLatency(0.02)))
+        cache = IdempotencyCache()
+        corpo = {"itens": [{"produto_id": produto.id, "quantidade": 1}]}
+
+        def repetir(_):
+            return cache.executar("mesma-chave", corpo, lambda: pedido_service.criar_pedido(corpo["itens"]).id)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            resultados = list(executor.map(repetir, range(N_THREADS)))
+
+        assert {id for id, _ in resultados} == {resultados[0][0]}
+        assert sum(not repetido for _, repetido in resultados) == 1
+        assert produto_service.buscar_produto(produto.id).estoque == 99
+        assert len(pedido_service.pedido_repo.find_all()) == 1
+        assert cache.faltas == 1 and cache.acertos == N_THREADS - 1
+        assert cache.esperas >= 1
+
+
+class TestLimiteDeConcorrenciaAdaptativo:
+    def _limitador(self, agora, **kwargs):
+        opcoes = dict(initial_limit=4, latency_target=0.1, max_queue_delay=0.05)
+        opcoes.update(kwargs)
+        return AdaptiveConcurrencyLimiter(clock=lambda: agora[0], **opcoes)
+
+    def test_limite_cresce_quando_usado_com_latencia_boa(self):
+        agora = [0.0]
+        limitador = self._limitador(agora)
+        for _ in range(20):
+            admissoes = [limitador.acquire() for _ in range(limitador.limit)]
+            agora[0] += 0.01
+            for admitida_em in admissoes:
+                limitador.release(admitida_em)
+        assert limitador.limit > 4
+
+    def test_limite_nao_cresce_com_pouca_carga(self):
+        agora = [0.0]
+        limitador = self._limitador(agora)
+        for _ in range(100):
+            admitida_em = limitador.acquire()
+            agora[0] += 0.01
+            limitador.release(admitida_em)
+        assert limitador.limit == 4
+
+    def test_latencia_acima_do_alvo_reduz_o_limite_uma_vez_por_janela(self):
+        agora = [0.0]
+        limitador = self._limitador(agora, initial_limit=40)
+        admissoes = [limitador.acquire() for _ in range(10)]
+        agora[0] += 0.5
+        for admitida_em in admissoes:
+            limitador.release(admitida_em)
+        # 10 respostas lentas da mesma leva: uma redução só.
+        assert limitador.limit == 36
+        admitida_em = limitador.acquire()
+        agora[0] += 0.5
+        limitador.release(admitida_em)
+        assert limitador.limit == 32
+
+    def test_fila_cheia_recusa_na_hora_com_retry_after(self):
+        agora = [0.0]
+        limitador = self._limitador(agora, initial_limit=1, max_queue_delay=0.0)
+        limitador.acquire()
+        with pytest.raises(Sobrecarga) as erro:
+            limitador.acquire()
+        assert erro.value.retry_after >= 1
+        assert limitador.estatisticas()["recusadas"] == 1
+
+    def test_requisicao_na_fila_e_admitida_quando_uma_vaga_abre(self):
+        limitador = AdaptiveConcurrencyLimiter(initial_limit=1, latency_target=1.0, max_queue_delay=5.0)
+        admitida_em = limitador.acquire()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            na_fila = executor.submit(limitador.acquire)
+            while limitador.estatisticas()["na_fila"] == 0:
+                pass
+            limitador.release(admitida_em)
+            na_fila.result(timeout=5)
+        assert limitador.in_flight == 1
+
+    def test_espera_alem_do_prazo_e_recusada(self):
+        limitador = AdaptiveConcurrencyLimiter(initial_limit=1, latency_target=1.0, max_queue_delay=0.02)
+        limitador.acquire()
+        with pytest.raises(Sobrecarga):
+            limitador.acquire()
+        assert limitador.estatisticas()["na_fila"] == 0
+        assert limitador.in_flight == 1
+
+
+class TestFilasPorPrioridade:
+    CLASSES = (
+        TrafficClass("checkout", priority=1),
+        TrafficClass("catalogo", share=0.5, max_queue=2),
+    )
+
+    def _limitador(self, **kwargs):
+        opcoes = dict(initial_limit=4, latency_target=10.0, max_queue_delay=5.0, classes=self.CLASSES)
+        opcoes.update(kwargs)
+        return AdaptiveConcurrencyLimiter(**opcoes)
+
+    def _esperar_fila(self, limitador, classe, tamanho):
+        while limitador.estatisticas()["classes"][classe]["na_fila"] < tamanho:
+            pass
+
+    def test_catalogo_nao_ocupa_mais_que_a_sua_fatia(self):
+        limitador = self._limitador(max_queue_delay=0.0)
+        limitador.acquire("catalogo")
+        limitador.acquire("catalogo")
+        with pytest.raises(Sobrecarga):
+            limitador.acquire("catalogo")
+        # As vagas restantes continuam livres para o checkout.
+        limitador.acquire("checkout")
+        limitador.acquire("checkout")
+        assert limitador.in_flight == 4
+
+    def test_fila_do_catalogo_e_limitada(self):
+        limitador = self._limitador()
+        ocupadas = [limitador.acquire("catalogo") for _ in range(2)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            na_fila = [executor.submit(limitador.acquire, "catalogo") for _ in range(2)]
+            self._esperar_fila(limitador, "catalogo", 2)
+            with pytest.raises(Sobrecarga):
+                limitador.acquire("catalogo")
+            for admitida_em in ocupadas:
+                limitador.release(admitida_em, "catalogo")
+            for futuro in na_fila:
+                futuro.result(timeout=5)
+        assert limitador.estatisticas()["classes"]["catalogo"]["recusadas"] == 1
+
+    def test_vaga_liberada_vai_primeiro_para_o_checkout(self):
+        limitador = self._limitador(initial_limit=2, classes=(
+            TrafficClass("checkout", priority=1),
+            TrafficClass("catalogo"),
+        ))
+        ocupadas = [limitador.acquire("catalogo"), limitador.acquire("catalogo")]
+        ordem = []
+
+        def esperar(classe):
+            limitador.acquire(classe)
+            ordem.append(classe)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            # O catálogo chegou antes, mas o checkout tem prioridade.
+            catalogo = executor.submit(esperar, "catalogo")
+            self._esperar_fila(limitador, "catalogo", 1)
+            checkout = executor.submit(esperar, "checkout")
+            self._esperar_fila(limitador, "checkout", 1)
+
+            limitador.release(ocupadas[0], "catalogo")
+            checkout.result(timeout=5)
+            assert ordem == ["checkout"]
+            limitador.release(ocupadas[1], "catalogo")
+            catalogo.result(timeout=5)
+        assert ordem == ["checkout", "catalogo"]
+
+
+@pytest.fixture
+def trocas_de_thread_frequentes():
+    # Troca de thread a cada 1µs em vez de 5ms: aumenta muito a chance de uma
+    # thread ser interrompida entre a leitura e a gravação de um contador.
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(intervalo)
+
+
+@pytest.mark.usefixtures("trocas_de_thread_frequentes")
+class TestAlocacaoDeIds:
+    def test_100k_pedidos_concorrentes_recebem_ids_unicos(self, pedido_repo):
+        n_saves = 100_000
+        por_thread = n_saves // N_THREADS
+
+        def gravar(_):
+            return [
+                pedido_repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0)).id
+                for _ in range(por_thread)
+            ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            ids = [id for lote in executor.map(gravar, range(N_THREADS)) for id in lote]
+
+        assert len(ids) == por_thread * N_THREADS
+        assert len(set(ids)) == len(ids), f"{len(ids) - len(set(ids))} ids repetidos"
+        # Sem buracos: cada id foi entregue exatamente uma vez, de 1 a N.
+        assert sorted(ids) == list(range(1, len(ids) + 1))
+        assert len(pedido_repo.find_all()) == len(ids)
+
+    def test_cadastros_concorrentes_de_produtos_recebem_ids_unicos(self, produto_repo):
+        def cadastrar(i):
+            return produto_repo.save(Produto(nome=f"Produto {i}", preco=10.0, estoque=1)).id
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            ids = list(executor.map(cadastrar, range(10_000)))
+
+        assert sorted(ids) == list(range(1, 10_001))
+        assert len(produto_repo.find_all()) == 10_000
+
+
+@pytest.mark.usefixtures("trocas_de_thread_frequentes")
+class TestMetricas:
+    def test_histograma_nao_perde_amostras_concorrentes(self):
+        histograma = LatencyHistogram()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            list(executor.map(lambda _: [histograma.registrar(0.001) for _ in range(1000)], range(N_THREADS)))
+        assert histograma.contagem == N_THREADS * 1000
+        assert histograma.soma == pytest.approx(N_THREADS * 1000 * 0.001)
+
+    def test_contadores_do_lock_do_storage_sao_exatos(self):
+        storage = InMemoryStorage()
+        storage.add(1, "item")
+
+        def ler(_):
+            for _ in range(1000):
+                storage.get(1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+            list(executor.map(ler, range(N_THREADS)))
+        lock = storage.estatisticas_de_lock()
+        assert lock["aquisicoes"] == N_THREADS * 1000 + 1
+        assert lock["esperas"] <= lock["aquisicoes"]
+
+    def test_espera_pelo_lock_ocupado_e_medida(self):
+        storage = InMemoryStorage()
+        leitura = threading.Thread(target=storage.get, args=(1,))
+        with storage._lock:
+            leitura.start()
+            time.sleep(0.05)
+        leitura.join()
+        lock = storage.estatisticas_de_lock()
+        assert lock["esperas"] == 1
+        assert lock["tempo_de_espera_s"] >= 0.04
+
+
+def _comprar_em_outro_processo(caminho: str, produto_id: int, tentativas: int, fila) -> None:
+    produto_repo = ProdutoRepository(SQLiteStorage(caminho, "produtos"))
+    pedido_service = PedidoService(produto_repo, PedidoRepository(SQLiteStorage(caminho, "pedidos")))
+    itens = [{"produto_id": produto_id, "quantidade": 1}]
+    fila.put(sum(_tentar_pedido(pedido_service, itens) for _ in range(tentativas)))
+
+
+def _comprar_no_catalogo_compartilhado(nome: str, produto_id: int, tentativas: int, fila) -> None:
+    catalogo = SharedMemoryCatalog(nome)
+    pedido_service = PedidoService(ProdutoRepository(catalogo), PedidoRepository(InMemoryStorage()))
+    itens = [{"produto_id": produto_id, "quantidade": 1}]
+    fila.put(sum(_tentar_pedido(pedido_service, itens) for _ in range(tentativas)))
+    catalogo.close()
+
+
+def _semear_em_outro_processo(caminho: str, fila) -> None:
+    semear_catalogo(ProdutoService(ProdutoRepository(SQLiteStorage(caminho, "produtos"))))
+    fila.put(0)
+
+
+def _semear_no_catalogo_compartilhado(nome: str, fila) -> None:
+    catalogo = SharedMemoryCatalog(nome)
+    semear_catalogo(ProdutoService(ProdutoRepository(catalogo)))
+    catalogo.close()
+    fila.put(0)
+
+
+def _requisicoes_em_outro_worker(caminho: str, tentativas: int, fila) -> None:
+    limiter = SlidingWindowCounterRateLimiter(MappedSlidingWindowStorage(f"bfmmap://{caminho}"))
+    limite = parse("100/minute")
+    fila.put(sum(limiter.hit(limite, "10.0.0.1", "criar_pedido") for _ in range(tentativas)))
+
+
+def _disputar_em_processos(alvo, args, n_processos: int = 4) -> int:
+    contexto = multiprocessing.get_context("fork")
+    fila = contexto.Queue()
+    processos = [contexto.Process(target=alvo, args=args + (fila,)) for _ in range(n_processos)]
+    for p in processos:
+        p.start()
+    vendidos = sum(fila.get(timeout=60) for _ in processos)
+    for p in processos:
+        p.join(timeout=10)
+    return vendidos
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requer multiprocessing com fork",
+)
+class TestReservaDeEstoqueEntreProcessos:
+    def test_workers_no_mesmo_sqlite_nao_vendem_alem_do_estoque(self, tmp_path):
+        # Simula 4 workers do gunicorn compartilhando o mesmo arquivo SQLite: o
+        # lock de item precisa valer entre processos, não só entre threads.
+        caminho = str(tmp_path / "bfshop.db")
+        produto = ProdutoService(ProdutoRepository(SQLiteStorage(caminho, "produtos"))).cadastrar_produto(
+            "Console Black Friday", 4000.0, 100
+        )
+
+        vendidos = _disputar_em_processos(_comprar_em_outro_processo, (caminho, produto.id, 60))
+
+        assert vendidos == 100, f"{vendidos} pedidos aceitos para 100 unidades em estoque"
+        assert SQLiteStorage(caminho, "produtos").get(produto.id).estoque == 0
+        # Pedidos gravados no mesmo arquivo pelos 4 workers: cada um com o seu id,
+        # nenhum sobrescrito por outro worker.
+        pedidos = SQLiteStorage(caminho, "pedidos").get_all()
+        assert len(pedidos) == 100
+        assert len({p.id for p in pedidos}) == 100
+
+    def test_workers_subindo_juntos_semeiam_o_catalogo_uma_vez(self, tmp_path):
+        caminho = str(tmp_path / "bfshop.db")
+
+        _disputar_em_processos(_semear_em_outro_processo, (caminho,))
+
+        produtos = SQLiteStorage(caminho, "produtos").get_all()
+        assert [p.id for p in produtos] == list(range(1, 51))
+
+    def test_workers_subindo_juntos_semeiam_o_catalogo_compartilhado_uma_vez(self):
+        catalogo = SharedMemoryCatalog(f"bfshop_teste_{uuid.uuid4().hex[:12]}", capacity=100)
+        try:
+            _disputar_em_processos(_semear_no_catalogo_compartilhado, (catalogo.name,))
+
+            assert [p.id for p in catalogo.get_all()] == list(range(1, 51))
+        finally:
+            catalogo.close()
+            catalogo.unlink()
+
+    def test_workers_no_catalogo_compartilhado_nao_vendem_alem_do_estoque(self):
+        # Mesmo cenário com o estoque em memória compartilhada: a baixa é feita
+        # diretamente no bloco, sob o lock de item entre processos.
+        catalogo = SharedMemoryCatalog(f"bfshop_teste_{uuid.uuid4().hex[:12]}", capacity=100)
+        try:
+            produto = ProdutoService(ProdutoRepository(catalogo)).cadastrar_produto(
+                "Console Black Friday", 4000.0, 100
+            )
+
+            vendidos = _disputar_em_processos(_comprar_no_catalogo_compartilhado, (catalogo.name, produto.id, 60))
+
+            assert vendidos == 100, f"{vendidos} pedidos aceitos para 100 unidades em estoque"
+            assert catalogo.get(produto.id).estoque == 0
+        finally:
+            catalogo.close()
+            catalogo.unlink()
+
+    def test_workers_no_mesmo_arquivo_de_limites_dividem_o_limite(self, tmp_path):
+        # 4 workers recebendo requisições do mesmo IP: juntos aceitam 100 por
+        # minuto, e não 100 cada um como com memory://.
+        caminho = str(tmp_path / "limites.bin")
+        MappedSlidingWindowStorage(f"bfmmap://{caminho}").close()
+
+        aceitas = _disputar_em_processos(_requisicoes_em_outro_worker, (caminho, 60))
+
+        assert aceitas == 100, f"{aceitas} requisições aceitas para um limite de 100/min"
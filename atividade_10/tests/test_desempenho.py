@@ -5,7 +5,27 @@ Meta: P95 (aproximado pela média) < 500ms por operação na camada de serviço.
 Os testes operam diretamente sobre a camada de serviço (sem HTTP) para eliminar
 ruído de rede e medir com precisão o comportamento algorítmico.
 """
+import concurrent.futures
+import itertools
+import statistics
+import time
+import tracemalloc
 import pytest
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from api_comum import json_compacto, json_em_partes, produto_para_dict
+from indexes import corresponde
+from journal import OrderJournal
+from limiter_storage import MappedSlidingWindowStorage
+from metrics import LatencyHistogram, medir
+from relatorios import AgregadosDeVendas
+from models import ItemCarrinho, Pedido, StatusPedido, TabelaDeItens
+from storage import InMemoryStorage, SQLiteStorage
+from repository import ProdutoRepository, PedidoRepository
+from service import ProdutoService, PedidoService
+from latency import DbLatencySimulator, HistogramLatency, LogNormalLatency
 
 
 class TestDesempenhoListarProdutos:
@@ -41,11 +61,13 @@ class TestDesempenhoBuscarProduto:
 
 class TestDesempenhoCriarPedido:
     # min_rounds=50 (menor que os outros 100): criar_pedido modifica estado
-    # (decrementa estoque em cada rodada), então um número alto esgotaria o estoque
-    # do produto_populado (100 unidades) antes de completar as medições.
+    # (decrementa estoque em cada rodada). O pytest-benchmark ainda repete a função
+    # até completar seu tempo mínimo de medição — em geral centenas de rodadas —,
+    # então o produto usa estoque próprio, bem acima das 100 unidades do produto_populado.
     @pytest.mark.benchmark(min_rounds=50)
-    def test_p95_criar_pedido(self, benchmark, pedido_service, produto_populado):
-        itens = [{"produto_id": produto_populado.id, "quantidade": 1}]
+    def test_p95_criar_pedido(self, benchmark, pedido_service, produto_service):
+        produto = produto_service.cadastrar_produto("Smart TV 4K", 3500.00, 1_000_000)
+        itens = [{"produto_id": produto.id, "quantidade": 1}]
         benchmark(pedido_service.criar_pedido, itens)
         assert benchmark.stats["mean"] < 0.5, (
             f"Média {benchmark.stats['mean']*1000:.2f}ms excede SLA de 500ms"
@@ -59,3 +81,542 @@ class TestDesempenhoCadastrarProduto:
         assert benchmark.stats["mean"] < 0.5, (
             f"Média {benchmark.stats['mean']*1000:.2f}ms excede SLA de 500ms"
         )
+
+
+class TestDesempenhoSnapshotListagem:
+    @pytest.mark.benchmark(min_rounds=100)
+    def test_get_all_nao_cresce_com_tamanho_do_catalogo(self, benchmark, storage):
+        # Com 100 mil itens, uma cópia da lista a cada chamada custaria centenas de
+        # microssegundos; o snapshot publicado deve ser devolvido sem cópia alguma.
+        for i in range(100_000):
+            storage.add(i, i)
+        storage.get_all()
+
+        benchmark(storage.get_all)
+        assert benchmark.stats["mean"] < 0.00005, (
+            f"Média {benchmark.stats['mean']*1e6:.1f}µs indica cópia do catálogo a cada leitura"
+        )
+
+    def test_snapshot_reutilizado_ate_a_proxima_escrita(self, storage):
+        storage.add(1, "a")
+        primeiro = storage.get_all()
+        assert storage.get_all() is primeiro
+
+        storage.add(2, "b")
+        segundo = storage.get_all()
+        assert segundo is not primeiro
+        assert segundo == ("a", "b")
+        # O snapshot antigo é imutável: quem já o obteve não vê a escrita posterior.
+        assert primeiro == ("a",)
+
+        storage.delete(1)
+        assert storage.get_all() == ("b",)
+
+    def test_regravar_mesmo_objeto_preserva_snapshot_e_avanca_versao(
+        self, produto_service, produto_populado
+    ):
+        repo = produto_service.repository
+        snapshot = repo.find_all()
+        versao = repo.storage.version
+
+        produto_service.atualizar_estoque(produto_populado.id, 1)
+
+        assert repo.find_all() is snapshot
+        assert repo.storage.version > versao
+        assert snapshot[0].estoque == 99
+
+
+class TestDesempenhoMetricas:
+    @pytest.mark.benchmark(min_rounds=10_000)
+    def test_registrar_latencia_custa_microssegundos(self, benchmark):
+        histograma = LatencyHistogram()
+        benchmark(histograma.registrar, 0.0123)
+        # Menos de 1% da latência simulada de banco (1ms) de cada operação.
+        assert benchmark.stats["mean"] < 10e-6
+
+    def test_medir_acrescenta_pouco_a_uma_chamada(self):
+        def operacao():
+            return None
+
+        medida = medir(operacao)
+        tempos = {}
+        for nome, funcao in (("direta", operacao), ("medida", medida)):
+            inicio = time.perf_counter()
+            for _ in range(20_000):
+                funcao()
+            tempos[nome] = (time.perf_counter() - inicio) / 20_000
+        assert tempos["medida"] - tempos["direta"] < 10e-6, tempos
+
+
+class TestDesempenhoPedidosEmLote:
+    # Mesmo volume de pedidos nos dois testes; o grupo coloca os dois lado a lado
+    # na tabela do pytest-benchmark para comparar o custo por lote.
+    N_PEDIDOS = 50
+
+    @pytest.fixture
+    def pedidos(self, produto_service):
+        produto = produto_service.cadastrar_produto("Smart TV 4K", 3500.00, 10_000_000)
+        return [[{"produto_id": produto.id, "quantidade": 1}]] * self.N_PEDIDOS
+
+    @pytest.mark.benchmark(group="pedidos-em-lote", min_rounds=20)
+    def test_criar_pedidos_individualmente(self, benchmark, pedido_service, pedidos):
+        def individualmente():
+            for itens in pedidos:
+                pedido_service.criar_pedido(itens)
+
+        benchmark(individualmente)
+
+    @pytest.mark.benchmark(group="pedidos-em-lote", min_rounds=20)
+    def test_criar_pedidos_em_lote(self, benchmark, pedido_service, pedidos):
+        resultados = benchmark(pedido_service.criar_pedidos_em_lote, pedidos)
+        assert all(not isinstance(r, ValueError) for r in resultados)
+        # O lote paga uma única latência de transação, então deve custar menos
+        # que a soma das latências dos pedidos individuais.
+        assert benchmark.stats["mean"] < self.N_PEDIDOS * 0.001, (
+            f"Média {benchmark.stats['mean']*1000:.2f}ms por lote de {self.N_PEDIDOS} "
+            f"não é menor que {self.N_PEDIDOS} transações individuais"
+        )
+
+
+class TestDesempenhoBuscaDeVariosProdutos:
+    N_IDS = 20
+
+    @pytest.fixture
+    def ids(self, produto_service):
+        return [
+            produto_service.cadastrar_produto(f"Produto BF {i:02d}", 10.0 * (i + 1), 100).id
+            for i in range(self.N_IDS)
+        ]
+
+    @pytest.mark.benchmark(group="busca-varios-produtos", min_rounds=20)
+    def test_buscar_produtos_um_a_um(self, benchmark, produto_service, ids):
+        benchmark(lambda: [produto_service.buscar_produto(id) for id in ids])
+
+    @pytest.mark.benchmark(group="busca-varios-produtos", min_rounds=100)
+    def test_buscar_produtos_em_uma_passada(self, benchmark, produto_service, ids):
+        produtos = benchmark(produto_service.buscar_produtos, ids)
+        assert [p.id for p in produtos] == ids
+        assert benchmark.stats["mean"] < self.N_IDS * 0.001, (
+            f"Média {benchmark.stats['mean']*1000:.2f}ms não é menor que {self.N_IDS} buscas individuais"
+        )
+
+
+@pytest.fixture(scope="module")
+def catalogo_100k():
+    # Escopo de módulo: montar 100 mil produtos uma única vez. Os testes que o
+    # usam só leem o catálogo.
+    produto_service = ProdutoService(ProdutoRepository(InMemoryStorage()))
+    for i in range(100_000):
+        produto_service.cadastrar_produto(f"Produto {i:06d}", 10.0 + i % 500, 100)
+    return produto_service
+
+
+class TestDesempenhoPaginacao:
+    @pytest.mark.benchmark(min_rounds=100)
+    def test_p95_pagina_no_meio_de_100k_produtos(self, benchmark, catalogo_100k):
+        produtos, proximo = benchmark(catalogo_100k.listar_produtos_paginado, 100, 50_000)
+        assert [p.id for p in produtos] == list(range(50_001, 50_101))
+        assert proximo == 50_100
+        # A página custa O(log n + limite): fica na ordem da latência simulada de
+        # 1ms, muito longe dos 500ms, mesmo com 100 mil produtos.
+        assert benchmark.stats["mean"] < 0.005, (
+            f"Média {benchmark.stats['mean']*1000:.2f}ms para uma página de 100 itens em 100k produtos"
+        )
+
+    def test_tempo_da_pagina_nao_cresce_com_o_catalogo(self, catalogo_100k, produto_service):
+        for i in range(1000):
+            produto_service.cadastrar_produto(f"Produto {i:06d}", 10.0 + i % 500, 100)
+
+        def tempo_medio(service, cursor):
+            inicio = time.perf_counter()
+            for _ in range(200):
+                service.repository.find_page(cursor, 100)
+            return (time.perf_counter() - inicio) / 200
+
+        pequeno = tempo_medio(produto_service, 500)
+        grande = tempo_medio(catalogo_100k, 50_000)
+        assert grande < pequeno * 3, (
+            f"Página em 100k produtos ({grande*1e6:.1f}µs) muito mais lenta que em 1k ({pequeno*1e6:.1f}µs)"
+        )
+
+
+@pytest.fixture(scope="module")
+def pedidos_100k():
+    # 100 mil pedidos, 1% confirmados: consulta seletiva, como a de um painel
+    # que lista só os pedidos de um status.
+    repo = PedidoRepository(InMemoryStorage())
+    for i in range(100_000):
+        status = StatusPedido.CONFIRMADO if i % 100 == 0 else StatusPedido.AGUARDANDO
+        repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0, status=status))
+    return repo
+
+
+class TestDesempenhoIndicesSecundarios:
+    # Cada grupo compara a consulta pelo índice com a varredura de find_all que
+    # ela substitui, sobre os mesmos 100 mil registros.
+    @staticmethod
+    def _por_preco_varrendo(repo, minimo, maximo):
+        return sorted((p for p in repo.find_all() if minimo <= p.preco <= maximo), key=lambda p: (p.preco, p.id))
+
+    @staticmethod
+    def _por_nome_varrendo(repo, termo):
+        return [p for p in repo.find_all() if corresponde(termo, p.nome)]
+
+    @staticmethod
+    def _por_status_varrendo(repo, status):
+        return [p for p in repo.find_all() if p.status == status]
+
+    @pytest.mark.benchmark(group="indice-preco")
+    @pytest.mark.parametrize("modo", ["indice", "varredura"])
+    def test_faixa_de_preco(self, benchmark, catalogo_100k, modo):
+        repo = catalogo_100k.repository
+        consulta = repo.find_by_price_range if modo == "indice" else (
+            lambda minimo, maximo: self._por_preco_varrendo(repo, minimo, maximo)
+        )
+        produtos = benchmark(consulta, 100.0, 101.0)
+        # Preços 10.0 + i % 500: 200 produtos em cada preço inteiro da faixa.
+        assert len(produtos) == 400
+
+    @pytest.mark.benchmark(group="indice-nome")
+    @pytest.mark.parametrize("modo", ["indice", "varredura"])
+    def test_busca_por_nome(self, benchmark, catalogo_100k, modo):
+        repo = catalogo_100k.repository
+        consulta = repo.search_by_name if modo == "indice" else (
+            lambda termo: self._por_nome_varrendo(repo, termo)
+        )
+        produtos = benchmark.pedantic(consulta, args=("0123",), rounds=5 if modo == "varredura" else 100)
+        assert [p.nome for p in produtos] == [f"Produto {i:06d}" for i in range(12_300, 12_400)]
+
+    @pytest.mark.benchmark(group="indice-status")
+    @pytest.mark.parametrize("modo", ["indice", "varredura"])
+    def test_pedidos_por_status(self, benchmark, pedidos_100k, modo):
+        consulta = pedidos_100k.find_by_status if modo == "indice" else (
+            lambda status: self._por_status_varrendo(pedidos_100k, status)
+        )
+        assert len(benchmark(consulta, StatusPedido.CONFIRMADO)) == 1000
+
+    def test_pagina_de_pedidos_por_status_nao_percorre_o_status_inteiro(self, pedidos_100k):
+        # 99 mil pedidos AGUARDANDO: a página de 100 sai da lista de ids já
+        # ordenada do índice, sem ordenar nem montar os demais.
+        def tempo(**kwargs):
+            inicio = time.perf_counter()
+            pedidos = pedidos_100k.find_by_status(StatusPedido.AGUARDANDO, **kwargs)
+            return time.perf_counter() - inicio, pedidos
+
+        pagina, pedidos = min(tempo(after_id=50_000, limit=100) for _ in range(5))
+        completo, _ = tempo()
+        assert [p.id for p in pedidos][:2] == [50_002, 50_003]
+        assert pagina * 50 < completo, (
+            f"Página de 100 ({pagina*1e3:.3f}ms) não é 50x mais rápida que o status inteiro ({completo*1e3:.2f}ms)"
+        )
+
+    def test_indices_superam_a_varredura(self, catalogo_100k, pedidos_100k):
+        repo = catalogo_100k.repository
+
+        def tempo(funcao, *args):
+            inicio = time.perf_counter()
+            funcao(*args)
+            return time.perf_counter() - inicio
+
+        comparacoes = {
+            "preco": (tempo(repo.find_by_price_range, 100.0, 101.0),
+                      tempo(self._por_preco_varrendo, repo, 100.0, 101.0)),
+            "nome": (tempo(repo.search_by_name, "0123"), tempo(self._por_nome_varrendo, repo, "0123")),
+            "status": (tempo(pedidos_100k.find_by_status, StatusPedido.CONFIRMADO),
+                       tempo(self._por_status_varrendo, pedidos_100k, StatusPedido.CONFIRMADO)),
+        }
+        for nome, (indice, varredura) in comparacoes.items():
+            assert indice * 5 < varredura, (
+                f"Índice de {nome} ({indice*1e3:.2f}ms) não é 5x mais rápido que a varredura ({varredura*1e3:.2f}ms)"
+            )
+
+
+class TestDesempenhoRelatorioDeVendas:
+    # Relatório a partir dos agregados incrementais contra recalculá-lo varrendo
+    # todos os pedidos, com 100 mil pedidos gravados.
+    @pytest.mark.benchmark(group="relatorio-vendas")
+    @pytest.mark.parametrize("modo", ["agregados", "varredura"])
+    def test_relatorio_com_100k_pedidos(self, benchmark, pedidos_100k, modo):
+        vendas = AgregadosDeVendas(pedidos_100k.find_all())
+
+        def relatorio():
+            if modo == "agregados":
+                return vendas.relatorio()
+            return AgregadosDeVendas(pedidos_100k.find_all()).relatorio()
+
+        resultado = benchmark.pedantic(relatorio, rounds=5 if modo == "varredura" else 100)
+        assert resultado["por_status"]["CONFIRMADO"]["pedidos"] == 1000
+        if modo == "agregados":
+            # Custo proporcional aos produtos vendidos (um, aqui), não aos pedidos.
+            assert benchmark.stats["mean"] < 0.001
+
+
+def _percentis(duracoes: list) -> dict:
+    # quantiles(n=100) devolve os 99 pontos de corte P1..P99.
+    cortes = statistics.quantiles(duracoes, n=100)
+    return {"p50": cortes[49], "p95": cortes[94], "p99": cortes[98]}
+
+
+def _medir_duracoes(funcao, n: int) -> list:
+    duracoes = []
+    for _ in range(n):
+        inicio = time.perf_counter()
+        funcao()
+        duracoes.append(time.perf_counter() - inicio)
+    return duracoes
+
+
+class TestDesempenhoLatenciaRealista:
+    # Mediana de 1ms (a mesma latência do modelo constante), mas com cauda longa:
+    # sigma=0.8 leva o P99 da latência sorteada a ~6ms.
+    N_CHAMADAS = 400
+
+    @pytest.fixture
+    def latencia_lognormal(self):
+        return DbLatencySimulator(LogNormalLatency(median=0.001, sigma=0.8, seed=42))
+
+    def test_p95_p99_buscar_produto_com_latencia_lognormal(self, latencia_lognormal):
+        produto_service = ProdutoService(ProdutoRepository(InMemoryStorage()), latencia_lognormal)
+        produto = produto_service.cadastrar_produto("Smart TV 4K", 3500.00, 100)
+
+        p = _percentis(_medir_duracoes(lambda: produto_service.buscar_produto(produto.id), self.N_CHAMADAS))
+
+        # A cauda aparece no P99 (bem acima da mediana), mas segue longe do SLA.
+        assert p["p99"] > p["p50"] * 2, f"Cauda não reproduzida: P50={p['p50']*1000:.2f}ms P99={p['p99']*1000:.2f}ms"
+        assert p["p95"] < 0.5 and p["p99"] < 0.5, (
+            f"P95={p['p95']*1000:.2f}ms / P99={p['p99']*1000:.2f}ms excedem SLA de 500ms"
+        )
+
+    def test_p95_p99_criar_pedido_com_latencia_lognormal(self, latencia_lognormal):
+        produto_repo = ProdutoRepository(InMemoryStorage())
+        produto = ProdutoService(produto_repo).cadastrar_produto("Smart TV 4K", 3500.00, 1_000_000)
+        pedido_service = PedidoService(produto_repo, PedidoRepository(InMemoryStorage()), latencia_lognormal)
+        itens = [{"produto_id": produto.id, "quantidade": 1}]
+
+        p = _percentis(_medir_duracoes(lambda: pedido_service.criar_pedido(itens), self.N_CHAMADAS))
+
+        assert p["p95"] < 0.5 and p["p99"] < 0.5, (
+            f"P95={p['p95']*1000:.2f}ms / P99={p['p99']*1000:.2f}ms excedem SLA de 500ms"
+        )
+
+    def test_histograma_gravado_e_reproduzido(self):
+        # 90% das consultas em 1ms, 9% em 5ms e 1% em 20ms: a reprodução deve
+        # devolver só esses valores, nas mesmas proporções aproximadas.
+        modelo = HistogramLatency([(0.001, 90), (0.005, 9), (0.020, 1)], seed=7)
+        amostras = [modelo.sample() for _ in range(20_000)]
+
+        assert set(amostras) == {0.001, 0.005, 0.020}
+        assert abs(amostras.count(0.001) / len(amostras) - 0.90) < 0.02
+        assert _percentis(amostras)["p99"] in (0.005, 0.020)
+
+
+class TestDesempenhoMotoresDeStorage:
+    # Mesmas operações nos dois motores, agrupadas para comparação lado a lado.
+    # O SQLite paga serialização e uma transação por escrita em troca de
+    # durabilidade e de compartilhar o catálogo entre processos.
+    @pytest.fixture(params=["memoria", "sqlite"])
+    def produto_service_por_motor(self, request, tmp_path):
+        if request.param == "memoria":
+            storage = InMemoryStorage()
+        else:
+            storage = SQLiteStorage(str(tmp_path / "bfshop.db"), "produtos")
+        produto_service = ProdutoService(ProdutoRepository(storage))
+        for i in range(50):
+            produto_service.cadastrar_produto(f"Produto BF {i:02d}", 10.0 * (i + 1), 1_000_000)
+        yield produto_service
+        if request.param == "sqlite":
+            storage.close()
+
+    @pytest.mark.benchmark(group="motor-storage-leitura", min_rounds=100)
+    def test_p95_buscar_produto_por_motor(self, benchmark, produto_service_por_motor):
+        benchmark(produto_service_por_motor.buscar_produto, 25)
+        assert benchmark.stats["mean"] < 0.5
+
+    @pytest.mark.benchmark(group="motor-storage-escrita", min_rounds=100)
+    def test_p95_atualizar_estoque_por_motor(self, benchmark, produto_service_por_motor):
+        benchmark(produto_service_por_motor.atualizar_estoque, 25, 1)
+        assert benchmark.stats["mean"] < 0.5
+
+
+class TestDesempenhoJournalDePedidos:
+    # Pedidos/s gravados no journal por 16 threads para diferentes janelas de group
+    # commit. max_batch=1 é a referência sem agrupamento: um fsync por pedido.
+    # A melhor janela depende do custo do fsync: em disco rápido (ou tmpfs) a
+    # espera da janela domina; em disco com fsync de milissegundos, o agrupamento.
+    N_THREADS = 16
+    PEDIDOS_POR_THREAD = 25
+
+    @pytest.fixture(params=[(0.0, 1), (0.0, 256), (0.001, 256), (0.005, 256)],
+                    ids=["fsync-por-pedido", "janela-0ms", "janela-1ms", "janela-5ms"])
+    def pedido_repo_com_journal(self, request, tmp_path):
+        janela, max_batch = request.param
+        journal = OrderJournal(str(tmp_path / "pedidos.log"), batch_window=janela, max_batch=max_batch)
+        yield PedidoRepository(InMemoryStorage(), journal=journal)
+        journal.close()
+
+    def _gravar_concorrentemente(self, pedido_repo):
+        def gravar(_):
+            for _ in range(self.PEDIDOS_POR_THREAD):
+                pedido_repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.N_THREADS) as executor:
+            list(executor.map(gravar, range(self.N_THREADS)))
+
+    @pytest.mark.benchmark(group="journal-pedidos")
+    def test_pedidos_por_segundo_por_janela(self, benchmark, pedido_repo_com_journal):
+        journal = pedido_repo_com_journal.journal
+        benchmark.pedantic(self._gravar_concorrentemente, args=(pedido_repo_com_journal,), rounds=3)
+
+        n_pedidos = 3 * self.N_THREADS * self.PEDIDOS_POR_THREAD
+        benchmark.extra_info["pedidos_por_segundo"] = round(
+            self.N_THREADS * self.PEDIDOS_POR_THREAD / benchmark.stats["mean"]
+        )
+        benchmark.extra_info["pedidos_por_fsync"] = round(n_pedidos / journal.lotes_gravados, 1)
+        assert len(pedido_repo_com_journal.find_all()) == n_pedidos
+        if journal.max_batch > 1 and journal.batch_window > 0:
+            # Com janela, pedidos concorrentes dividem o mesmo fsync.
+            assert journal.lotes_gravados < n_pedidos / 4, (
+                f"{journal.lotes_gravados} fsyncs para {n_pedidos} pedidos"
+            )
+
+
+def _bytes_por_pedido(montar, n: int) -> float:
+    # Memória ainda alocada depois de montar n pedidos, dividida por n. Os
+    # pedidos ficam vivos até a medição terminar.
+    tracemalloc.start()
+    try:
+        pedidos = montar(n)
+        atual, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(pedidos) == n
+    return atual / n
+
+
+# Dois itens por pedido; as listas de itens são montadas uma vez e reaproveitadas
+# porque, no serviço, os ItemCarrinho montados são temporários.
+_ITENS_POR_PRODUTO = [[ItemCarrinho(i, 1, 12.5), ItemCarrinho(7, 2, 99.9)] for i in range(50)]
+
+
+def _pedidos_colunares(n: int) -> list:
+    tabela = TabelaDeItens()
+    return [
+        Pedido(itens=tabela.adicionar(_ITENS_POR_PRODUTO[i % 50]), total=212.3 + i, id=i + 1000)
+        for i in range(n)
+    ]
+
+
+def _pedidos_com_lista_de_itens(n: int) -> list:
+    return [
+        Pedido(itens=[ItemCarrinho(i % 50, 1, 12.5), ItemCarrinho(7, 2, 99.9)], total=212.3 + i, id=i + 1000)
+        for i in range(n)
+    ]
+
+
+class TestDesempenhoMemoriaDosPedidos:
+    # Bytes por pedido guardado em memória, medidos com tracemalloc. Só o modelo
+    # (Pedido e seus itens), sem o dict e os índices do storage.
+    N_PEDIDOS = 1_000_000
+
+    @pytest.mark.lento
+    def test_bytes_por_pedido_com_1m_pedidos(self, record_property):
+        bytes_por_pedido = _bytes_por_pedido(_pedidos_colunares, self.N_PEDIDOS)
+        record_property("bytes_por_pedido", round(bytes_por_pedido))
+        # Pedido e fatia com __slots__ (~120 B), total, id e posição na tabela
+        # (~80 B), mais 24 B por item nas colunas. Com @dataclass comum e lista de
+        # ItemCarrinho, o mesmo pedido ocupava ~430 B.
+        assert bytes_por_pedido < 300, f"{bytes_por_pedido:.0f} bytes por pedido com {self.N_PEDIDOS} pedidos"
+
+    def test_itens_colunares_ocupam_menos_que_lista_de_objetos(self, record_property):
+        colunar = _bytes_por_pedido(_pedidos_colunares, 100_000)
+        lista = _bytes_por_pedido(_pedidos_com_lista_de_itens, 100_000)
+        record_property("bytes_por_pedido_colunar", round(colunar))
+        record_property("bytes_por_pedido_lista", round(lista))
+        # A diferença é de ~40 B por item (objeto com slots e posição na lista
+        # contra 24 B nas colunas), então cresce com o tamanho do pedido.
+        assert colunar < lista, f"colunar {colunar:.0f} B/pedido vs lista {lista:.0f} B/pedido"
+
+
+class TestDesempenhoListagemEmPartes:
+    # Listagem completa de 100 mil produtos: corpo inteiro (lista de dicts mais a
+    # string final) contra a codificação em partes direto do snapshot.
+    @staticmethod
+    def _pico_de_memoria(produtos) -> int:
+        tracemalloc.start()
+        try:
+            for _ in json_em_partes(produtos, produto_para_dict):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_pico_de_memoria_nao_cresce_com_o_catalogo(self, catalogo_100k):
+        produtos = catalogo_100k.repository.find_all()
+        pequeno = self._pico_de_memoria(produtos[:10_000])
+        grande = self._pico_de_memoria(produtos)
+        # Memória de uma parte (500 produtos), seja qual for o tamanho do catálogo.
+        assert grande < pequeno * 1.5, f"pico de {grande/1024:.0f} KiB em 100k vs {pequeno/1024:.0f} KiB em 10k"
+
+    @pytest.mark.benchmark(group="listagem-primeiro-byte")
+    @pytest.mark.parametrize("modo", ["corpo-inteiro", "em-partes"])
+    def test_tempo_ate_o_primeiro_byte(self, benchmark, catalogo_100k, modo):
+        produtos = catalogo_100k.repository.find_all()
+        def primeiro_byte():
+            if modo == "corpo-inteiro":
+                return json_compacto([produto_para_dict(p) for p in produtos])[:1]
+            return next(json_em_partes(produtos, produto_para_dict))[:1]
+
+        assert benchmark.pedantic(primeiro_byte, rounds=10) == b"["
+        if modo == "em-partes":
+            # A primeira parte custa 500 produtos, não 100 mil.
+            assert benchmark.stats["mean"] < 0.01
+
+
+class TestDesempenhoStorageDeLimites:
+    # Custo do rate limiting por requisição com 15 mil usuários (um IP cada)
+    # circulando: memory:// conta por processo; bfmmap:// conta para todos os
+    # workers na tabela mapeada em arquivo.
+    N_USUARIOS = 15_000
+
+    @pytest.fixture(params=["memory", "bfmmap"])
+    def limiter(self, request, tmp_path):
+        if request.param == "memory":
+            storage = MemoryStorage()
+        else:
+            storage = MappedSlidingWindowStorage(f"bfmmap://{tmp_path / 'limites.bin'}")
+        yield SlidingWindowCounterRateLimiter(storage)
+        if request.param == "bfmmap":
+            storage.close()
+
+    def _ips(self):
+        return [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(self.N_USUARIOS)]
+
+    @pytest.mark.benchmark(group="limiter-15k-usuarios", min_rounds=10_000)
+    def test_custo_por_requisicao(self, benchmark, limiter):
+        limite = parse("100/minute")
+        ips = itertools.cycle(self._ips())
+
+        def requisicao():
+            return limiter.hit(limite, next(ips), "listar_produtos")
+
+        benchmark(requisicao)
+        # Bem abaixo de 1% do orçamento de 10ms por requisição.
+        assert benchmark.stats["mean"] < 100e-6
+
+    def test_tabela_compartilhada_nao_custa_mais_que_memory(self, tmp_path):
+        limite = parse("100/minute")
+        ips = self._ips()
+        compartilhado = MappedSlidingWindowStorage(f"bfmmap://{tmp_path / 'limites.bin'}")
+        tempos = {}
+        for nome, storage in (("memory", MemoryStorage()), ("bfmmap", compartilhado)):
+            limiter = SlidingWindowCounterRateLimiter(storage)
+            inicio = time.perf_counter()
+            for _ in range(3):
+                for ip in ips:
+                    limiter.hit(limite, ip, "listar_produtos")
+            tempos[nome] = (time.perf_counter() - inicio) / (3 * len(ips))
+        compartilhado.close()
+
+        # Um lock fcntl por partição e uma tabela de tamanho fixo custam o mesmo
+        # que o dict + timer de expiração do MemoryStorage; margem para ruído.
+        assert tempos["bfmmap"] < 2 * tempos["memory"], tempos
@@ -3,14 +3,60 @@ Testes de Escalabilidade — ThreadPoolExecutor
 Meta: eficiência de escalonamento horizontal > 80%.
 
 Simula múltiplos workers (servidores) processando requisições em paralelo.
-O time.sleep(0.001) no service libera o GIL do Python durante a espera de I/O,
-permitindo que threads genuinamente concorrentes demonstrem ganho real de throughput.
+A latência simulada no service (time.sleep de 1ms, via DbLatencySimulator) libera
+o GIL do Python durante a espera de I/O, permitindo que threads genuinamente
+concorrentes demonstrem ganho real de throughput.
 """
 import time
+import statistics
+import threading
 import concurrent.futures
 import pytest
 
+from storage import InMemoryStorage, LockProfiler, ShardedInMemoryStorage
+from repository import ProdutoRepository, PedidoRepository
+from service import ProdutoService, PedidoService
+from latency import ConstantLatency, DbLatencySimulator
+from load_shedding import AdaptiveConcurrencyLimiter, Sobrecarga, TrafficClass
+
 N_REQUESTS = 200
+# Com 8 workers, 200 requisições duram só ~25 lotes de 1ms e qualquer pausa do
+# sistema distorce a eficiência; os testes com 8 workers usam uma janela maior
+# e comparam a mediana de algumas medições intercaladas (1 worker, 8 workers,
+# 1 worker...), para que uma oscilação da máquina afete os dois lados.
+N_REQUESTS_8_WORKERS = 400
+N_MEDICOES = 3
+# Latência simulada nos testes de eficiência do storage particionado. Com 1ms,
+# o custo de CPU de cada requisição (pool de threads, serviço) passa a ser uma
+# fração grande dela e, em máquinas com poucos núcleos, 8 workers esbarram na
+# CPU antes de esbarrar em qualquer lock; com 3ms, o teste mede a concorrência.
+LATENCIA_PARTICIONADO = 0.003
+# Tempo de cada passagem pelo lock do storage nos testes que comparam o lock
+# único com o particionado. A seção crítica real dura microssegundos e, sob o
+# GIL, a diferença entre os dois some no ruído; com uma seção crítica que
+# ocupa o lock de fato (como a manutenção de índices de um catálogo grande),
+# fica visível quanto da carga cada storage serializa.
+SECAO_CRITICA = 0.0005
+
+
+# Todos os InMemoryStorage deste módulo usam o mesmo profiler de locks: com
+# --perfil-de-locks, o resumo final do pytest mostra se o lock único do storage
+# chegou a limitar o throughput (disputas e espera) ou se o gargalo estava em
+# outro lugar.
+_perfil_de_locks = LockProfiler()
+
+
+@pytest.fixture
+def storage():
+    # Substitui a fixture de conftest.py (e com ela produto_repo e produto_service).
+    return InMemoryStorage(lock_profiler=_perfil_de_locks)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def relatorio_de_contencao(relatorios_de_locks):
+    yield
+    if relatorios_de_locks is not None:
+        relatorios_de_locks["contenção no lock do InMemoryStorage"] = _perfil_de_locks.formatar()
 
 
 def _medir_throughput(service, n_workers: int) -> float:
@@ -27,6 +73,78 @@ def _medir_throughput(service, n_workers: int) -> float:
     return N_REQUESTS / duracao
 
 
+def _medir_throughput_leitura(service, ids: list, n_workers: int) -> float:
+    inicio = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(service.buscar_produto, ids[i % len(ids)])
+            for i in range(N_REQUESTS_8_WORKERS)
+        ]
+        concurrent.futures.wait(futures)
+    duracao = time.perf_counter() - inicio
+    return N_REQUESTS_8_WORKERS / duracao
+
+
+def _medianas(*medicoes):
+    # Cada rodada executa todas as medições, em sequência; devolve a mediana de cada uma.
+    rodadas = [[medir() for medir in medicoes] for _ in range(N_MEDICOES)]
+    return [statistics.median(valores) for valores in zip(*rodadas)]
+
+
+def _carga_mista(produto_service, pedido_service, ids: list, n_workers: int) -> float:
+    # Metade das tarefas cria pedidos (escrita nos storages) e a outra metade
+    # lê produtos.
+    inicio = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = []
+        for i in range(N_REQUESTS_8_WORKERS):
+            produto_id = ids[i % len(ids)]
+            if i % 2:
+                futures.append(executor.submit(
+                    pedido_service.criar_pedido,
+                    [{"produto_id": produto_id, "quantidade": 1}],
+                ))
+            else:
+                futures.append(executor.submit(produto_service.buscar_produto, produto_id))
+        concurrent.futures.wait(futures)
+    return N_REQUESTS_8_WORKERS / (time.perf_counter() - inicio)
+
+
+class _LockComSecaoCritica:
+    # Lock retido por SECAO_CRITICA a cada uso. time.sleep libera o GIL: só as
+    # threads que esperam este mesmo lock ficam paradas.
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        time.sleep(SECAO_CRITICA)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def _servicos(criar_storage, secao_critica: bool = False, latencia: float = 0.001):
+    storages = criar_storage(), criar_storage()
+    if secao_critica:
+        for storage in storages:
+            if isinstance(storage, ShardedInMemoryStorage):
+                storage._locks = [_LockComSecaoCritica() for _ in storage._locks]
+            else:
+                storage._lock = _LockComSecaoCritica()
+    produto_repo = ProdutoRepository(storages[0])
+    produto_service = ProdutoService(produto_repo, DbLatencySimulator(ConstantLatency(latencia)))
+    ids = [
+        produto_service.cadastrar_produto(f"Produto {i}", float(i + 1) * 10, 100_000).id
+        for i in range(50)
+    ]
+    pedido_service = PedidoService(
+        produto_repo, PedidoRepository(storages[1]), DbLatencySimulator(ConstantLatency(latencia))
+    )
+    return produto_service, pedido_service, ids
+
+
 class TestEscalabilidade:
     def test_throughput_aumenta_com_4_workers(self, produto_service):
         for i in range(10):
@@ -73,3 +191,220 @@ class TestEscalabilidade:
             f"Degradação detectada: primeira metade {tp_primeiro:.1f} req/s, "
             f"segunda metade {tp_segundo:.1f} req/s"
         )
+
+
+class TestEscalabilidadeStorageParticionado:
+    @staticmethod
+    def _particionado():
+        return ShardedInMemoryStorage(n_shards=16)
+
+    def test_leitura_escala_com_8_workers(self):
+        produto_service, _, ids = _servicos(self._particionado, latencia=LATENCIA_PARTICIONADO)
+
+        throughput_1, throughput_8 = _medianas(
+            lambda: _medir_throughput_leitura(produto_service, ids, n_workers=1),
+            lambda: _medir_throughput_leitura(produto_service, ids, n_workers=8),
+        )
+
+        eficiencia = (throughput_8 / throughput_1) / 8.0
+        assert eficiencia >= 0.80, (
+            f"Eficiência de leitura com 8 workers: {eficiencia:.1%} — abaixo da meta de 80%\n"
+            f"  Throughput 1 worker: {throughput_1:.1f} req/s\n"
+            f"  Throughput 8 workers: {throughput_8:.1f} req/s"
+        )
+
+    def test_leitura_escala_com_escritas_concorrentes(self):
+        # Com shards independentes, as leituras não ficam serializadas atrás
+        # das escritas de pedidos.
+        servicos = _servicos(self._particionado, latencia=LATENCIA_PARTICIONADO)
+
+        throughput_1, throughput_8 = _medianas(
+            lambda: _carga_mista(*servicos, n_workers=1),
+            lambda: _carga_mista(*servicos, n_workers=8),
+        )
+
+        eficiencia = (throughput_8 / throughput_1) / 8.0
+        assert eficiencia >= 0.80, (
+            f"Eficiência da carga mista com 8 workers: {eficiencia:.1%} — abaixo da meta de 80%\n"
+            f"  Throughput 1 worker: {throughput_1:.1f} req/s\n"
+            f"  Throughput 8 workers: {throughput_8:.1f} req/s"
+        )
+
+    def test_particionado_supera_o_lock_unico_sob_disputa(self):
+        # Mesma carga mista com 8 workers sobre o InMemoryStorage (um lock para
+        # o storage inteiro) e sobre o particionado (um lock por shard), com a
+        # mesma seção crítica nos dois. No lock único, toda passagem pelo
+        # storage espera a anterior; nos shards, só as que caem no mesmo shard.
+        lock_unico = _servicos(InMemoryStorage, secao_critica=True)
+        particionado = _servicos(self._particionado, secao_critica=True)
+
+        throughput_lock_unico, throughput_particionado = _medianas(
+            lambda: _carga_mista(*lock_unico, n_workers=8),
+            lambda: _carga_mista(*particionado, n_workers=8),
+        )
+
+        assert throughput_particionado >= throughput_lock_unico * 1.5, (
+            f"Storage particionado ({throughput_particionado:.1f} req/s) não supera em 1.5x "
+            f"o lock único ({throughput_lock_unico:.1f} req/s) com 8 workers"
+        )
+
+
+class TestEscalabilidadePoolDeConexoes:
+    def test_pool_de_conexoes_limita_o_ganho_com_workers(self, produto_repo):
+        # Com um pool de 2 conexões, 8 workers disputam 2 conexões: o throughput
+        # satura perto de 2x o de 1 worker, não 8x. É o gargalo que um cache na
+        # frente do serviço (ou um pool maior) precisa resolver.
+        produto_service = ProdutoService(produto_repo, DbLatencySimulator(pool_size=2))
+        for i in range(10):
+            produto_service.cadastrar_produto(f"Produto {i}", float(i + 1) * 10, 100)
+
+        throughput_1 = _medir_throughput(produto_service, n_workers=1)
+        throughput_8 = _medir_throughput(produto_service, n_workers=8)
+
+        ganho = throughput_8 / throughput_1
+        assert 1.5 <= ganho <= 2.5, (
+            f"Ganho de {ganho:.1f}x com 8 workers e pool de 2 conexões — esperado ~2x"
+        )
+
+
+def _sobrecarregar(service, produto_id: int, limitador, duracao: float = 1.5, n_clientes: int = 64):
+    """Latências das requisições atendidas, recusas e throughput com n_clientes sem think time."""
+    latencias, recusas = [], [0]
+    fim = time.perf_counter() + duracao
+
+    def cliente(_):
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            if limitador is None:
+                service.buscar_produto(produto_id)
+            else:
+                try:
+                    admitida_em = limitador.acquire()
+                except Sobrecarga:
+                    recusas[0] += 1
+                    # Cliente respeitando o 503: pausa antes de tentar de novo.
+                    time.sleep(0.01)
+                    continue
+                try:
+                    service.buscar_produto(produto_id)
+                finally:
+                    limitador.release(admitida_em)
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_clientes) as executor:
+        list(executor.map(cliente, range(n_clientes)))
+    return latencias, recusas[0], len(latencias) / (time.perf_counter() - inicio)
+
+
+class TestLoadShedding:
+    def test_p99_fica_limitado_sob_sobrecarga(self):
+        # "Banco" com 4 conexões de 5ms (~800 req/s) e 64 clientes sem think
+        # time: sem proteção, a fila do pool cresce e o P99 vai a segundos.
+        service = ProdutoService(
+            ProdutoRepository(InMemoryStorage(lock_profiler=_perfil_de_locks)),
+            DbLatencySimulator(ConstantLatency(0.005), pool_size=4),
+        )
+        produto = service.cadastrar_produto("Produto sob carga", 10.0, 100)
+        latency_target, max_queue_delay = 0.02, 0.01
+
+        sem_protecao, _, throughput_sem = _sobrecarregar(service, produto.id, None)
+        limitador = AdaptiveConcurrencyLimiter(
+            initial_limit=32, latency_target=latency_target, max_queue_delay=max_queue_delay
+        )
+        com_protecao, recusas, throughput_com = _sobrecarregar(service, produto.id, limitador)
+
+        p99_sem = statistics.quantiles(sem_protecao, n=100)[98]
+        p99_com = statistics.quantiles(com_protecao, n=100)[98]
+        assert recusas > 0
+        # Alvo de latência + espera máxima na fila, com folga para o escalonador
+        # de 64 threads numa máquina pequena.
+        assert p99_com < 5 * (latency_target + max_queue_delay), (
+            f"P99 com load shedding: {p99_com * 1000:.0f}ms (sem: {p99_sem * 1000:.0f}ms)"
+        )
+        assert p99_com < p99_sem
+        # Recusar o excesso não pode custar a capacidade do servidor.
+        assert throughput_com >= 0.7 * throughput_sem, (
+            f"Throughput com load shedding: {throughput_com:.0f} req/s (sem: {throughput_sem:.0f} req/s)"
+        )
+
+
+def _pico_misto(operacoes: dict, clientes: dict, limitador, duracao: float = 1.5):
+    """Latências e recusas por classe com vários tipos de cliente disputando o mesmo limitador."""
+    latencias = {classe: [] for classe in operacoes}
+    recusas = {classe: 0 for classe in operacoes}
+    fim = time.perf_counter() + duracao
+
+    def cliente(classe):
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            try:
+                admitida_em = limitador.acquire(classe)
+            except Sobrecarga:
+                recusas[classe] += 1
+                time.sleep(0.01)
+                continue
+            try:
+                operacoes[classe]()
+            finally:
+                limitador.release(admitida_em, classe)
+            latencias[classe].append(time.perf_counter() - inicio)
+            # Quem compra pensa antes do próximo pedido; quem navega, não.
+            if classe == "checkout":
+                time.sleep(0.01)
+
+    tipos = [classe for classe, n in clientes.items() for _ in range(n)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(tipos)) as executor:
+        list(executor.map(cliente, tipos))
+    return latencias, recusas
+
+
+class TestFilasPorPrioridade:
+    def test_checkout_mantem_o_slo_enquanto_o_catalogo_absorve_as_recusas(self):
+        # 64 clientes navegando sem pausa saturam o "banco" (4 conexões de 5ms);
+        # 8 compradores disputam as mesmas conexões.
+        latencia = DbLatencySimulator(ConstantLatency(0.005), pool_size=4)
+        produto_repo = ProdutoRepository(InMemoryStorage(lock_profiler=_perfil_de_locks))
+        produto_service = ProdutoService(produto_repo, latencia)
+        pedido_repo = PedidoRepository(InMemoryStorage(lock_profiler=_perfil_de_locks))
+        pedido_service = PedidoService(produto_repo, pedido_repo, latencia)
+        produto = produto_service.cadastrar_produto("Produto sob carga", 10.0, 10**9)
+        operacoes = {
+            "catalogo": lambda: produto_service.buscar_produto(produto.id),
+            "checkout": lambda: pedido_service.criar_pedido([{"produto_id": produto.id, "quantidade": 1}]),
+        }
+        clientes = {"catalogo": 64, "checkout": 8}
+        latency_target, max_queue_delay = 0.02, 0.01
+
+        def limitador(classes):
+            return AdaptiveConcurrencyLimiter(
+                initial_limit=32, latency_target=latency_target, max_queue_delay=max_queue_delay, classes=classes
+            )
+
+        # Mesma configuração de api_comum.criar_limitador_de_concorrencia.
+        com_prioridade = limitador((
+            TrafficClass("checkout", priority=1, share=1.0, max_queue=256),
+            TrafficClass("catalogo", priority=0, share=0.7, max_queue=128, max_queue_delay=max_queue_delay / 2),
+        ))
+        latencias, recusas = _pico_misto(operacoes, clientes, com_prioridade)
+        # Referência: as mesmas filas sem prioridade nem fatias.
+        _, recusas_sem_prioridade = _pico_misto(
+            operacoes, clientes, limitador((TrafficClass("checkout"), TrafficClass("catalogo")))
+        )
+
+        def taxa_de_recusa(atendidas, recusadas):
+            return recusadas / (atendidas + recusadas)
+
+        recusa_checkout = taxa_de_recusa(len(latencias["checkout"]), recusas["checkout"])
+        recusa_catalogo = taxa_de_recusa(len(latencias["catalogo"]), recusas["catalogo"])
+        p99_checkout = statistics.quantiles(latencias["checkout"], n=100)[98]
+
+        assert recusa_checkout < 0.05, f"{recusa_checkout:.1%} dos pedidos recusados"
+        assert recusa_catalogo > 0.5, f"catálogo com só {recusa_catalogo:.1%} de recusas: o servidor não saturou"
+        assert recusas["checkout"] < recusas_sem_prioridade["checkout"] / 10, (
+            f"Pedidos recusados: {recusas['checkout']} com prioridade, "
+            f"{recusas_sem_prioridade['checkout']} sem"
+        )
+        assert p99_checkout < 5 * (latency_target + max_queue_delay), (
+            f"P99 do checkout sob pico: {p99_checkout * 1000:.0f}ms"
+        )
@@ -7,6 +7,14 @@ O Flask-Limiter com storage_uri="memory://" mantém o estado de rate limiting en
 chamadas dentro do mesmo test client, simulando requisições do mesmo IP.
 """
 import pytest
+from flask import Flask
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits import parse
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+import limiter_storage
+from limiter_storage import MappedSlidingWindowStorage
 
 
 class TestRateLimitingSaude:
@@ -78,3 +86,89 @@ class TestIsolamentoDeLimites:
         assert resp.status_code == 200, (
             "O endpoint /saude foi bloqueado indevidamente após atingir o limite de /produtos"
         )
+
+
+@pytest.fixture
+def limites_compartilhados(tmp_path):
+    storage = MappedSlidingWindowStorage(f"bfmmap://{tmp_path / 'limites.bin'}", partitions=4, slots_per_partition=64)
+    yield storage
+    storage.close()
+
+
+class TestStorageDeLimitesCompartilhado:
+    def test_app_com_bfmmap_retorna_429_com_retry_after(self, tmp_path):
+        app = Flask(__name__)
+        limiter = Limiter(
+            get_remote_address,
+            app=app,
+            storage_uri=f"bfmmap://{tmp_path / 'limites.bin'}",
+            strategy="sliding-window-counter",
+            headers_enabled=True,
+        )
+
+        @app.route("/recurso")
+        @limiter.limit("5 per minute")
+        def recurso():
+            return "ok"
+
+        cliente = app.test_client()
+        codigos = [cliente.get("/recurso").status_code for _ in range(7)]
+        assert codigos == [200] * 5 + [429] * 2
+        resp = cliente.get("/recurso")
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert resp.headers["X-RateLimit-Remaining"] == "0"
+
+    def test_dois_workers_no_mesmo_arquivo_compartilham_a_contagem(self, tmp_path, limites_compartilhados):
+        outro_worker = MappedSlidingWindowStorage(f"bfmmap://{tmp_path / 'limites.bin'}")
+        limite = parse("10/minute")
+        primeiro = SlidingWindowCounterRateLimiter(limites_compartilhados)
+        segundo = SlidingWindowCounterRateLimiter(outro_worker)
+
+        aceitas = [primeiro.hit(limite, "1.2.3.4") for _ in range(6)]
+        aceitas += [segundo.hit(limite, "1.2.3.4") for _ in range(6)]
+
+        assert sum(aceitas) == 10
+        assert segundo.get_window_stats(limite, "1.2.3.4").remaining == 0
+        assert primeiro.hit(limite, "5.6.7.8")
+        outro_worker.close()
+
+    def test_janela_anterior_pesa_proporcionalmente(self, limites_compartilhados, monkeypatch):
+        agora = [6000.0]  # início exato de uma janela de 60s
+        monkeypatch.setattr(limiter_storage.time, "time", lambda: agora[0])
+        limite = parse("100/minute")
+        limiter = SlidingWindowCounterRateLimiter(limites_compartilhados)
+
+        assert sum(limiter.hit(limite, "ip") for _ in range(120)) == 100
+        # 15s depois da virada, 3/4 da janela anterior ainda contam: 75 ocupadas.
+        agora[0] = 6075.0
+        assert sum(limiter.hit(limite, "ip") for _ in range(100)) == 25
+        # Duas janelas depois, nada da contagem antiga sobra.
+        agora[0] = 6180.0
+        assert sum(limiter.hit(limite, "ip") for _ in range(120)) == 100
+
+    def test_tabela_cheia_reaproveita_slots_expirados(self, limites_compartilhados, monkeypatch):
+        agora = [6000.0]
+        monkeypatch.setattr(limiter_storage.time, "time", lambda: agora[0])
+        limite = parse("1/minute")
+        limiter = SlidingWindowCounterRateLimiter(limites_compartilhados)
+        capacidade = 4 * 64
+
+        for i in range(capacidade):
+            limiter.hit(limite, f"ip-{i}")
+        assert limites_compartilhados.tabela_cheia > 0
+
+        # Duas janelas depois, os slots antigos voltam a servir a novas chaves.
+        agora[0] = 6120.0
+        assert all(limiter.hit(limite, f"novo-{i}") for i in range(capacidade // 2))
+        assert limites_compartilhados.reaproveitados > 0
+        assert not limiter.hit(limite, "novo-0")
+
+    def test_reset_zera_as_contagens(self, limites_compartilhados):
+        limite = parse("2/minute")
+        limiter = SlidingWindowCounterRateLimiter(limites_compartilhados)
+        limiter.hit(limite, "ip")
+        limiter.hit(limite, "ip")
+        assert not limiter.hit(limite, "ip")
+
+        assert limites_compartilhados.reset() == 1
+        assert limiter.hit(limite, "ip")
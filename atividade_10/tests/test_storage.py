@@ -0,0 +1,508 @@
+"""
+Testes de Contrato dos Storages
+
+Todos os backends (memória, memória particionada, SQLite e catálogo em memória
+compartilhada) devem ser
+intercambiáveis atrás dos repositórios, então o mesmo conjunto de testes roda
+contra cada um deles.
+"""
+import concurrent.futures
+import itertools
+import pickle
+import threading
+import time
+import uuid
+
+import pytest
+
+from indexes import PrefixIndex
+from journal import OrderJournal
+from models import ItemCarrinho, ItensPedido, Pedido, Produto, StatusPedido, TabelaDeItens
+import shared_catalog
+from shared_catalog import SharedMemoryCatalog
+from storage import InMemoryStorage, LockProfiler, ShardedInMemoryStorage, SQLiteStorage
+from repository import ProdutoRepository, PedidoRepository
+from service import ProdutoService, PedidoService
+
+
+def _catalogo_compartilhado(capacity: int = 1000, **kwargs) -> SharedMemoryCatalog:
+    # Nome único por teste: o bloco é global na máquina, como o de um deploy real.
+    return SharedMemoryCatalog(f"bfshop_teste_{uuid.uuid4().hex[:12]}", capacity=capacity, **kwargs)
+
+
+def _descartar(catalogo: SharedMemoryCatalog) -> None:
+    catalogo.close()
+    catalogo.unlink()
+
+
+@pytest.fixture(params=["memoria", "memoria_perfilada", "particionado", "sqlite", "shm"])
+def backend(request, tmp_path):
+    if request.param == "memoria":
+        yield InMemoryStorage()
+    elif request.param == "memoria_perfilada":
+        yield InMemoryStorage(lock_profiler=LockProfiler())
+    elif request.param == "particionado":
+        yield ShardedInMemoryStorage(n_shards=4)
+    elif request.param == "sqlite":
+        storage = SQLiteStorage(str(tmp_path / "bfshop.db"), "produtos")
+        yield storage
+        storage.close()
+    else:
+        catalogo = _catalogo_compartilhado()
+        yield catalogo
+        _descartar(catalogo)
+
+
+def _produto(id: int) -> Produto:
+    return Produto(nome=f"Produto {id}", preco=10.0 * id, estoque=id, id=id)
+
+
+class TestContratoStorage:
+    def test_add_get_delete(self, backend):
+        backend.add(1, _produto(1))
+        assert backend.get(1) == _produto(1)
+        assert backend.get(2) is None
+        assert backend.delete(1) is True
+        assert backend.delete(1) is False
+        assert backend.get(1) is None
+
+    def test_get_all_get_many_e_max_id(self, backend):
+        assert backend.max_id() is None
+        for id in (3, 1, 2):
+            backend.add(id, _produto(id))
+        assert sorted(p.id for p in backend.get_all()) == [1, 2, 3]
+        assert [p.id for p in backend.get_many([3, 99, 1])] == [3, 1]
+        assert backend.max_id() == 3
+
+    def test_get_page_em_ordem_de_id(self, backend):
+        for id in range(1, 11):
+            backend.add(id, _produto(id))
+        assert [p.id for p in backend.get_page(None, 4)] == [1, 2, 3, 4]
+        assert [p.id for p in backend.get_page(8, 4)] == [9, 10]
+
+    def test_versao_avanca_a_cada_escrita(self, backend):
+        versoes = [backend.version]
+        backend.add(1, _produto(1))
+        versoes.append(backend.version)
+        backend.add(1, _produto(1))
+        versoes.append(backend.version)
+        backend.delete(1)
+        versoes.append(backend.version)
+        backend.clear()
+        versoes.append(backend.version)
+        assert versoes == sorted(set(versoes))
+        assert backend.get_all() in ([], ())
+
+    def test_item_lock_e_reentrante_entre_usos(self, backend):
+        with backend.item_lock(1):
+            pass
+        with backend.item_lock(1):
+            pass
+
+
+class TestLocksPorItem:
+    def test_locks_de_pedidos_finalizados_sao_descartados(self, produto_service):
+        # Um lock por pedido confirmado ou cancelado, guardado para sempre,
+        # cresceria com o histórico de pedidos.
+        produto_service.cadastrar_produto("Produto", 10.0, 1000)
+        pedido_storage = InMemoryStorage()
+        pedidos = PedidoService(produto_service.repository, PedidoRepository(pedido_storage))
+        for _ in range(200):
+            pedido = pedidos.criar_pedido([{"produto_id": 1, "quantidade": 1}])
+            pedidos.confirmar_pedido(pedido.id)
+            pedidos.cancelar_pedido(pedido.id)
+
+        assert len(pedido_storage._item_locks) == 0
+        assert len(produto_service.repository.storage._item_locks) == 0
+
+    def test_exclusao_mutua_e_espera_com_timeout(self):
+        storage = InMemoryStorage()
+        dentro, maximo = [0], [0]
+
+        def incrementar():
+            for _ in range(200):
+                with storage.item_lock(7):
+                    dentro[0] += 1
+                    maximo[0] = max(maximo[0], dentro[0])
+                    dentro[0] -= 1
+
+        threads = [threading.Thread(target=incrementar) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert maximo[0] == 1
+        with storage.item_lock(7):
+            assert not storage.item_lock(7).acquire(timeout=0.01)
+        assert len(storage._item_locks) == 0
+
+
+class TestProfilerDeLocks:
+    def test_estatisticas_por_operacao(self):
+        # Relógio que avança 1s a cada leitura: sem disputa, cada operação lê o
+        # relógio duas vezes ao entrar e uma ao sair, e retém o lock por 1s.
+        relogio = itertools.count()
+        profiler = LockProfiler(clock=lambda: float(next(relogio)))
+        storage = InMemoryStorage(lock_profiler=profiler)
+        for id in range(3):
+            storage.add(id, _produto(id + 1))
+        storage.get(1)
+        storage.get_all()
+        storage.delete(2)
+
+        operacoes = profiler.relatorio()["operacoes"]
+        assert {nome: op["aquisicoes"] for nome, op in operacoes.items()} == {
+            "add": 3, "get": 1, "get_all": 1, "delete": 1,
+        }
+        assert operacoes["add"]["retencao_total_s"] == 3.0
+        assert operacoes["add"]["retencao_media_us"] == 1e6
+        assert all(op["disputas"] == 0 for op in operacoes.values())
+        # O lock continua contando para /metrics.
+        assert storage.estatisticas_de_lock()["aquisicoes"] == 6
+
+    def test_disputa_e_atribuida_a_operacao_que_esperou(self):
+        profiler = LockProfiler()
+        storage = InMemoryStorage(lock_profiler=profiler)
+        leitura = threading.Thread(target=storage.get, args=(1,))
+        with storage._lock:
+            leitura.start()
+            time.sleep(0.05)
+        leitura.join()
+
+        operacoes = profiler.relatorio()["operacoes"]
+        assert operacoes["get"]["disputas"] == 1
+        assert operacoes["get"]["espera_maxima_us"] >= 40_000
+        # O with do teste também é uma operação, com o nome de quem pegou o lock.
+        assert operacoes["test_disputa_e_atribuida_a_operacao_que_esperou"]["retencao_total_s"] >= 0.04
+        assert list(operacoes)[0] == "get"  # quem mais esperou vem primeiro
+
+    def test_soma_os_storages_do_mesmo_profiler(self):
+        profiler = LockProfiler()
+        produtos, pedidos = InMemoryStorage(lock_profiler=profiler), InMemoryStorage(lock_profiler=profiler)
+        produtos.add(1, "a")
+        pedidos.add(1, "b")
+        relatorio = profiler.relatorio()
+        assert relatorio["storages"] == 2
+        assert relatorio["operacoes"]["add"]["aquisicoes"] == 2
+        assert "add" in profiler.formatar()
+
+
+class TestSQLiteDuravel:
+    def test_pedidos_e_estoque_sobrevivem_ao_restart(self, tmp_path):
+        caminho = str(tmp_path / "bfshop.db")
+
+        def abrir():
+            produtos = SQLiteStorage(caminho, "produtos")
+            pedidos = SQLiteStorage(caminho, "pedidos")
+            produto_repo = ProdutoRepository(produtos)
+            servicos = (ProdutoService(produto_repo), PedidoService(produto_repo, PedidoRepository(pedidos)))
+            return (produtos, pedidos), servicos
+
+        storages, (produto_service, pedido_service) = abrir()
+        produto = produto_service.cadastrar_produto("Smart TV 4K", 3500.0, 10)
+        pedido = pedido_service.criar_pedido([{"produto_id": produto.id, "quantidade": 3}])
+        for s in storages:
+            s.close()
+
+        storages, (produto_service, pedido_service) = abrir()
+        assert produto_service.buscar_produto(produto.id).estoque == 7
+        assert pedido_service.pedido_repo.find_by_id(pedido.id).total == 3 * 3500.0
+        # O contador de ids continua de onde parou, sem sobrescrever o pedido antigo.
+        novo = pedido_service.criar_pedido([{"produto_id": produto.id, "quantidade": 1}])
+        assert novo.id == pedido.id + 1
+        for s in storages:
+            s.close()
+
+    def test_workers_no_mesmo_arquivo_nao_repetem_ids(self, tmp_path):
+        # Cada worker abre o seu repositório sobre o mesmo arquivo: o id de um
+        # pedido novo vem do banco, não de um contador por processo.
+        caminho = str(tmp_path / "bfshop.db")
+        repos = [PedidoRepository(SQLiteStorage(caminho, "pedidos")) for _ in range(2)]
+
+        pedidos = [repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0)) for repo in repos]
+
+        assert [p.id for p in pedidos] == [1, 2]
+        assert [p.id for p in repos[0].find_all()] == [1, 2]
+        for repo in repos:
+            repo.storage.close()
+
+
+class TestCatalogoEmMemoriaCompartilhada:
+    def test_segunda_instancia_enxerga_o_mesmo_catalogo(self):
+        # Cada worker do gunicorn abre o bloco pelo nome; a escrita de um é
+        # visível para o outro sem nenhuma sincronização adicional.
+        catalogo = _catalogo_compartilhado()
+        outro_worker = SharedMemoryCatalog(catalogo.name)
+        try:
+            catalogo.add(1, _produto(1))
+            assert outro_worker.get(1) == _produto(1)
+            outro_worker.add(1, Produto(nome="Produto 1", preco=10.0, estoque=0, id=1))
+            assert catalogo.get(1).estoque == 0
+            assert catalogo.version == outro_worker.version
+        finally:
+            outro_worker.close()
+            _descartar(catalogo)
+
+    def test_baixa_de_estoque_nao_cresce_a_tabela_de_nomes(self):
+        # Espaço para um único nome: regravar o mesmo produto a cada pedido não
+        # pode consumir a tabela de strings.
+        catalogo = _catalogo_compartilhado(names_size=len("Produto 1"))
+        try:
+            for estoque in range(100):
+                catalogo.add(1, Produto(nome="Produto 1", preco=10.0, estoque=estoque, id=1))
+            assert catalogo.get(1).estoque == 99
+            with pytest.raises(ValueError, match="cheia"):
+                catalogo.add(2, _produto(2))
+        finally:
+            _descartar(catalogo)
+
+    def test_workers_nao_repetem_ids_de_produtos_novos(self):
+        catalogo = _catalogo_compartilhado()
+        outro_worker = SharedMemoryCatalog(catalogo.name)
+        try:
+            repos = [ProdutoRepository(catalogo), ProdutoRepository(outro_worker)]
+            produtos = [repo.save(Produto(nome="Produto", preco=10.0, estoque=1)) for repo in repos]
+            assert [p.id for p in produtos] == [1, 2]
+            assert [p.id for p in catalogo.get_all()] == [1, 2]
+        finally:
+            outro_worker.close()
+            _descartar(catalogo)
+
+    def test_escrita_interrompida_e_reparada_pelo_leitor(self):
+        # Um worker que morre entre as duas metades de _escrever deixa o
+        # contador de sequência ímpar: a leitura não pode girar para sempre.
+        catalogo = _catalogo_compartilhado()
+        try:
+            catalogo.add(1, _produto(1))
+            offset = catalogo._offset(1)
+            seq = shared_catalog._QWORD.unpack_from(catalogo._buf, offset)[0]
+            shared_catalog._QWORD.pack_into(catalogo._buf, offset, seq + 1)
+
+            assert catalogo.get(1) == _produto(1)
+            assert shared_catalog._QWORD.unpack_from(catalogo._buf, offset)[0] == seq + 2
+        finally:
+            _descartar(catalogo)
+
+    def test_leitura_falha_se_o_escritor_nao_solta_o_lock(self, monkeypatch):
+        monkeypatch.setattr(shared_catalog, "_ESPERA_MAXIMA_DE_LEITURA", 0.05)
+        catalogo = _catalogo_compartilhado()
+        escrevendo, terminar = threading.Event(), threading.Event()
+
+        def escritor_travado():
+            with catalogo._locks.get(shared_catalog._LOCK_DE_ESCRITA):
+                offset = catalogo._offset(1)
+                seq = shared_catalog._QWORD.unpack_from(catalogo._buf, offset)[0]
+                shared_catalog._QWORD.pack_into(catalogo._buf, offset, seq + 1)
+                escrevendo.set()
+                terminar.wait(5)
+
+        try:
+            catalogo.add(1, _produto(1))
+            escritor = threading.Thread(target=escritor_travado)
+            escritor.start()
+            escrevendo.wait(5)
+            with pytest.raises(TimeoutError):
+                catalogo.get(1)
+            terminar.set()
+            escritor.join()
+        finally:
+            terminar.set()
+            _descartar(catalogo)
+
+    def test_id_fora_da_capacidade(self):
+        catalogo = _catalogo_compartilhado(capacity=10)
+        try:
+            assert catalogo.get(11) is None
+            with pytest.raises(ValueError, match="capacidade"):
+                catalogo.add(11, _produto(11))
+        finally:
+            _descartar(catalogo)
+
+
+class TestJournalDePedidos:
+    def _pedido(self, quantidade: int = 1) -> Pedido:
+        return Pedido(itens=[ItemCarrinho(7, quantidade, 25.0)], total=25.0 * quantidade)
+
+    def test_replay_reconstroi_pedidos_e_contador_de_ids(self, tmp_path):
+        caminho = str(tmp_path / "pedidos.log")
+        journal = OrderJournal(caminho)
+        repo = PedidoRepository(journal=journal)
+        primeiro = repo.save(self._pedido(1))
+        segundo = repo.save(self._pedido(2))
+        # Regravar o mesmo pedido acrescenta um registro; no replay vale o último.
+        segundo.status = StatusPedido.CONFIRMADO
+        repo.save(segundo)
+        journal.close()
+
+        journal = OrderJournal(caminho)
+        repo = PedidoRepository(journal=journal)
+        assert repo.find_by_id(primeiro.id) == primeiro
+        assert repo.find_by_id(segundo.id).status == StatusPedido.CONFIRMADO
+        assert repo.save(self._pedido()).id == segundo.id + 1
+        journal.close()
+
+    def test_registro_incompleto_de_uma_queda_e_descartado(self, tmp_path):
+        caminho = str(tmp_path / "pedidos.log")
+        journal = OrderJournal(caminho)
+        PedidoRepository(journal=journal).save(self._pedido())
+        journal.close()
+        with open(caminho, "ab") as arquivo:
+            arquivo.write(b'{"id":2,"total":25.0,"sta')
+
+        journal = OrderJournal(caminho)
+        repo = PedidoRepository(journal=journal)
+        assert [p.id for p in repo.find_all()] == [1]
+        repo.save(self._pedido())
+        journal.close()
+
+        journal = OrderJournal(caminho)
+        assert [p.id for p in journal.replay()] == [1, 2]
+        journal.close()
+
+    def test_lote_de_pedidos_usa_um_unico_fsync(self, tmp_path):
+        journal = OrderJournal(str(tmp_path / "pedidos.log"), batch_window=0)
+        repo = PedidoRepository(journal=journal)
+        repo.save_many([self._pedido() for _ in range(100)])
+        assert journal.lotes_gravados == 1
+        journal.close()
+
+
+class TestIndicesSecundarios:
+    # Roda sobre todos os backends: o InMemoryStorage responde pelos índices e os
+    # demais pela varredura de find_all; os resultados precisam ser os mesmos.
+    @pytest.fixture
+    def produto_repo(self, backend):
+        repo = ProdutoRepository(backend)
+        for nome, preco in [
+            ("Smart TV 4K", 3500.0),
+            ("Smart Watch", 900.0),
+            ("Fone Bluetooth", 150.0),
+            ("Café Especial", 45.0),
+            ("TV Box", 300.0),
+        ]:
+            repo.save(Produto(nome=nome, preco=preco, estoque=10))
+        return repo
+
+    def test_faixa_de_preco(self, produto_repo):
+        assert [p.nome for p in produto_repo.find_by_price_range(100.0, 900.0)] == [
+            "Fone Bluetooth", "TV Box", "Smart Watch",
+        ]
+        assert [p.preco for p in produto_repo.find_by_price_range(maximo=150.0)] == [45.0, 150.0]
+        assert produto_repo.find_by_price_range(5000.0) == []
+
+    def test_busca_por_prefixo_de_palavra(self, produto_repo):
+        assert [p.nome for p in produto_repo.search_by_name("tv")] == ["Smart TV 4K", "TV Box"]
+        assert [p.nome for p in produto_repo.search_by_name("SMART t")] == ["Smart TV 4K"]
+        # Sem diferenciar acentos, nos dois sentidos.
+        assert [p.nome for p in produto_repo.search_by_name("cafe")] == ["Café Especial"]
+        assert [p.nome for p in produto_repo.search_by_name("espécial")] == ["Café Especial"]
+        assert produto_repo.search_by_name("tablet") == []
+        assert produto_repo.search_by_name("  ") == []
+
+    def test_indices_acompanham_alteracao_no_lugar_e_delete(self, produto_repo):
+        tv = produto_repo.search_by_name("tv box")[0]
+        tv.nome = "Receptor Digital"
+        tv.preco = 10.0
+        produto_repo.save(tv)
+        assert [p.nome for p in produto_repo.search_by_name("tv")] == ["Smart TV 4K"]
+        assert produto_repo.search_by_name("receptor")[0].id == tv.id
+        assert produto_repo.find_by_price_range(maximo=10.0)[0].id == tv.id
+
+        produto_repo.delete(tv.id)
+        assert produto_repo.search_by_name("receptor") == []
+        assert produto_repo.find_by_price_range(maximo=10.0) == []
+
+    def test_pedidos_por_status_acompanham_mudanca_de_status(self):
+        storage = InMemoryStorage()
+        repo = PedidoRepository(storage)
+        pedidos = [repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0)) for _ in range(4)]
+        pedidos[1].status = StatusPedido.CONFIRMADO
+        repo.save(pedidos[1])
+
+        assert [p.id for p in repo.find_by_status(StatusPedido.AGUARDANDO)] == [1, 3, 4]
+        assert [p.id for p in repo.find_by_status(StatusPedido.CONFIRMADO)] == [2]
+        assert repo.find_by_status(StatusPedido.CANCELADO) == []
+        assert "status" in storage.indexes
+
+    def test_pedidos_por_status_paginados_por_cursor(self):
+        repo = PedidoRepository(InMemoryStorage())
+        pedidos = [repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0)) for _ in range(10)]
+        for pedido in pedidos[::3]:
+            pedido.status = StatusPedido.CONFIRMADO
+            repo.save(pedido)
+
+        aguardando = StatusPedido.AGUARDANDO
+        assert [p.id for p in repo.find_by_status(aguardando, limit=3)] == [2, 3, 5]
+        assert [p.id for p in repo.find_by_status(aguardando, after_id=5, limit=3)] == [6, 8, 9]
+        assert [p.id for p in repo.find_by_status(aguardando, after_id=9)] == []
+
+    def test_indice_de_status_igual_a_varredura_apos_mudancas_e_deletes(self):
+        # Remoções do índice são preguiçosas (ver HashIndex): depois de muitas
+        # idas e vindas entre status e de deletes, o resultado continua exato.
+        storage = InMemoryStorage()
+        repo = PedidoRepository(storage)
+        pedidos = [repo.save(Pedido(itens=[ItemCarrinho(1, 1, 10.0)], total=10.0)) for _ in range(200)]
+        status = list(StatusPedido)
+        for i in range(2000):
+            pedido = pedidos[(i * 7919) % len(pedidos)]
+            if i % 97 == 0:
+                storage.delete(pedido.id)
+                continue
+            pedido.status = status[(i * 31) % len(status)]
+            repo.save(pedido)
+
+        for s in status:
+            esperado = sorted(p.id for p in storage.get_all() if p.status == s)
+            assert [p.id for p in repo.find_by_status(s)] == esperado
+            assert [p.id for p in repo.find_by_status(s, after_id=100, limit=5)] == [
+                id for id in esperado if id > 100
+            ][:5]
+
+    def test_indice_declarado_depois_indexa_itens_existentes(self):
+        storage = InMemoryStorage()
+        storage.add(1, _produto(1))
+        storage.add_index("nome", PrefixIndex(lambda p: p.nome))
+        storage.add(2, _produto(2))
+        assert [p.id for p in storage.lookup("nome", "produto")] == [1, 2]
+
+
+class TestItensColunares:
+    def test_pedido_gravado_guarda_itens_na_tabela_colunar(self):
+        repo = PedidoRepository()
+        itens = [ItemCarrinho(1, 2, 10.0), ItemCarrinho(5, 1, 99.9)]
+        pedido = repo.save(Pedido(itens=list(itens), total=119.9))
+
+        assert isinstance(pedido.itens, ItensPedido)
+        assert list(pedido.itens) == itens
+        assert pedido.itens == itens and pedido.itens[-1] == itens[1] and pedido.itens[:1] == itens[:1]
+        assert pedido == Pedido(itens=itens, total=119.9, id=pedido.id)
+        # pickle (SQLiteStorage) leva só os itens do pedido, como lista.
+        assert pickle.loads(pickle.dumps(pedido)).itens == itens
+
+    def test_storage_serializado_nao_acumula_itens_no_processo(self, tmp_path):
+        # SQLite devolve cópias com itens em lista: cada regravação (mudança de
+        # status) acrescentaria os itens de novo a uma tabela que nunca é lida.
+        repo = PedidoRepository(SQLiteStorage(str(tmp_path / "bfshop.db"), "pedidos"))
+        pedido = repo.save(Pedido(itens=[ItemCarrinho(1, 2, 10.0)], total=20.0))
+        for status in (StatusPedido.CONFIRMADO, StatusPedido.CANCELADO):
+            copia = repo.find_by_id(pedido.id)
+            copia.status = status
+            repo.save(copia)
+
+        assert repo._itens is None
+        assert list(repo.find_by_id(pedido.id).itens) == [ItemCarrinho(1, 2, 10.0)]
+        repo.storage.close()
+
+    def test_pedidos_gravados_em_paralelo_nao_misturam_itens(self):
+        tabela = TabelaDeItens()
+
+        def adicionar(n):
+            return n, tabela.adicionar(ItemCarrinho(n, n, float(n)) for _ in range(n % 7 + 1))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            fatias = list(executor.map(adicionar, range(2000)))
+
+        for n, itens in fatias:
+            assert list(itens) == [ItemCarrinho(n, n, float(n))] * (n % 7 + 1)
+        assert len(tabela) == sum(len(itens) for _, itens in fatias)